@@ -0,0 +1,98 @@
+"""
+Local verification of Supabase access tokens.
+
+Supabase signs access tokens either with the project's shared JWT secret
+(HS256) or with an asymmetric key published at the project's JWKS endpoint
+(RS256/ES256). Both are verified here without calling the Supabase API;
+the JWKS document is cached and refreshed by PyJWKClient.
+"""
+from __future__ import annotations
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import jwt
+
+from ..config import settings
+
+
+class InvalidToken(Exception):
+    """Signature, expiry or audience check failed — the token must be rejected."""
+
+
+class VerificationUnavailable(Exception):
+    """No key material to check this token locally (no secret, JWKS unreachable)."""
+
+
+@dataclass(frozen=True)
+class TokenClaims:
+    sub: str
+    email: Optional[str]
+    role: str
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "TokenClaims":
+        meta = payload.get("user_metadata") or {}
+        role = meta.get("role", "STUDENT")
+        if role not in {"PROF", "STUDENT"}:
+            role = "STUDENT"
+        return cls(sub=str(payload["sub"]), email=payload.get("email"), role=role)
+
+
+_jwks_client: Optional[jwt.PyJWKClient] = None
+_jwks_lock = threading.Lock()
+
+
+def _jwks() -> Optional[jwt.PyJWKClient]:
+    global _jwks_client
+    if not settings.SUPABASE_URL:
+        return None
+    with _jwks_lock:
+        if _jwks_client is None:
+            url = settings.SUPABASE_URL.rstrip("/") + "/auth/v1/.well-known/jwks.json"
+            _jwks_client = jwt.PyJWKClient(
+                url, cache_jwk_set=True, lifespan=settings.AUTH_JWKS_TTL, timeout=5
+            )
+    return _jwks_client
+
+
+def verify_token(token: str, secret: Optional[str] = None) -> TokenClaims:
+    """Verify *token* locally and return its claims.
+
+    *secret* overrides ``SUPABASE_JWT_SECRET`` (used by the test signer).
+    """
+    try:
+        header = jwt.get_unverified_header(token)
+    except jwt.PyJWTError as exc:
+        raise InvalidToken(str(exc)) from exc
+
+    alg = header.get("alg", "")
+    if alg == "HS256":
+        key: Any = secret or settings.SUPABASE_JWT_SECRET
+        if not key:
+            raise VerificationUnavailable("SUPABASE_JWT_SECRET not configured")
+    elif alg in {"RS256", "ES256"}:
+        client = _jwks()
+        if client is None:
+            raise VerificationUnavailable("SUPABASE_URL not configured")
+        try:
+            key = client.get_signing_key_from_jwt(token).key
+        except jwt.PyJWKClientConnectionError as exc:
+            raise VerificationUnavailable(str(exc)) from exc
+        except jwt.PyJWTError as exc:
+            raise InvalidToken(str(exc)) from exc
+    else:
+        raise InvalidToken(f"unsupported alg {alg!r}")
+
+    try:
+        payload = jwt.decode(
+            token,
+            key,
+            algorithms=[alg],
+            audience="authenticated",
+            options={"require": ["sub", "exp"]},
+            leeway=settings.AUTH_CLOCK_SKEW,
+        )
+    except jwt.PyJWTError as exc:
+        raise InvalidToken(str(exc)) from exc
+    return TokenClaims.from_payload(payload)
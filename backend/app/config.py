@@ -12,10 +12,85 @@ class Settings(BaseModel):
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./autograde.db")
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
     SUPABASE_SERVICE_KEY: str = os.getenv("SUPABASE_SERVICE_KEY", "")
+    # Local JWT verification (HS256 secret; asymmetric keys come from JWKS)
+    SUPABASE_JWT_SECRET: str = os.getenv("SUPABASE_JWT_SECRET", "")
+    AUTH_JWKS_TTL: int = int(os.getenv("AUTH_JWKS_TTL", "600"))
+    AUTH_CLOCK_SKEW: int = int(os.getenv("AUTH_CLOCK_SKEW", "30"))
+    AUTH_USER_CACHE_TTL: float = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+    AUTH_REMOTE_FALLBACK: bool = os.getenv("AUTH_REMOTE_FALLBACK", "1") == "1"
     SIM_THRESH_SEM: float = float(os.getenv("SIM_THRESH_SEM", "0.90"))
     SIM_THRESH_JACC: float = float(os.getenv("SIM_THRESH_JACC", "0.80"))
+    UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "uploads")  # local store root + scratch space
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "local")  # "local" | "s3"
+    STORAGE_CONCURRENCY: int = int(os.getenv("STORAGE_CONCURRENCY", "8"))
+    S3_BUCKET: str = os.getenv("S3_BUCKET", "")
+    S3_PREFIX: str = os.getenv("S3_PREFIX", "")
+    S3_ENDPOINT_URL: str = os.getenv("S3_ENDPOINT_URL", "")  # e.g. http://localhost:9000 for MinIO
+    S3_REGION: str = os.getenv("S3_REGION", "")
+    S3_ACCESS_KEY_ID: str = os.getenv("S3_ACCESS_KEY_ID", "")
+    S3_SECRET_ACCESS_KEY: str = os.getenv("S3_SECRET_ACCESS_KEY", "")
+    S3_MULTIPART_MB: float = float(os.getenv("S3_MULTIPART_MB", "8"))
+    BLOB_CACHE_DIR: str = os.getenv("BLOB_CACHE_DIR", os.path.join(os.getenv("UPLOAD_DIR", "uploads"), ".cache"))
+    BLOB_CACHE_MB: float = float(os.getenv("BLOB_CACHE_MB", "2048"))
+    MAX_UPLOAD_MB: float = float(os.getenv("MAX_UPLOAD_MB", "50"))
+    BLOB_CLAIM_GRACE_MINUTES: float = float(os.getenv("BLOB_CLAIM_GRACE_MINUTES", "60"))  # upload → first reference
+    # Bulk scanned-exam import (ZIP or multi-student scan)
+    IMPORT_MAX_UPLOAD_MB: float = float(os.getenv("IMPORT_MAX_UPLOAD_MB", "1024"))
+    IMPORT_CONCURRENCY: int = int(os.getenv("IMPORT_CONCURRENCY", "4"))
+    REGRADE_CONCURRENCY: int = int(os.getenv("REGRADE_CONCURRENCY", "4"))  # regrade + retry jobs
+    RETRY_STALE_MINUTES: float = float(os.getenv("RETRY_STALE_MINUTES", "15"))  # PENDING this long = crashed
+    # "inline": grade inside the API process; "queue": hand work to app.worker
+    GRADING_MODE: str = os.getenv("GRADING_MODE", "inline")
+    WORKER_CONCURRENCY: int = int(os.getenv("WORKER_CONCURRENCY", "4"))
+    QUEUE_LEASE_SECONDS: float = float(os.getenv("QUEUE_LEASE_SECONDS", "120"))
+    QUEUE_MAX_ATTEMPTS: int = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+    QUEUE_RETRY_BACKOFF: float = float(os.getenv("QUEUE_RETRY_BACKOFF", "10"))  # seconds, doubles per attempt
+    QUEUE_POLL_SECONDS: float = float(os.getenv("QUEUE_POLL_SECONDS", "2"))
+    # Admission control (services/admission.py)
+    ADMISSION_MAX_INFLIGHT: int = int(os.getenv("ADMISSION_MAX_INFLIGHT", "16"))  # per API process
+    ADMISSION_MAX_INFLIGHT_PER_EXAM: int = int(os.getenv("ADMISSION_MAX_INFLIGHT_PER_EXAM", "8"))
+    ADMISSION_MAX_QUEUED: int = int(os.getenv("ADMISSION_MAX_QUEUED", "2000"))  # queue mode backlog
+    ADMISSION_MAX_QUEUED_PER_EXAM: int = int(os.getenv("ADMISSION_MAX_QUEUED_PER_EXAM", "500"))
+    ADMISSION_RETRY_AFTER: int = int(os.getenv("ADMISSION_RETRY_AFTER", "15"))  # seconds
+    ADMISSION_DEFER_MINUTES: float = float(os.getenv("ADMISSION_DEFER_MINUTES", "15"))  # 0 = never defer
+    # Inline mode: defer near-deadline uploads and grade them in this API process (else 429)
+    DEFER_DRAINER: bool = os.getenv("DEFER_DRAINER", "0") == "1"
+    # Scheduler in front of model / OCR / similarity calls (services/scheduler.py)
+    SCHED_MODEL_SLOTS: int = int(os.getenv("SCHED_MODEL_SLOTS", "8"))  # concurrent vision calls per process
+    SCHED_CPU_SLOTS: int = int(os.getenv("SCHED_CPU_SLOTS", "0"))  # 0 = os.cpu_count()
+    SCHED_RESERVED_SLOTS: int = int(os.getenv("SCHED_RESERVED_SLOTS", "2"))  # interactive-only
+    SCHED_WEIGHT_INTERACTIVE: float = float(os.getenv("SCHED_WEIGHT_INTERACTIVE", "8"))
+    SCHED_WEIGHT_BULK: float = float(os.getenv("SCHED_WEIGHT_BULK", "2"))
+    SCHED_WEIGHT_BACKGROUND: float = float(os.getenv("SCHED_WEIGHT_BACKGROUND", "1"))
+    SCHED_INTERACTIVE_SLO_SECONDS: float = float(os.getenv("SCHED_INTERACTIVE_SLO_SECONDS", "20"))
+    # Async submit path (services/executors.py); model concurrency is still SCHED_MODEL_SLOTS
+    ASYNC_DB_THREADS: int = int(os.getenv("ASYNC_DB_THREADS", "16"))  # blocking DB / storage work
+    ASYNC_CPU_PROCESSES: int = int(os.getenv("ASYNC_CPU_PROCESSES", "2"))  # PDF rendering; 0 = in-thread
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")  # if set, /metrics needs "Bearer <token>"
+    QUERY_REPEAT_THRESHOLD: int = int(os.getenv("QUERY_REPEAT_THRESHOLD", "10"))  # same statement shape per request
+    QUERY_LOG_COUNT: int = int(os.getenv("QUERY_LOG_COUNT", "50"))  # log requests with this many queries
+    QUERY_DEBUG_HEADERS: bool = os.getenv("QUERY_DEBUG_HEADERS", "0") == "1"  # X-DB-* response headers (dev)
+    # Request profiling (app/profiling.py); off unless a token or sample rate is set
+    PROFILE_TOKEN: str = os.getenv("PROFILE_TOKEN", "")  # "X-Profile: <token>" profiles one request
+    PROFILE_SAMPLE_RATE: float = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # 0..1 of all requests
+    PROFILE_INTERVAL_MS: float = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", "")  # default: <UPLOAD_DIR>/profiles
+    PROFILE_KEEP: int = int(os.getenv("PROFILE_KEEP", "200"))
     MAX_IMAGES_PER_CALL: int = int(os.getenv("MAX_IMAGES_PER_CALL", "10"))
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o")
+    # Text layer of digitally produced PDFs (utils/pdftext.py): typed pages skip OCR
+    TEXT_LAYER: bool = os.getenv("TEXT_LAYER", "1") == "1"
+    TEXT_LAYER_MIN_CHARS: int = int(os.getenv("TEXT_LAYER_MIN_CHARS", "50"))  # less text = treat as scanned
+    TEXT_GRADING: bool = os.getenv("TEXT_GRADING", "0") == "1"  # send typed pages as text, not images
+    TEXT_GRADING_MODEL: str = os.getenv("TEXT_GRADING_MODEL", "")  # text-only calls; "" = OPENAI_MODEL
+    # Question spans (services/spans.py): headers from the text layer / tesseract, vision model as fallback
+    SPANS_LOCAL: bool = os.getenv("SPANS_LOCAL", "1") == "1"
+    SPANS_MIN_CONF: float = float(os.getenv("SPANS_MIN_CONF", "60"))  # tesseract confidence of header words
+    SPANS_NARROW_PAGES: bool = os.getenv("SPANS_NARROW_PAGES", "0") == "1"  # grade each question on its own pages
+    # Fast start: no schema check or client warm-up at boot; everything heavy
+    # (OpenAI, Supabase, PIL, pdf2image) is imported on first use.
+    FAST_START: bool = os.getenv("FAST_START", "1") == "1"
+    COLD_START_BUDGET_MS: float = float(os.getenv("COLD_START_BUDGET_MS", "1000"))
 
 settings = Settings()
\ No newline at end of file
@@ -2,6 +2,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
 from .config import settings
+from . import querystats
 
 _db_url = settings.DATABASE_URL
 
@@ -32,4 +33,6 @@ engine = create_engine(
     connect_args=connect_args,
 )
 
+querystats.install(engine)
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
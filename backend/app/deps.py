@@ -1,14 +1,25 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
-from supabase import create_client
 from .database import SessionLocal
 from .models import User
 from .config import settings
+from .auth.tokens import TokenClaims, InvalidToken, VerificationUnavailable, verify_token
 
-_supabase = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_KEY)
 _bearer = HTTPBearer(auto_error=False)
 
+_supabase = None
+def supabase_client():
+    """Supabase admin client, created (and the SDK imported) on first use."""
+    global _supabase
+    if _supabase is None:
+        from supabase import create_client
+        _supabase = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_KEY)
+    return _supabase
+
 def get_db():
     db = SessionLocal()
     try:
@@ -16,28 +27,79 @@ def get_db():
     finally:
         db.close()
 
+# ── User-row cache ────────────────────────────────────────────────────────────
+# subject id → (expires_at, detached User snapshot). Tokens are still verified
+# on every request; only the profile lookup is cached.
+
+_user_cache: Dict[str, Tuple[float, User]] = {}
+_user_cache_lock = threading.Lock()
+
+def _cached_user(user_id: str) -> Optional[User]:
+    with _user_cache_lock:
+        hit = _user_cache.get(user_id)
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+        _user_cache.pop(user_id, None)
+    return None
+
+def _remember_user(user: User) -> None:
+    if settings.AUTH_USER_CACHE_TTL <= 0:
+        return
+    snapshot = User(id=user.id, email=user.email, role=user.role)
+    with _user_cache_lock:
+        _user_cache[user.id] = (time.monotonic() + settings.AUTH_USER_CACHE_TTL, snapshot)
+
+def invalidate_user(user_id: str) -> None:
+    """Drop a cached profile — call after changing a user's row."""
+    with _user_cache_lock:
+        _user_cache.pop(str(user_id), None)
+
+def clear_user_cache() -> None:
+    with _user_cache_lock:
+        _user_cache.clear()
+
+# ── Token → claims ────────────────────────────────────────────────────────────
+
+def _remote_claims(token: str) -> TokenClaims:
+    """Fallback: ask Supabase to validate the token (one network round trip)."""
+    try:
+        sb_user = supabase_client().auth.get_user(token).user
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    if not sb_user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return TokenClaims.from_payload({
+        "sub": sb_user.id,
+        "email": sb_user.email,
+        "user_metadata": sb_user.user_metadata,
+    })
+
+def _resolve_claims(token: str) -> TokenClaims:
+    try:
+        return verify_token(token)
+    except InvalidToken:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    except VerificationUnavailable:
+        if not settings.AUTH_REMOTE_FALLBACK:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return _remote_claims(token)
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(_bearer),
     db: Session = Depends(get_db),
 ) -> User:
     if not credentials:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    try:
-        resp = _supabase.auth.get_user(credentials.credentials)
-        sb_user = resp.user
-    except Exception:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    if not sb_user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    user = db.query(User).filter(User.id == str(sb_user.id)).first()
+    claims = _resolve_claims(credentials.credentials)
+    user = _cached_user(claims.sub)
+    if user:
+        return user
+    user = db.query(User).filter(User.id == claims.sub).first()
     if not user:
         # Auto-create profile on first login using role stored in Supabase metadata
-        meta = sb_user.user_metadata or {}
-        role = meta.get("role", "STUDENT")
-        if role not in {"PROF", "STUDENT"}:
-            role = "STUDENT"
-        user = User(id=str(sb_user.id), email=sb_user.email, role=role)
+        user = User(id=claims.sub, email=claims.email, role=claims.role)
         db.add(user)
         db.commit()
         db.refresh(user)
+    _remember_user(user)
     return user
@@ -0,0 +1,435 @@
+"""
+Load test: mixed traffic against one uvicorn worker at rising concurrency.
+
+    python -m app.loadtest                                   # scratch SQLite, 1 → 32 users
+    python -m app.loadtest --levels 8,16,32,64 --duration 60 --out load.json
+    python -m app.loadtest --database-url postgresql://...   # a SCRATCH Postgres (gets written to)
+
+The app runs in a child process with the real routers, admission control,
+scheduler and DB, but with local auth (tokens from ``auth.testing``) and a
+stand-in vision model (sync and async client) whose latency is log-normal
+with the given p50/p95 plus a per-image cost. ``--stub-render`` also
+replaces pdf2image with blank letter-size pages (for machines without
+poppler).
+
+Each level runs N closed-loop virtual users that pick operations by weight:
+student submits, professor dashboard polling (``/prof/exams``), stats and
+flags. The JSON report has throughput, latency percentiles, error and 429
+rates per operation, plus the server's queue/scheduler snapshot. Rising
+stops at the first level where submits exceed ``--stop-p95`` seconds at the
+95th percentile or ``--stop-error-rate`` errors.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+# operation → default weight; paths are filled in per exam
+DEFAULT_MIX = {"submit": 1, "exams": 4, "stats": 2, "flags": 2}
+
+
+# ── Stand-ins (child process) ─────────────────────────────────────────────────
+
+class StubVision:
+    """
+    Quacks like ``OpenAI()`` for ``chat.completions.with_raw_response.create``.
+
+    Latency per call is log-normal (median *p50*, 95th percentile *p95*) plus
+    *per_image* seconds for each image in the request. Span detection answers
+    with *questions* evenly split bands; grading answers with a random score.
+    """
+
+    def __init__(self, p50: float, p95: float, per_image: float, error_rate: float,
+                 questions: int, asynchronous: bool = False):
+        self.mu = math.log(max(p50, 1e-3))
+        self.sigma = max(math.log(max(p95, p50) / max(p50, 1e-3)) / 1.645, 0.0)
+        self.per_image = per_image
+        self.error_rate = error_rate
+        self.questions = questions
+        create = self.acreate if asynchronous else self.create
+        self.chat = SimpleNamespace(completions=SimpleNamespace(
+            with_raw_response=SimpleNamespace(create=create)))
+
+    def create(self, model: str, messages: List[Dict[str, Any]], **kwargs) -> SimpleNamespace:
+        time.sleep(self._latency(messages))
+        return self._respond(messages)
+
+    async def acreate(self, model: str, messages: List[Dict[str, Any]], **kwargs) -> SimpleNamespace:
+        await asyncio.sleep(self._latency(messages))
+        return self._respond(messages)
+
+    @staticmethod
+    def _parts(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [p for m in messages if isinstance(m["content"], list) for p in m["content"]]
+
+    def _latency(self, messages: List[Dict[str, Any]]) -> float:
+        images = sum(1 for p in self._parts(messages) if p.get("type") == "image_url")
+        return random.lognormvariate(self.mu, self.sigma) + self.per_image * images
+
+    def _respond(self, messages: List[Dict[str, Any]]) -> SimpleNamespace:
+        parts = self._parts(messages)
+        images = sum(1 for p in parts if p.get("type") == "image_url")
+        prompt = " ".join(p.get("text", "") for p in parts)
+        if random.random() < self.error_rate:
+            raise TimeoutError("stub vision model timed out")
+        if "q_idx" in prompt:
+            body = {"items": self._spans(max(images, 1))}
+        else:
+            body = {"points": round(random.uniform(0, 10), 1), "rationale": "load test",
+                    "strengths": ["setup"], "missing": []}
+        resp = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(body)))],
+            usage=SimpleNamespace(prompt_tokens=800 * images + 300, completion_tokens=120),
+        )
+        return SimpleNamespace(retries_taken=0, parse=lambda: resp)
+
+    def _spans(self, pages: int) -> List[Dict[str, Any]]:
+        per_page = max(1, math.ceil(self.questions / pages))
+        items = []
+        for q in range(self.questions):
+            page, slot = divmod(q, per_page)
+            top = slot / per_page
+            items.append({"q_idx": q + 1, "segments": [
+                {"page": min(page, pages - 1) + 1, "y_top": round(top, 3),
+                 "y_bottom": round(top + 1 / per_page, 3)}]})
+        return items
+
+
+def _blank_pages(pdf_path: str, out_dir: str) -> List[str]:
+    """pdf_to_pngs without poppler: one blank 200 dpi letter page per PDF page."""
+    from PIL import Image
+    from pypdf import PdfReader
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(1, len(PdfReader(pdf_path).pages) + 1):
+        p = out / f"page_{i:03d}.png"
+        Image.new("L", (1700, 2200), 255).save(p, format="PNG")
+        paths.append(str(p))
+    return paths
+
+
+def serve(args: argparse.Namespace) -> None:
+    import uvicorn
+
+    from . import migrations
+    from .auth.testing import use_local_auth
+    from .config import settings
+    from .database import engine
+    from .main import app
+    from .services import grading_vision
+    from .utils import images
+
+    migrations.upgrade(engine)
+    use_local_auth()
+    model = (args.model_p50, args.model_p95, args.model_per_image, args.model_error_rate,
+             args.questions)
+    grading_vision._client = StubVision(*model)
+    grading_vision._async_client = StubVision(*model, asynchronous=True)
+    if args.stub_render:
+        # Rendering runs in spawned processes on the async path; keep it in-process
+        settings.ASYNC_CPU_PROCESSES = 0
+        images.pdf_to_pngs = _blank_pages
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", workers=1)
+
+
+# ── Traffic (parent process) ──────────────────────────────────────────────────
+
+def _exam_pdf(pages: int, seed: int) -> bytes:
+    """A letter-size PDF with random strokes — unique bytes, so no render-cache hits."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    ims = []
+    for _ in range(pages):
+        im = Image.new("L", (612, 792), 255)
+        draw = ImageDraw.Draw(im)
+        for _ in range(40):
+            x, y = rng.randrange(40, 560), rng.randrange(40, 740)
+            draw.line((x, y, x + rng.randrange(-60, 60), y + rng.randrange(-20, 20)), fill=0, width=2)
+        ims.append(im)
+    buf = io.BytesIO()
+    ims[0].save(buf, format="PDF", save_all=True, append_images=ims[1:])
+    return buf.getvalue()
+
+
+def _auth(user_id: str, role: str) -> Dict[str, str]:
+    from .auth.testing import sign_test_token
+    return {"Authorization": f"Bearer {sign_test_token(user_id, f'{user_id}@load.test', role)}"}
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 1)
+
+
+class Run:
+    """Shared state of one load test: client, exam ids, results."""
+
+    def __init__(self, client, base: str, args: argparse.Namespace):
+        self.client, self.base, self.args = client, base, args
+        self.prof = _auth("load-prof", "PROF")
+        self.exams: List[int] = []
+        self.students = 0
+        self.mix = list(args.mix.items())
+
+    async def setup(self) -> None:
+        r = await self.client.get(f"{self.base}/auth/me", headers=self.prof)
+        r.raise_for_status()
+        due = (datetime.utcnow() + timedelta(days=7)).isoformat() + "Z"
+
+        async def one(n: int) -> int:
+            r = await self.client.post(f"{self.base}/prof/exams", headers=self.prof,
+                                       json={"title": f"Load exam {n}", "due_at": due})
+            r.raise_for_status()
+            exam_id = r.json()["id"]
+            pdf = _exam_pdf(self.args.pages, seed=-n - 1)
+            r = await self.client.post(f"{self.base}/prof/exams/{exam_id}/solution_pdf",
+                                       headers=self.prof,
+                                       files={"file": ("solution.pdf", pdf, "application/pdf")})
+            r.raise_for_status()
+            return exam_id
+
+        self.exams = list(await asyncio.gather(*(one(n) for n in range(self.args.exams))))
+
+    def _request(self, op: str) -> Tuple[str, str, Dict[str, Any]]:
+        exam = random.choice(self.exams)
+        if op == "submit":
+            self.students += 1
+            n = self.students
+            pdf = _exam_pdf(self.args.pages, seed=n)
+            return "POST", f"/student/exams/{exam}/submit_pdf", {
+                "headers": _auth(f"load-student-{n}", "STUDENT"),
+                "files": {"file": (f"{n}.pdf", pdf, "application/pdf")},
+            }
+        path = {"exams": "/prof/exams", "stats": f"/prof/exams/{exam}/stats",
+                "flags": f"/prof/exams/{exam}/flags"}[op]
+        return "GET", path, {"headers": self.prof}
+
+    async def user(self, until: float, results: List[Tuple[str, float, int]]) -> None:
+        ops, weights = zip(*self.mix)
+        while time.monotonic() < until:
+            op = random.choices(ops, weights)[0]
+            method, path, kwargs = self._request(op)
+            start = time.perf_counter()
+            try:
+                r = await self.client.request(method, self.base + path, **kwargs)
+                status = r.status_code
+            except Exception:
+                status = 0  # connection error / client timeout
+            results.append((op, time.perf_counter() - start, status))
+
+    async def level(self, users: int) -> Dict[str, Any]:
+        results: List[Tuple[str, float, int]] = []
+        started = time.monotonic()
+        until = started + self.args.duration
+        await asyncio.gather(*(self.user(until, results) for _ in range(users)))
+        elapsed = time.monotonic() - started
+        report = summarize(results, elapsed)
+        report["concurrency"] = users
+        try:
+            r = await self.client.get(f"{self.base}/prof/queue", headers=self.prof)
+            report["server"] = r.json()
+        except Exception as exc:
+            report["server"] = {"error": str(exc)}
+        return report
+
+
+def summarize(results: List[Tuple[str, float, int]], elapsed: float) -> Dict[str, Any]:
+    by_op: Dict[str, List[Tuple[float, int]]] = defaultdict(list)
+    for op, seconds, status in results:
+        by_op[op].append((seconds, status))
+
+    def block(rows: List[Tuple[float, int]]) -> Dict[str, Any]:
+        statuses = Counter(status for _, status in rows)
+        rejected = statuses[429]
+        errors = sum(n for s, n in statuses.items() if s == 0 or (s >= 400 and s != 429))
+        ok = [seconds for seconds, status in rows if 200 <= status < 400]
+        return {
+            "requests": len(rows),
+            "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {"p50": _percentile(ok, 0.50), "p90": _percentile(ok, 0.90),
+                           "p95": _percentile(ok, 0.95), "p99": _percentile(ok, 0.99),
+                           "max": _percentile(ok, 1.0)},
+            "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+            "rejected_rate": round(rejected / len(rows), 4) if rows else 0.0,
+            "status": {str(s): n for s, n in sorted(statuses.items())},
+        }
+
+    out = block([(s, st) for _, s, st in results])
+    out["duration_s"] = round(elapsed, 1)
+    out["ops"] = {op: block(rows) for op, rows in sorted(by_op.items())}
+    return out
+
+
+def _saturated(level: Dict[str, Any], args: argparse.Namespace) -> Optional[str]:
+    submit = level["ops"].get("submit")
+    if level["error_rate"] > args.stop_error_rate:
+        return f"error rate {level['error_rate']:.1%} > {args.stop_error_rate:.1%}"
+    if submit and (submit["latency_ms"]["p95"] or 0) > args.stop_p95 * 1000:
+        return f"submit p95 {submit['latency_ms']['p95'] / 1000:.1f}s > {args.stop_p95}s"
+    return None
+
+
+async def drive(base: str, args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        run = Run(client, base, args)
+        await run.setup()
+        levels: List[Dict[str, Any]] = []
+        sustained, saturated = None, None
+        for users in args.levels:
+            print(f"[load] {users} users for {args.duration}s ...", file=sys.stderr)
+            level = await run.level(users)
+            levels.append(level)
+            submit = level["ops"].get("submit", {})
+            print(f"[load] {users:>4} users: {level['throughput_rps']} req/s, "
+                  f"submit p95 {submit.get('latency_ms', {}).get('p95')} ms, "
+                  f"errors {level['error_rate']:.1%}, 429 {level['rejected_rate']:.1%}",
+                  file=sys.stderr)
+            reason = _saturated(level, args)
+            if reason:
+                saturated = {"concurrency": users, "reason": reason}
+                if not args.no_stop:
+                    break
+            elif saturated is None:
+                sustained = users
+    return {
+        "config": {
+            "levels": args.levels, "duration_s": args.duration, "mix": args.mix,
+            "exams": args.exams, "pages": args.pages, "questions": args.questions,
+            "model": {"p50_s": args.model_p50, "p95_s": args.model_p95,
+                      "per_image_s": args.model_per_image, "error_rate": args.model_error_rate},
+            "stub_render": args.stub_render,
+            "database": "scratch sqlite" if not args.database_url else "DATABASE_URL from --database-url",
+        },
+        "max_sustained_concurrency": sustained,
+        "saturated_at": saturated,
+        "levels": levels,
+    }
+
+
+# ── Process management ────────────────────────────────────────────────────────
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(proc: subprocess.Popen, base: str, timeout: float = 90.0) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"app exited during startup (code {proc.returncode})")
+        try:
+            if httpx.get(base + "/", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise SystemExit(f"app did not answer on {base} within {timeout:.0f}s")
+
+
+def _child_args(args: argparse.Namespace, port: int) -> List[str]:
+    return [
+        sys.executable, "-m", "app.loadtest", "--serve", "--port", str(port),
+        "--questions", str(args.questions),
+        "--model-p50", str(args.model_p50), "--model-p95", str(args.model_p95),
+        "--model-per-image", str(args.model_per_image),
+        "--model-error-rate", str(args.model_error_rate),
+        *(["--stub-render"] if args.stub_render else []),
+    ]
+
+
+def _parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        if op.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation {op!r} (one of {', '.join(DEFAULT_MIX)})")
+        mix[op.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.loadtest")
+    parser.add_argument("--levels", type=lambda s: [int(n) for n in s.split(",")],
+                        default=[1, 2, 4, 8, 16, 32], help="comma-separated user counts")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--mix", type=_parse_mix, default=dict(DEFAULT_MIX),
+                        help="weights, e.g. submit=1,exams=4,stats=2,flags=2")
+    parser.add_argument("--exams", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=4, help="pages per PDF")
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--model-p50", type=float, default=4.0, help="vision call median, seconds")
+    parser.add_argument("--model-p95", type=float, default=12.0)
+    parser.add_argument("--model-per-image", type=float, default=0.3)
+    parser.add_argument("--model-error-rate", type=float, default=0.01)
+    parser.add_argument("--stub-render", action="store_true", help="blank pages instead of pdf2image")
+    parser.add_argument("--database-url", default="", help="default: a scratch SQLite file")
+    parser.add_argument("--timeout", type=float, default=300, help="client timeout, seconds")
+    parser.add_argument("--stop-p95", type=float, default=120, help="submit p95 limit, seconds")
+    parser.add_argument("--stop-error-rate", type=float, default=0.05)
+    parser.add_argument("--no-stop", action="store_true", help="run every level")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args)
+        return 0
+
+    scratch = tempfile.mkdtemp(prefix="loadtest-")
+    env = os.environ.copy()
+    env["DATABASE_URL"] = args.database_url or f"sqlite:///{scratch}/load.db"
+    env["UPLOAD_DIR"] = os.path.join(scratch, "uploads")
+    env.setdefault("FAST_START", "1")
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen(_child_args(args, port), cwd=BACKEND_DIR, env=env)
+    try:
+        _wait_ready(proc, base)
+        report = asyncio.run(drive(base, args))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    text = json.dumps(report, indent=2, default=str)
+    if args.out:
+        Path(args.out).write_text(text)
+        print(f"[load] report written to {args.out}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,57 +1,68 @@
 import os
 import logging
-import threading
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from sqlalchemy import text
-from .database import engine, SessionLocal
-from .models import Base, Exam, _gen_code
+from . import metrics, migrations, profiling
+from .config import settings
+from .database import engine
 from .routers import auth as auth_router
 from .routers import professor as professor_router
 from .routers import student as student_router
+from .routers import pages as pages_router
+from .routers import profiles as profiles_router
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Keepalive thread — prevents process from exiting when idle
-def _keepalive():
-    import time
-    while True:
-        time.sleep(30)
+def _check_schema():
+    # Schema changes are applied out of band: `python -m app.migrations`
+    try:
+        waiting = migrations.pending(engine)
+        if waiting:
+            logger.warning(
+                "Database schema is behind by %d migration(s) (%s); "
+                "run `python -m app.migrations`.",
+                len(waiting), ", ".join(f"{v:04d}" for v, _ in waiting),
+            )
+    except Exception as e:
+        logger.error(f"Schema version check failed: {e}")
 
-threading.Thread(target=_keepalive, daemon=True).start()
+def _warm_up():
+    """Import heavy libraries up front so the first request doesn't pay for them."""
+    import openai, PIL.Image, pdf2image  # noqa: F401
+    from .deps import supabase_client
+    supabase_client()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    try:
-        logger.info("Creating database tables...")
-        Base.metadata.create_all(bind=engine)
-        # Add enrollment_code column to existing exams table if missing
-        with engine.connect() as conn:
-            conn.execute(text(
-                "ALTER TABLE exams ADD COLUMN IF NOT EXISTS enrollment_code VARCHAR(8)"
-            ))
-            conn.commit()
-        # Generate codes for exams that don't have one yet
-        db = SessionLocal()
+    if not settings.FAST_START:
+        _check_schema()
         try:
-            exams = db.query(Exam).filter(Exam.enrollment_code == None).all()
-            for exam in exams:
-                exam.enrollment_code = _gen_code()
-            if exams:
-                db.commit()
-        finally:
-            db.close()
-        logger.info("Database tables ready.")
-    except Exception as e:
-        logger.error(f"DB init failed: {e}")
-        raise
+            _warm_up()
+        except Exception as e:
+            logger.warning(f"Warm-up skipped: {e}")
+    drainer = None
+    if settings.DEFER_DRAINER and settings.GRADING_MODE != "queue" and settings.ADMISSION_DEFER_MINUTES:
+        # Opt-in: grade the submissions deferred past a deadline in this process
+        from .worker import Worker
+        drainer = Worker(1, ["stages"], settings.QUEUE_POLL_SECONDS)
+        drainer.start()
     yield
+    if drainer:
+        drainer.stop()
+    from .services import executors
+    executors.shutdown()
 
 app = FastAPI(title="AutoGradeAI (Cookie Sessions)", lifespan=lifespan)
 
+metrics.install_db_hooks(engine)
+app.middleware("http")(metrics.http_middleware)
+if profiling.enabled():
+    app.middleware("http")(profiling.middleware)
+
 _origins = [
     "https://auto-grade-ai.vercel.app",
 ]
@@ -72,6 +83,12 @@ app.add_middleware(
 def root():
     return {"ok": True, "app": "AutoGradeAI"}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def prometheus_metrics(request: Request):
+    if settings.METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {settings.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Optional: to verify cookies exist
 @app.get("/debug/cookies")
 def debug_cookies(request: Request):
@@ -81,3 +98,5 @@ def debug_cookies(request: Request):
 app.include_router(auth_router.router, prefix="/auth", tags=["auth"])
 app.include_router(professor_router.router, prefix="/prof", tags=["professor"])
 app.include_router(student_router.router, prefix="/student", tags=["student"])
+app.include_router(pages_router.router, prefix="/pages", tags=["pages"])
+app.include_router(profiles_router.router, prefix="/profiles", tags=["profiles"], include_in_schema=False)
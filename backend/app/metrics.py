@@ -0,0 +1,250 @@
+"""
+In-process metrics, exposed in Prometheus text format at ``GET /metrics``.
+
+A deliberately small registry (counters, gauges, histograms with fixed
+buckets) so that recording costs a dict lookup and a lock — cheap enough to
+call on every request and every model call. Values are per process; with
+several uvicorn workers or ``app.worker`` processes, scrape each one.
+
+    from ..metrics import VISION_SECONDS
+    with VISION_SECONDS.time(stage="grade", exam=exam_id):
+        ...
+"""
+from __future__ import annotations
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+_REGISTRY: List["_Metric"] = []
+_COLLECTORS: List[Callable[[], Iterable["_Metric"]]] = []
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTES_BUCKETS = (1e4, 5e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), register: bool = True):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        if register:
+            _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple("" if labels.get(n) is None else str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key: Tuple[str, ...], value) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, key, state) -> List[str]:
+        counts, total, n = state[0][:], state[1], state[2]
+        out, running = [], 0
+        for bound, c in zip(self.buckets + (float("inf"),), counts):
+            running += c
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            labels = _labels(self.labelnames, key, 'le="%s"' % le)
+            out.append(f"{self.name}_bucket{labels} {running}")
+        out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+        out.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return out
+
+
+def collector(fn: Callable[[], Iterable[_Metric]]) -> Callable[[], Iterable[_Metric]]:
+    """Register *fn* to build gauges at scrape time (queue depth, scheduler state...)."""
+    _COLLECTORS.append(fn)
+    return fn
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    for fn in _COLLECTORS:
+        try:
+            for metric in fn():
+                lines.extend(metric.render())
+        except Exception as exc:  # a broken collector must not break the scrape
+            lines.append(f"# collector {fn.__name__} failed: {_escape(str(exc))}")
+    return "\n".join(lines) + "\n"
+
+
+# ── Metrics ───────────────────────────────────────────────────────────────────
+
+HTTP_SECONDS = Histogram("autograde_http_request_seconds", "HTTP request latency",
+                         ["method", "route", "status"])
+DB_QUERIES = Histogram("autograde_db_queries_per_request", "SQL statements per HTTP request",
+                       ["route"], buckets=COUNT_BUCKETS)
+DB_SECONDS = Histogram("autograde_db_seconds_per_request", "Time in SQL per HTTP request",
+                       ["route"])
+DB_REPEATED = Counter("autograde_db_repeated_statement_requests_total",
+                      "Requests that repeated one statement shape (N+1 suspects)", ["route"])
+DB_CONNECTIONS = Counter("autograde_db_connections_opened_total", "New DB connections")
+DB_CHECKED_OUT = Gauge("autograde_db_connections_in_use", "DB connections checked out")
+
+STAGE_SECONDS = Histogram("autograde_stage_seconds", "Pipeline stage duration",
+                          ["stage", "exam"])
+STAGE_FAILURES = Counter("autograde_stage_failures_total", "Pipeline stage failures",
+                         ["stage", "exam"])
+RENDER_SECONDS = Histogram("autograde_pdf_render_seconds", "PDF → page images (cache misses)")
+PAGES = Histogram("autograde_pages_per_submission", "Pages per rendered submission",
+                  ["exam"], buckets=COUNT_BUCKETS)
+TEXT_LAYER_PAGES = Counter("autograde_text_layer_pages_total",
+                           "Submission pages taken from the PDF text layer (no OCR)", ["exam"])
+
+VISION_SECONDS = Histogram("autograde_vision_call_seconds", "Vision model call latency",
+                           ["stage", "exam"])
+VISION_REQUEST_BYTES = Histogram("autograde_vision_request_bytes",
+                                 "Encoded image bytes per vision call", ["stage"],
+                                 buckets=BYTES_BUCKETS)
+VISION_RETRIES = Counter("autograde_vision_retries_total", "Vision call retries (client side)",
+                         ["stage"])
+VISION_ERRORS = Counter("autograde_vision_errors_total", "Vision calls that failed",
+                        ["stage", "error"])
+VISION_TOKENS = Counter("autograde_vision_tokens_total", "Tokens reported in OpenAI usage",
+                        ["stage", "exam", "type"])
+
+SCHED_WAIT_SECONDS = Histogram("autograde_scheduler_wait_seconds", "Time waiting for a scheduler slot",
+                               ["resource", "work_class"])
+
+OCR_SECONDS = Histogram("autograde_ocr_page_seconds", "OCR time per page")
+SPAN_OCR_SECONDS = Histogram("autograde_span_ocr_page_seconds", "Header OCR time per page (span detection)")
+SPAN_DETECTIONS = Counter("autograde_span_detections_total", "Question span detections by source",
+                          ["kind", "source"])
+SIMILARITY_SECONDS = Histogram("autograde_similarity_seconds", "Similarity check duration",
+                               ["exam"])
+SIMILARITY_COMPARISONS = Counter("autograde_similarity_comparisons_total",
+                                 "Submission pairs compared", ["exam"])
+
+
+# ── Hooks ─────────────────────────────────────────────────────────────────────
+
+def install_db_hooks(engine) -> None:
+    """Track connection use (statement counts come from querystats)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine.pool, "connect")
+    def _connect(dbapi_conn, record):
+        DB_CONNECTIONS.inc()
+
+    @event.listens_for(engine.pool, "checkout")
+    def _checkout(dbapi_conn, record, proxy):
+        DB_CHECKED_OUT.inc()
+
+    @event.listens_for(engine.pool, "checkin")
+    def _checkin(dbapi_conn, record):
+        DB_CHECKED_OUT.dec()
+
+
+def route_template(scope) -> str:
+    """Route template of a matched request ("/prof/exams/{exam_id}"), else "unmatched"."""
+    route = scope.get("route")
+    regex = getattr(route, "path_regex", None)
+    if regex is None:
+        return "unmatched"
+    # The matched route's path leaves out the static prefix its router was included under
+    path = scope["path"]
+    for i, ch in enumerate(path):
+        if ch == "/" and regex.match(path[i:]):
+            return path[:i] + route.path
+    return route.path
+
+
+async def http_middleware(request, call_next):
+    """Request latency plus SQL count/time and N+1 suspects, labelled by route template."""
+    from . import querystats
+
+    start = time.perf_counter()
+    status = 500
+    response = None
+    # The context is copied into the threadpool that runs sync routes.
+    with querystats.track() as stats:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            route = route_template(request.scope)
+            HTTP_SECONDS.observe(time.perf_counter() - start,
+                                 method=request.method, route=route, status=status)
+            DB_QUERIES.observe(stats.count, route=route)
+            DB_SECONDS.observe(stats.seconds, route=route)
+            if stats.repeated():
+                DB_REPEATED.inc(route=route)
+    response.headers.update(querystats.report(stats, request.method, route))
+    return response
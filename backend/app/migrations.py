@@ -0,0 +1,381 @@
+"""
+Versioned schema migrations.
+
+Run separately from the web process:
+
+    python -m app.migrations            # apply pending migrations
+    python -m app.migrations --status   # show applied / pending versions
+    python -m app.migrations --check-indexes
+                                        # EXPLAIN the hot router queries and
+                                        # fail if any of them skips its index
+
+Each migration is a plain function registered with ``@migration(version)``.
+Migrations must be idempotent (check before ALTER / CREATE) because the
+baseline step creates every table from the current models on a fresh DB.
+"""
+from __future__ import annotations
+import argparse
+import logging
+import sys
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+_MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = []
+
+
+def migration(version: int):
+    def register(fn: Callable[[Connection], None]):
+        _MIGRATIONS.append((version, fn.__name__, fn))
+        _MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl_type: str) -> None:
+    if not _has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def _create_index(conn: Connection, name: str, table: str, columns: List[str],
+                  unique: bool = False) -> None:
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    conn.execute(text(
+        f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+    ))
+
+
+# ── Migrations ────────────────────────────────────────────────────────────────
+
+@migration(1)
+def baseline(conn: Connection) -> None:
+    """Create any missing tables from the current models."""
+    from .models import Base
+    Base.metadata.create_all(bind=conn)
+
+
+@migration(2)
+def exam_enrollment_codes(conn: Connection) -> None:
+    from .models import _gen_code
+    _add_column(conn, "exams", "enrollment_code", "VARCHAR(8)")
+    _create_index(conn, "ix_exams_enrollment_code", "exams", ["enrollment_code"], unique=True)
+    ids = conn.execute(text("SELECT id FROM exams WHERE enrollment_code IS NULL")).scalars().all()
+    for exam_id in ids:
+        conn.execute(
+            text("UPDATE exams SET enrollment_code = :code WHERE id = :id"),
+            {"code": _gen_code(), "id": exam_id},
+        )
+
+
+@migration(3)
+def similarity_flag_severity(conn: Connection) -> None:
+    _add_column(conn, "similarity_flags", "severity", "VARCHAR(8)")
+    _create_index(conn, "ix_similarity_flags_severity", "similarity_flags", ["severity"])
+    conn.execute(text(
+        "UPDATE similarity_flags SET severity = CASE "
+        "WHEN sem >= 0.95 OR jacc >= 0.92 THEN 'HIGH' ELSE 'MEDIUM' END "
+        "WHERE severity IS NULL"
+    ))
+
+
+# Composite indexes matching the router / service filter + sort patterns.
+# Kept in sync with the Index() entries in models.__table_args__.
+HOT_PATH_INDEXES: List[Tuple[str, str, List[str]]] = [
+    ("ix_exams_created_by", "exams", ["created_by"]),
+    ("ix_questions_exam_id_idx", "questions", ["exam_id", "idx"]),
+    ("ix_submissions_exam_id_status", "submissions", ["exam_id", "status"]),
+    ("ix_submissions_exam_id_submitted_at", "submissions", ["exam_id", "submitted_at"]),
+    ("ix_submissions_student_id_submitted_at", "submissions", ["student_id", "submitted_at"]),
+    ("ix_answers_submission_id", "answers", ["submission_id"]),
+    ("ix_exam_enrollments_student_id", "exam_enrollments", ["student_id"]),
+    ("ix_similarity_flags_exam_id_sem", "similarity_flags", ["exam_id", "sem"]),
+    ("ix_similarity_flags_submission_a", "similarity_flags", ["submission_a"]),
+    ("ix_similarity_flags_submission_b", "similarity_flags", ["submission_b"]),
+]
+
+
+@migration(4)
+def hot_path_indexes(conn: Connection) -> None:
+    for name, table, columns in HOT_PATH_INDEXES:
+        _create_index(conn, name, table, columns)
+
+
+@migration(5)
+def content_addressed_blobs(conn: Connection) -> None:
+    from .models import Blob
+    Blob.__table__.create(bind=conn, checkfirst=True)
+    for table in ("solution_docs", "submission_docs"):
+        _add_column(conn, table, "blob_sha256", "VARCHAR(64) REFERENCES blobs (sha256)")
+        _create_index(conn, f"ix_{table}_blob_sha256", table, ["blob_sha256"])
+
+
+@migration(6)
+def normalized_doc_pages(conn: Connection) -> None:
+    """Move image lists, spans and OCR out of the extracted_text JSON blobs."""
+    import json
+    from .models import DocPage, PageSpan
+    from .utils.images import page_info
+
+    DocPage.__table__.create(bind=conn, checkfirst=True)
+    PageSpan.__table__.create(bind=conn, checkfirst=True)
+    pages_t, spans_t = DocPage.__table__, PageSpan.__table__
+
+    def insert_pages(fk: str, doc_id: int, images: List[str]) -> Dict[int, int]:
+        ids: Dict[int, int] = {}
+        for page_no, path in enumerate(images, start=1):
+            try:
+                info = page_info(path)
+            except Exception:
+                info = {}
+            res = conn.execute(pages_t.insert().values(
+                {fk: doc_id, "page_no": page_no, "image_path": path, **info}
+            ))
+            ids[page_no] = res.inserted_primary_key[0]
+        return ids
+
+    done = set(conn.execute(text(
+        "SELECT DISTINCT solution_doc_id FROM doc_pages WHERE solution_doc_id IS NOT NULL"
+    )).scalars())
+    for doc_id, raw in conn.execute(text("SELECT id, extracted_text FROM solution_docs")).all():
+        if doc_id in done:
+            continue
+        try:
+            data = json.loads(raw or "{}")
+        except ValueError:
+            continue
+        ids = insert_pages("solution_doc_id", doc_id, data.get("images", []))
+        for item in data.get("spans", []):
+            for seg in item.get("segments", []):
+                page_id = ids.get(int(seg.get("page", 0) or 0))
+                if page_id is None or int(item.get("q_idx", 0)) <= 0:
+                    continue
+                conn.execute(spans_t.insert().values(
+                    page_id=page_id, q_idx=int(item["q_idx"]),
+                    y_top=float(seg.get("y_top", 0.0)), y_bottom=float(seg.get("y_bottom", 1.0)),
+                ))
+
+    done = set(conn.execute(text(
+        "SELECT DISTINCT submission_doc_id FROM doc_pages WHERE submission_doc_id IS NOT NULL"
+    )).scalars())
+    for doc_id, raw in conn.execute(text("SELECT id, extracted_text FROM submission_docs")).all():
+        if doc_id in done:
+            continue
+        try:
+            data = json.loads(raw or "{}")
+        except ValueError:
+            continue
+        ids = insert_pages("submission_doc_id", doc_id, data.get("images", []))
+        # Legacy OCR was stored per document; keep it whole on the first page.
+        if data.get("ocr") and 1 in ids:
+            conn.execute(pages_t.update().where(pages_t.c.id == ids[1]).values(ocr_text=data["ocr"]))
+
+
+@migration(7)
+def storage_keys(conn: Connection) -> None:
+    """Stored paths become blob-store keys (relative to UPLOAD_DIR for the local store)."""
+    from pathlib import Path
+    from .config import settings
+
+    prefix = str(Path(settings.UPLOAD_DIR)) + "/"
+    for table, column in (
+        ("blobs", "path"),
+        ("solution_docs", "file_path"),
+        ("submission_docs", "file_path"),
+        ("doc_pages", "image_path"),
+    ):
+        conn.execute(
+            text(f"UPDATE {table} SET {column} = substr({column}, :start) "
+                 f"WHERE substr({column}, 1, :n) = :prefix"),
+            {"start": len(prefix) + 1, "n": len(prefix), "prefix": prefix},
+        )
+
+
+@migration(8)
+def solution_assets_version(conn: Connection) -> None:
+    # NULL → bundle built on first grading (solution_assets.current_bundle).
+    _add_column(conn, "solution_docs", "assets_version", "VARCHAR(32)")
+
+
+@migration(9)
+def jobs(conn: Connection) -> None:
+    from .models import Job
+    Job.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(10)
+def job_checkpoints(conn: Connection) -> None:
+    from .models import JobItem, QuestionResult
+    JobItem.__table__.create(bind=conn, checkfirst=True)
+    QuestionResult.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(11)
+def submission_stages(conn: Connection) -> None:
+    _add_column(conn, "submissions", "failed_stage", "VARCHAR(16)")
+    _add_column(conn, "submissions", "error", "TEXT")
+    _add_column(conn, "submissions", "attempts", "INTEGER DEFAULT 0")
+    _add_column(conn, "submissions", "similarity_at", "TIMESTAMP")
+
+
+@migration(12)
+def queue_tasks(conn: Connection) -> None:
+    from .models import QueueTask
+    QueueTask.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(13)
+def doc_page_text_layer(conn: Connection) -> None:
+    _add_column(conn, "doc_pages", "text_layer", "BOOLEAN DEFAULT FALSE")
+
+
+@migration(14)
+def blob_claims(conn: Connection) -> None:
+    # NULL → no upload in flight; sweeps need not wait.
+    _add_column(conn, "blobs", "claimed_at", "TIMESTAMP")
+
+
+# ── Runner ────────────────────────────────────────────────────────────────────
+
+def _ensure_version_table(conn: Connection) -> None:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR(128) NOT NULL, applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def applied_versions(engine: Engine) -> List[int]:
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return sorted(conn.execute(text("SELECT version FROM schema_migrations")).scalars().all())
+
+
+def pending(engine: Engine) -> List[Tuple[int, str]]:
+    done = set(applied_versions(engine))
+    return [(v, name) for v, name, _ in _MIGRATIONS if v not in done]
+
+
+def upgrade(engine: Engine) -> List[int]:
+    """Apply every pending migration, each in its own transaction."""
+    done = set(applied_versions(engine))
+    ran: List[int] = []
+    for version, name, fn in _MIGRATIONS:
+        if version in done:
+            continue
+        logger.info(f"Applying migration {version:04d} {name}...")
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) "
+                     "VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.utcnow()},
+            )
+        ran.append(version)
+    return ran
+
+
+# ── EXPLAIN check ─────────────────────────────────────────────────────────────
+
+# (label, SQL, params, index the planner is expected to pick)
+HOT_QUERIES: List[Tuple[str, str, Dict, str]] = [
+    ("exam submissions by status",
+     "SELECT id FROM submissions WHERE exam_id = :exam_id AND status = :status",
+     {"exam_id": 1, "status": "GRADED"}, "ix_submissions_exam_id_status"),
+    ("exam submissions by time",
+     "SELECT id FROM submissions WHERE exam_id = :exam_id ORDER BY submitted_at",
+     {"exam_id": 1}, "ix_submissions_exam_id_submitted_at"),
+    ("student history",
+     "SELECT id FROM submissions WHERE student_id = :sid ORDER BY submitted_at DESC",
+     {"sid": "x"}, "ix_submissions_student_id_submitted_at"),
+    ("submission answers",
+     "SELECT id FROM answers WHERE submission_id = :sid",
+     {"sid": 1}, "ix_answers_submission_id"),
+    ("exam questions",
+     "SELECT id FROM questions WHERE exam_id = :exam_id ORDER BY idx",
+     {"exam_id": 1}, "ix_questions_exam_id_idx"),
+    ("exam flags",
+     "SELECT id FROM similarity_flags WHERE exam_id = :exam_id ORDER BY sem DESC",
+     {"exam_id": 1}, "ix_similarity_flags_exam_id_sem"),
+    ("flags for submission (a)",
+     "SELECT id FROM similarity_flags WHERE submission_a = :sid",
+     {"sid": 1}, "ix_similarity_flags_submission_a"),
+    ("flags for submission (b)",
+     "SELECT id FROM similarity_flags WHERE submission_b = :sid",
+     {"sid": 1}, "ix_similarity_flags_submission_b"),
+    ("professor exams",
+     "SELECT id FROM exams WHERE created_by = :uid",
+     {"uid": "x"}, "ix_exams_created_by"),
+    ("submission pages",
+     "SELECT image_path FROM doc_pages WHERE submission_doc_id = :doc ORDER BY page_no",
+     {"doc": 1}, "ix_doc_pages_submission_doc_id_page_no"),
+    ("solution pages",
+     "SELECT image_path FROM doc_pages WHERE solution_doc_id = :doc ORDER BY page_no",
+     {"doc": 1}, "ix_doc_pages_solution_doc_id_page_no"),
+    ("page spans",
+     "SELECT q_idx, y_top, y_bottom FROM page_spans WHERE page_id = :pid",
+     {"pid": 1}, "ix_page_spans_page_id_q_idx"),
+]
+
+
+def explain(conn: Connection, sql: str, params: Dict) -> str:
+    """Return the query plan as one string, for SQLite or Postgres."""
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).all()
+        return "\n".join(str(r[-1]) for r in rows)
+    # Tiny dev tables make Postgres prefer a seq scan; forbid it for the check.
+    conn.execute(text("SET LOCAL enable_seqscan = off"))
+    rows = conn.execute(text("EXPLAIN " + sql), params).all()
+    return "\n".join(str(r[0]) for r in rows)
+
+
+def check_indexes(engine: Engine) -> List[Tuple[str, str]]:
+    """EXPLAIN every hot query; return (label, plan) for those missing their index."""
+    misses: List[Tuple[str, str]] = []
+    with engine.begin() as conn:
+        for label, sql, params, index in HOT_QUERIES:
+            plan = explain(conn, sql, params)
+            if index not in plan:
+                misses.append((label, plan))
+    return misses
+
+
+def main(argv: List[str] | None = None) -> int:
+    from .database import engine
+
+    parser = argparse.ArgumentParser(prog="python -m app.migrations")
+    parser.add_argument("--status", action="store_true", help="list applied/pending migrations")
+    parser.add_argument("--check-indexes", action="store_true",
+                        help="EXPLAIN hot queries and fail if an index is not used")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        done = applied_versions(engine)
+        for version, name, _ in _MIGRATIONS:
+            mark = "applied" if version in done else "pending"
+            print(f"{version:04d} {name:<32} {mark}")
+        return 0
+
+    if args.check_indexes:
+        misses = check_indexes(engine)
+        for label, plan in misses:
+            print(f"[index miss] {label}:\n  {plan}")
+        print("ok" if not misses else f"{len(misses)} hot queries not using an index")
+        return 1 if misses else 0
+
+    ran = upgrade(engine)
+    print(f"Applied {len(ran)} migration(s)." if ran else "Schema is up to date.")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -1,5 +1,5 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Integer, Text, ForeignKey, DateTime, Float, JSON, UniqueConstraint
+from sqlalchemy import Boolean, String, Integer, Text, ForeignKey, DateTime, Float, JSON, UniqueConstraint, Index
 from datetime import datetime
 from typing import Optional
 import secrets, string
@@ -20,6 +20,7 @@ class User(Base):
 
 class Exam(Base):
     __tablename__ = "exams"
+    __table_args__ = (Index("ix_exams_created_by", "created_by"),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     title: Mapped[str] = mapped_column(String(255))
     due_at: Mapped[datetime] = mapped_column(DateTime)
@@ -28,6 +29,7 @@ class Exam(Base):
 
 class Question(Base):
     __tablename__ = "questions"
+    __table_args__ = (Index("ix_questions_exam_id_idx", "exam_id", "idx"),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     exam_id: Mapped[int] = mapped_column(ForeignKey("exams.id"))
     idx: Mapped[int] = mapped_column(Integer)
@@ -37,14 +39,25 @@ class Question(Base):
 
 class Submission(Base):
     __tablename__ = "submissions"
+    __table_args__ = (
+        Index("ix_submissions_exam_id_status", "exam_id", "status"),
+        Index("ix_submissions_exam_id_submitted_at", "exam_id", "submitted_at"),
+        Index("ix_submissions_student_id_submitted_at", "student_id", "submitted_at"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     exam_id: Mapped[int] = mapped_column(ForeignKey("exams.id"))
     student_id: Mapped[str] = mapped_column(ForeignKey("users.id"))
     submitted_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    status: Mapped[str] = mapped_column(String(16), default="PENDING")
+    status: Mapped[str] = mapped_column(String(16), default="PENDING")  # PENDING|GRADED|FAILED
+    # Pipeline bookkeeping (services/pipeline.py)
+    failed_stage: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    similarity_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
 class Answer(Base):
     __tablename__ = "answers"
+    __table_args__ = (Index("ix_answers_submission_id", "submission_id"),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     submission_id: Mapped[int] = mapped_column(ForeignKey("submissions.id"))
     question_id: Mapped[int] = mapped_column(ForeignKey("questions.id"))
@@ -55,10 +68,16 @@ class Grade(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     submission_id: Mapped[int] = mapped_column(ForeignKey("submissions.id"), unique=True)
     total: Mapped[float] = mapped_column(Float)
-    breakdown: Mapped[dict] = mapped_column(JSON)
+    # Deferred: per-question rationales are only read by detail views
+    breakdown: Mapped[dict] = mapped_column(JSON, deferred=True)
 
 class SimilarityFlag(Base):
     __tablename__ = "similarity_flags"
+    __table_args__ = (
+        Index("ix_similarity_flags_exam_id_sem", "exam_id", "sem"),
+        Index("ix_similarity_flags_submission_a", "submission_a"),
+        Index("ix_similarity_flags_submission_b", "submission_b"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     exam_id: Mapped[int] = mapped_column(ForeignKey("exams.id"))
     submission_a: Mapped[int] = mapped_column(ForeignKey("submissions.id"))
@@ -66,26 +85,141 @@ class SimilarityFlag(Base):
     question_id: Mapped[int] = mapped_column(ForeignKey("questions.id"))
     sem: Mapped[float] = mapped_column(Float)
     jacc: Mapped[float] = mapped_column(Float)
+    severity: Mapped[str] = mapped_column(String(8), index=True, default="MEDIUM")  # "HIGH" | "MEDIUM"
     reason: Mapped[str] = mapped_column(Text)
 
 class ExamEnrollment(Base):
     """Links a student to an exam they joined via enrollment code."""
     __tablename__ = "exam_enrollments"
-    __table_args__ = (UniqueConstraint("exam_id", "student_id"),)
+    __table_args__ = (
+        UniqueConstraint("exam_id", "student_id"),
+        Index("ix_exam_enrollments_student_id", "student_id"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     exam_id: Mapped[int] = mapped_column(ForeignKey("exams.id"))
     student_id: Mapped[str] = mapped_column(ForeignKey("users.id"))
 
+class Blob(Base):
+    """A stored upload, addressed by the SHA-256 of its bytes and shared by reference."""
+    __tablename__ = "blobs"
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int] = mapped_column(Integer)
+    path: Mapped[str] = mapped_column(String(512))
+    refcount: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    claimed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)  # last upload of these bytes
+
 class SolutionDoc(Base):
     __tablename__ = "solution_docs"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     exam_id: Mapped[int] = mapped_column(ForeignKey("exams.id"), unique=True, index=True)
     file_path: Mapped[str] = mapped_column(String(512))
-    extracted_text: Mapped[str] = mapped_column(Text)
+    blob_sha256: Mapped[Optional[str]] = mapped_column(ForeignKey("blobs.sha256"), index=True, nullable=True)
+    assets_version: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)  # per-question bundle, see solution_assets
+    extracted_text: Mapped[str] = mapped_column(Text, deferred=True)  # legacy JSON; pages live in doc_pages
 
 class SubmissionDoc(Base):
     __tablename__ = "submission_docs"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     submission_id: Mapped[int] = mapped_column(ForeignKey("submissions.id"), unique=True, index=True)
     file_path: Mapped[str] = mapped_column(String(512))
-    extracted_text: Mapped[str] = mapped_column(Text)
+    blob_sha256: Mapped[Optional[str]] = mapped_column(ForeignKey("blobs.sha256"), index=True, nullable=True)
+    extracted_text: Mapped[str] = mapped_column(Text, deferred=True)  # legacy JSON; pages live in doc_pages
+
+class DocPage(Base):
+    """One rendered page of a solution or submission PDF (exactly one doc FK is set)."""
+    __tablename__ = "doc_pages"
+    __table_args__ = (
+        Index("ix_doc_pages_solution_doc_id_page_no", "solution_doc_id", "page_no", unique=True),
+        Index("ix_doc_pages_submission_doc_id_page_no", "submission_doc_id", "page_no", unique=True),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    solution_doc_id: Mapped[Optional[int]] = mapped_column(ForeignKey("solution_docs.id"), nullable=True)
+    submission_doc_id: Mapped[Optional[int]] = mapped_column(ForeignKey("submission_docs.id"), nullable=True)
+    page_no: Mapped[int] = mapped_column(Integer)  # 1-based
+    image_path: Mapped[str] = mapped_column(String(512))
+    image_sha256: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    width: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    height: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    ocr_text: Mapped[Optional[str]] = mapped_column(Text, nullable=True, deferred=True)
+    text_layer: Mapped[bool] = mapped_column(Boolean, default=False)  # ocr_text came from the PDF
+
+class PageSpan(Base):
+    """Vertical band (relative y in [0,1]) of a page that belongs to question q_idx."""
+    __tablename__ = "page_spans"
+    __table_args__ = (Index("ix_page_spans_page_id_q_idx", "page_id", "q_idx"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    page_id: Mapped[int] = mapped_column(ForeignKey("doc_pages.id"))
+    q_idx: Mapped[int] = mapped_column(Integer)
+    y_top: Mapped[float] = mapped_column(Float)
+    y_bottom: Mapped[float] = mapped_column(Float)
+
+class Job(Base):
+    """A long-running professor operation (bulk import, ...) and its progress."""
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_exam_id_kind", "exam_id", "kind"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(32))  # "import" | "regrade" | "retry"
+    exam_id: Mapped[int] = mapped_column(ForeignKey("exams.id"))
+    created_by: Mapped[str] = mapped_column(ForeignKey("users.id"))
+    status: Mapped[str] = mapped_column(String(16), default="QUEUED")  # QUEUED|RUNNING|DONE|FAILED
+    params: Mapped[dict] = mapped_column(JSON, default=dict)
+    blob_sha256: Mapped[Optional[str]] = mapped_column(ForeignKey("blobs.sha256"), nullable=True)
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    done: Mapped[int] = mapped_column(Integer, default=0)
+    failed: Mapped[int] = mapped_column(Integer, default=0)
+    results: Mapped[Optional[list]] = mapped_column(JSON, nullable=True, deferred=True)  # per-item summary
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+class JobItem(Base):
+    """Per-submission checkpoint of a job: PENDING → DONE | FAILED."""
+    __tablename__ = "job_items"
+    __table_args__ = (
+        UniqueConstraint("job_id", "submission_id"),
+        Index("ix_job_items_job_id_status", "job_id", "status"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[int] = mapped_column(ForeignKey("jobs.id"))
+    submission_id: Mapped[int] = mapped_column(ForeignKey("submissions.id"))
+    status: Mapped[str] = mapped_column(String(16), default="PENDING")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class QuestionResult(Base):
+    """One graded question of a submission within a grading run (e.g. "regrade:12")."""
+    __tablename__ = "question_results"
+    __table_args__ = (UniqueConstraint("submission_id", "run", "question_id"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    submission_id: Mapped[int] = mapped_column(ForeignKey("submissions.id"))
+    question_id: Mapped[int] = mapped_column(ForeignKey("questions.id"))
+    run: Mapped[str] = mapped_column(String(40))
+    result: Mapped[dict] = mapped_column(JSON)  # {points, feedback}
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class QueueTask(Base):
+    """A unit of work for app.worker, claimed under a lease (see services/queue.py)."""
+    __tablename__ = "queue_tasks"
+    __table_args__ = (
+        Index("ix_queue_tasks_status_available_at", "status", "available_at"),
+        Index("ix_queue_tasks_submission_id", "submission_id"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(32))  # "stages" | "regrade" | "retry" | "import"
+    payload: Mapped[dict] = mapped_column(JSON, default=dict)
+    submission_id: Mapped[Optional[int]] = mapped_column(ForeignKey("submissions.id"), nullable=True)
+    exam_id: Mapped[Optional[int]] = mapped_column(ForeignKey("exams.id"), nullable=True)
+    priority: Mapped[int] = mapped_column(Integer, default=0)
+    status: Mapped[str] = mapped_column(String(16), default="QUEUED")  # QUEUED|CLAIMED|DONE|DEAD
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=3)
+    lease_owner: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    available_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
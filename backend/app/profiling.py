@@ -0,0 +1,178 @@
+"""
+On-demand wall-clock profiling of single requests.
+
+A request is profiled when it carries ``X-Profile: <PROFILE_TOKEN>`` or is
+picked by ``PROFILE_SAMPLE_RATE``. While it runs, a sampler thread records
+the stack of every thread that is executing app code (the route's
+threadpool thread and any executor work it starts) every
+``PROFILE_INTERVAL_MS``. Waiting time, such as DB or model calls, shows up
+because these are wall-clock samples.
+
+Each result is written to ``PROFILE_DIR`` as a folded-stack file
+(``thread;outer;...;leaf count``), which flamegraph.pl, speedscope and
+inferno all read. A JSON sidecar holds the route, exam id, status and
+timing. Both are served by ``GET /profiles`` to holders of the token.
+
+When neither setting is on, the middleware is not installed at all.
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = str(Path(__file__).resolve().parent)
+HEADER = "x-profile"
+
+_busy = threading.Lock()  # one profile at a time keeps the overhead bounded
+
+
+def enabled() -> bool:
+    return bool(settings.PROFILE_TOKEN) or settings.PROFILE_SAMPLE_RATE > 0
+
+
+def profile_dir() -> Path:
+    path = Path(settings.PROFILE_DIR or os.path.join(settings.UPLOAD_DIR, "profiles"))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def authorized(token: Optional[str]) -> bool:
+    return bool(settings.PROFILE_TOKEN) and token == settings.PROFILE_TOKEN
+
+
+# ── Sampler ───────────────────────────────────────────────────────────────────
+
+class Sampler(threading.Thread):
+    """Collects folded stacks of threads running app code until stop()."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        me = threading.get_ident()
+        while not self._halt.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack, in_app = [], False
+                while frame is not None:
+                    code = frame.f_code
+                    in_app = in_app or code.co_filename.startswith(APP_DIR)
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if in_app:  # skip idle pool threads and the event loop
+                    stack.append(names.get(tid, f"thread-{tid}"))
+                    self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._halt.set()
+        self.join()
+
+
+# ── Storage ───────────────────────────────────────────────────────────────────
+
+def _slug(route: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_")[:60] or "root"
+
+
+def save(sampler: Sampler, meta: Dict[str, Any]) -> str:
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    exam = f"-exam{meta['exam_id']}" if meta.get("exam_id") else ""
+    name = f"{stamp}-{meta['method'].lower()}-{_slug(meta['route'])}{exam}"
+    folder = profile_dir()
+    with open(folder / f"{name}.folded", "w") as f:
+        for stack, n in sampler.stacks.most_common():
+            f.write(f"{stack} {n}\n")
+    (folder / f"{name}.json").write_text(json.dumps({**meta, "id": name, "samples": sampler.samples}))
+    _prune(folder)
+    return name
+
+
+def _prune(folder: Path) -> None:
+    metas = sorted(folder.glob("*.json"))
+    for old in metas[:max(0, len(metas) - settings.PROFILE_KEEP)]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".folded").unlink(missing_ok=True)
+
+
+def listing(limit: int = 100) -> List[Dict[str, Any]]:
+    out = []
+    for meta in sorted(profile_dir().glob("*.json"), reverse=True)[:limit]:
+        try:
+            out.append(json.loads(meta.read_text()))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def path_for(profile_id: str) -> Optional[Path]:
+    if not re.fullmatch(r"[\w.-]+", profile_id):
+        return None
+    path = profile_dir() / f"{profile_id}.folded"
+    return path if path.exists() else None
+
+
+# ── Middleware ────────────────────────────────────────────────────────────────
+
+async def middleware(request, call_next):
+    requested = HEADER in request.headers
+    if requested and not authorized(request.headers[HEADER]):
+        requested = False
+    if not (requested or random.random() < settings.PROFILE_SAMPLE_RATE):
+        return await call_next(request)
+    if not _busy.acquire(blocking=False):
+        return await call_next(request)
+
+    from .metrics import route_template
+
+    sampler = Sampler(settings.PROFILE_INTERVAL_MS / 1000)
+    started = time.perf_counter()
+    sampler.start()
+    status = 500
+    response = None
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        sampler.stop()
+        _busy.release()
+        params = request.scope.get("path_params") or {}
+        meta = {
+            "method": request.method,
+            "route": route_template(request.scope),
+            "path": request.url.path,
+            "exam_id": params.get("exam_id") or request.query_params.get("exam_id"),
+            "status": status,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "trigger": "header" if requested else "sampled",
+            "created_at": datetime.utcnow().isoformat() + "Z",
+        }
+        try:
+            profile_id = save(sampler, meta)
+            logger.info(f"[profile] {meta['method']} {meta['route']} "
+                        f"{meta['duration_ms']} ms → {profile_id}")
+        except OSError as exc:
+            profile_id = None
+            logger.warning(f"[profile] could not save profile: {exc}")
+    if profile_id and requested:
+        response.headers["X-Profile-Id"] = profile_id
+    return response
@@ -0,0 +1,162 @@
+"""
+Query budgets for the read endpoints, checked against a seeded large exam.
+
+    python -m app.query_budget                          # 300 students, 10 questions
+    python -m app.query_budget --students 2000 --verbose
+
+Runs against a throwaway SQLite database (never DATABASE_URL). Each endpoint
+has a fixed statement budget that must not grow with class size, and no
+statement shape may repeat QUERY_REPEAT_THRESHOLD times — the signature of a
+per-row query. Exits 1 on any violation.
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from fastapi import Request
+
+# (method, path, role, max statements). {exam}/{sub}/{job} are filled in after seeding.
+BUDGETS: List[Tuple[str, str, str, int]] = [
+    ("GET", "/auth/me", "prof", 1),
+    ("GET", "/prof/exams", "prof", 5),
+    ("GET", "/prof/exams/{exam}/submissions", "prof", 4),
+    ("GET", "/prof/exams/{exam}/stats", "prof", 5),
+    ("GET", "/prof/exams/{exam}/export_csv", "prof", 3),
+    ("GET", "/prof/exams/{exam}/flags", "prof", 3),
+    ("GET", "/prof/exams/{exam}/solution_pages", "prof", 3),
+    ("GET", "/prof/submissions/{sub}", "prof", 7),
+    ("GET", "/prof/jobs/{job}", "prof", 3),
+    ("GET", "/prof/exams/{exam}/queue", "prof", 4),
+    ("GET", "/student/exams/open", "student", 2),
+    ("GET", "/student/submissions", "student", 2),
+    ("GET", "/student/submissions/{sub}", "student", 3),
+]
+
+
+def seed(db, students: int, questions: int, pages: int) -> dict:
+    """
+    One professor with a dozen exams, one of them with *students* graded
+    submissions, flags and a finished job.
+    """
+    from . import models
+
+    prof = models.User(id="prof-budget", email="prof@budget.test", role="PROF")
+    db.add(prof)
+    exam = models.Exam(title="Budget exam", due_at=datetime.utcnow() + timedelta(days=7),
+                       created_by=prof.id)
+    db.add(exam)
+    db.flush()
+    db.add_all(models.Exam(title=f"Other exam {n}", due_at=exam.due_at, created_by=prof.id)
+               for n in range(11))
+    qs = [models.Question(exam_id=exam.id, idx=i, prompt=f"Q{i}", max_points=10.0, answer_key={})
+          for i in range(1, questions + 1)]
+    db.add_all(qs)
+    sol = models.SolutionDoc(exam_id=exam.id, file_path="solution.pdf", extracted_text="")
+    db.add(sol)
+    db.flush()
+    db.add_all(models.DocPage(solution_doc_id=sol.id, page_no=p, image_path=f"pages/sol/{p}.png")
+               for p in range(1, pages + 1))
+
+    subs = []
+    for n in range(students):
+        user = models.User(id=f"student-{n}", email=f"s{n}@budget.test", role="STUDENT")
+        db.add(user)
+        db.add(models.ExamEnrollment(exam_id=exam.id, student_id=user.id))
+        sub = models.Submission(exam_id=exam.id, student_id=user.id, status="GRADED")
+        db.add(sub)
+        subs.append(sub)
+    db.flush()
+    for n, sub in enumerate(subs):
+        doc = models.SubmissionDoc(submission_id=sub.id, file_path=f"{n}.pdf", extracted_text="")
+        db.add(doc)
+        db.flush()
+        db.add_all(models.DocPage(submission_doc_id=doc.id, page_no=p, image_path=f"pages/{n}/{p}.png")
+                   for p in range(1, pages + 1))
+        breakdown = {str(q.id): {"points": 7.0, "feedback": {"rationale": "ok", "strengths": [],
+                                                             "missing": []}} for q in qs}
+        db.add(models.Grade(submission_id=sub.id, total=7.0 * questions, breakdown=breakdown))
+        db.add_all(models.Answer(submission_id=sub.id, question_id=q.id, text="[image]") for q in qs)
+        if n % 10 == 1:
+            db.add(models.SimilarityFlag(exam_id=exam.id, submission_a=subs[n - 1].id,
+                                         submission_b=sub.id, question_id=qs[0].id, sem=0.97,
+                                         jacc=0.9, severity="HIGH", reason="seeded"))
+    job = models.Job(kind="regrade", exam_id=exam.id, created_by=prof.id, params={},
+                     total=students, status="DONE")
+    db.add(job)
+    db.flush()
+    db.add_all(models.JobItem(job_id=job.id, submission_id=s.id, status="DONE") for s in subs)
+    db.commit()
+    return {"exam": exam.id, "sub": subs[0].id, "job": job.id,
+            "prof": prof.id, "student": subs[0].student_id}
+
+
+def _header_user(request: Request):
+    """Stands in for token auth: the user id comes from the X-Budget-User header."""
+    from . import models
+    from .database import SessionLocal
+
+    with SessionLocal() as db:
+        user = db.get(models.User, request.headers["x-budget-user"])
+        db.expunge(user)
+        return user
+
+
+def run(students: int, questions: int, pages: int, verbose: bool) -> int:
+    from fastapi.testclient import TestClient
+
+    from . import migrations, querystats
+    from .database import SessionLocal, engine
+    from .deps import get_current_user
+    from .main import app
+
+    migrations.upgrade(engine)
+    with SessionLocal() as db:
+        ids = seed(db, students, questions, pages)
+
+    app.dependency_overrides[get_current_user] = _header_user
+    client = TestClient(app)
+    failures = 0
+    for method, template, role, limit in BUDGETS:
+        path = template.format(**ids)
+        headers = {"x-budget-user": ids[role]}
+        try:
+            with querystats.assert_max_queries(limit) as stats:
+                resp = client.request(method, path, headers=headers)
+            status = "ok" if resp.status_code < 400 else f"HTTP {resp.status_code}"
+            if resp.status_code >= 400:
+                failures += 1
+        except querystats.TooManyQueries as exc:
+            failures += 1
+            status = f"OVER BUDGET: {exc}"
+        print(f"{method:<4} {template:<42} {stats.count:>4}/{limit:<3} {status}")
+        if verbose and status == "ok":
+            print("     " + stats.summary().replace("\n", "\n     "))
+    app.dependency_overrides.pop(get_current_user, None)
+    print(f"\n{len(BUDGETS) - failures}/{len(BUDGETS)} endpoints within budget "
+          f"({students} students × {questions} questions)")
+    return 1 if failures else 0
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.query_budget")
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--verbose", action="store_true", help="print statement shapes per endpoint")
+    args = parser.parse_args(argv)
+
+    if "app.database" in sys.modules:
+        raise SystemExit("run as `python -m app.query_budget` (needs its own database)")
+    scratch = tempfile.mkdtemp(prefix="query-budget-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{scratch}/budget.db"
+    os.environ["UPLOAD_DIR"] = os.path.join(scratch, "uploads")
+    os.environ.setdefault("FAST_START", "1")
+    return run(args.students, args.questions, args.pages, args.verbose)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
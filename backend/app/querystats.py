@@ -0,0 +1,139 @@
+"""
+Per-request SQL accounting and N+1 detection.
+
+SQLAlchemy cursor events feed whatever ``track()`` blocks are active in the
+current context (the HTTP middleware opens one per request). Each statement
+is reduced to its *shape* — literals and IN-lists collapsed — so a loop that
+runs ``SELECT ... WHERE submission_id = ?`` once per row shows up as one
+shape repeated N times.
+
+    with querystats.assert_max_queries(12):
+        client.get("/prof/exams/1/submissions")
+
+``python -m app.query_budget`` runs those checks against a seeded large exam.
+"""
+from __future__ import annotations
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_active: ContextVar[Tuple["QueryStats", ...]] = ContextVar("querystats", default=())
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PARAM = r"(?:\?|%s|:\w+|\$\d+|\[POSTCOMPILE_\w+\])"
+_IN_LISTS = re.compile(r"\(\s*" + _PARAM + r"(?:\s*,\s*" + _PARAM + r")*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def shape(statement: str) -> str:
+    """Statement with literals, numbers and parameter lists collapsed."""
+    s = _STRINGS.sub("?", statement)
+    s = _NUMBERS.sub("?", s)
+    s = _IN_LISTS.sub("(?)", s)
+    return _SPACE.sub(" ", s).strip()
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds", "shapes")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: Counter = Counter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[shape(statement)] += 1
+
+    def repeated(self, threshold: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Shapes run at least *threshold* times — the N+1 suspects."""
+        threshold = threshold or settings.QUERY_REPEAT_THRESHOLD
+        return [(s, n) for s, n in self.shapes.most_common() if n >= threshold]
+
+    def summary(self, top: int = 5) -> str:
+        lines = [f"{self.count} queries, {self.seconds * 1000:.1f} ms"]
+        lines += [f"  {n:>4}x  {s[:200]}" for s, n in self.shapes.most_common(top)]
+        return "\n".join(lines)
+
+
+@contextmanager
+def track() -> Iterator[QueryStats]:
+    """Count the statements run inside the block (on this context, nested blocks included)."""
+    stats = QueryStats()
+    token = _active.set(_active.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+
+
+def install(engine) -> None:
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        if _active.get():
+            conn.info.setdefault("querystats_t0", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _end(conn, cursor, statement, parameters, context, executemany):
+        active = _active.get()
+        if not active:
+            return
+        started = conn.info.get("querystats_t0")
+        elapsed = time.perf_counter() - started.pop() if started else 0.0
+        for stats in active:
+            stats.record(statement, elapsed)
+
+
+# ── Request reporting ─────────────────────────────────────────────────────────
+
+def report(stats: QueryStats, method: str, route: str) -> Dict[str, str]:
+    """Log N+1 suspects and heavy requests; returns debug headers (empty unless enabled)."""
+    repeated = stats.repeated()
+    for statement, n in repeated:
+        logger.warning(f"[n+1] {method} {route}: {n}x {statement[:300]}")
+    if stats.count >= settings.QUERY_LOG_COUNT:
+        logger.info(f"[queries] {method} {route}: {stats.summary()}")
+    if not settings.QUERY_DEBUG_HEADERS:
+        return {}
+    return {
+        "X-DB-Queries": str(stats.count),
+        "X-DB-Time-Ms": f"{stats.seconds * 1000:.1f}",
+        "X-DB-Repeated": str(max((n for _, n in repeated), default=0)),
+    }
+
+
+# ── Test helper ───────────────────────────────────────────────────────────────
+
+class TooManyQueries(AssertionError):
+    pass
+
+
+@contextmanager
+def assert_max_queries(limit: int, *, repeat_limit: Optional[int] = None) -> Iterator[QueryStats]:
+    """
+    Fail if the block runs more than *limit* statements, or any one shape more
+    than *repeat_limit* times (default: QUERY_REPEAT_THRESHOLD - 1).
+    """
+    repeat_limit = repeat_limit if repeat_limit is not None else settings.QUERY_REPEAT_THRESHOLD - 1
+    with track() as stats:
+        yield stats
+    problems = []
+    if stats.count > limit:
+        problems.append(f"{stats.count} queries (limit {limit})")
+    worst = stats.shapes.most_common(1)
+    if worst and worst[0][1] > repeat_limit:
+        problems.append(f"statement repeated {worst[0][1]}x (limit {repeat_limit})")
+    if problems:
+        raise TooManyQueries("; ".join(problems) + "\n" + stats.summary())
@@ -2,8 +2,7 @@ from datetime import datetime, timezone, timedelta
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from .. import models
-from ..deps import get_db, get_current_user
-from ..deps import _supabase
+from ..deps import get_db, get_current_user, invalidate_user, supabase_client
 
 router = APIRouter()
 
@@ -19,7 +18,7 @@ def init_profile(payload: dict, db: Session = Depends(get_db)):
     if not user_id:
         raise HTTPException(400, "user_id required")
     try:
-        resp = _supabase.auth.admin.get_user_by_id(user_id)
+        resp = supabase_client().auth.admin.get_user_by_id(user_id)
         sb_user = resp.user
         if not sb_user:
             raise HTTPException(400, "User not found")
@@ -39,6 +38,7 @@ def init_profile(payload: dict, db: Session = Depends(get_db)):
     else:
         db.add(models.User(id=str(sb_user.id), email=sb_user.email, role=role))
     db.commit()
+    invalidate_user(str(sb_user.id))
     return {"ok": True}
 
 
@@ -55,6 +55,7 @@ def create_profile(payload: dict, db: Session = Depends(get_db),
     else:
         db.add(models.User(id=user.id, email=user.email, role=role))
     db.commit()
+    invalidate_user(user.id)
     return {"id": user.id, "email": user.email, "role": role}
 
 
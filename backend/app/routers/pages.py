@@ -0,0 +1,99 @@
+# AUTOGRADEAI/backend/app/routers/pages.py
+from email.utils import parsedate_to_datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session, aliased
+from typing import Optional
+import hashlib, os
+
+from .. import models
+from ..deps import get_db, get_current_user
+from ..services import storage
+
+router = APIRouter()
+
+# URLs from page_urls carry the image hash (v=…), so their bytes never change.
+# Page ids can be reused after a re-upload, so a bare /pages/{id} revalidates.
+_CACHE_IMMUTABLE = "private, max-age=31536000, immutable"
+_CACHE_REVALIDATE = "private, no-cache"
+_MEDIA_TYPES = {"full": "image/png", "thumb": "image/webp", "preview": "image/webp"}
+
+
+def page_urls(page_id: int, image_sha256: Optional[str] = None) -> dict:
+    version = f"&v={image_sha256[:16]}" if image_sha256 else ""
+    base = f"/pages/{page_id}"
+    return {
+        "url": f"{base}?variant=full{version}",
+        "preview_url": f"{base}?variant=preview{version}",
+        "thumb_url": f"{base}?variant=thumb{version}",
+    }
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return etag in {t.strip() for t in inm.split(",")} or inm.strip() == "*"
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@router.get("/{page_id}")
+def get_page_image(
+    page_id: int,
+    request: Request,
+    variant: str = Query("preview", pattern="^(full|preview|thumb)$"),
+    v: Optional[str] = Query(None, max_length=64),
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Serve a solution or submission page (or a WebP derivative) with HTTP validators."""
+    SolExam = aliased(models.Exam)
+    SubExam = aliased(models.Exam)
+    row = db.execute(
+        select(
+            models.DocPage.image_path,
+            models.DocPage.image_sha256,
+            SolExam.created_by,
+            models.Submission.student_id,
+            SubExam.created_by,
+        )
+        .outerjoin(models.SolutionDoc, models.SolutionDoc.id == models.DocPage.solution_doc_id)
+        .outerjoin(SolExam, SolExam.id == models.SolutionDoc.exam_id)
+        .outerjoin(models.SubmissionDoc, models.SubmissionDoc.id == models.DocPage.submission_doc_id)
+        .outerjoin(models.Submission, models.Submission.id == models.SubmissionDoc.submission_id)
+        .outerjoin(SubExam, SubExam.id == models.Submission.exam_id)
+        .where(models.DocPage.id == page_id)
+    ).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Page not found")
+    key, image_sha, solution_owner, student_id, submission_owner = row
+    allowed = (
+        (user.role == "PROF" and user.id in {solution_owner, submission_owner})
+        or (user.role == "STUDENT" and student_id is not None and user.id == student_id)
+    )
+    if not allowed:
+        raise HTTPException(status_code=404, detail="Page not found")
+
+    try:
+        path = (
+            storage.fetch([key])[0] if variant == "full"
+            else storage.derivative(key, variant)
+        )
+        stat = os.stat(path)
+    except (FileNotFoundError, OSError):
+        raise HTTPException(status_code=404, detail="Page image missing")
+
+    tag = image_sha or hashlib.sha256(key.encode()).hexdigest()
+    etag = f'"{tag[:32]}-{variant}"'
+    immutable = bool(v and image_sha and image_sha.startswith(v))
+    headers = {"ETag": etag, "Cache-Control": _CACHE_IMMUTABLE if immutable else _CACHE_REVALIDATE}
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+    # FileResponse adds Last-Modified/Content-Length and answers Range requests.
+    return FileResponse(path, media_type=_MEDIA_TYPES[variant], headers=headers, stat_result=stat)
@@ -1,21 +1,21 @@
 # AUTOGRADEAI/backend/app/routers/professor.py
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Form, Query
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from datetime import datetime, timezone
-from pathlib import Path
-import csv, io, json
+from sqlalchemy import case, func, or_
+from sqlalchemy.orm import Session, aliased, undefer
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import csv, io
 
 from .. import schemas, models
 from ..deps import get_db, get_current_user
-from ..utils.images import pdf_to_pngs
-from ..services.grading_vision import detect_question_spans
+from ..config import settings
+from ..services import admission, documents, imports, jobs, pipeline, queue, regrade, scheduler, solution_assets, storage
+from ..services.spans import detect_spans
+from .pages import page_urls
 
 router = APIRouter()
 
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-
 
 # ── Role guards ───────────────────────────────────────────────────────────────
 
@@ -87,44 +87,41 @@ def list_my_exams(prof=Depends(get_prof), db: Session = Depends(get_db)):
         .order_by(models.Exam.id.asc())
         .all()
     )
-    result = []
-    for e in exams:
-        sub_count = (
-            db.query(models.Submission)
-            .filter(models.Submission.exam_id == e.id)
-            .count()
-        )
-        graded_count = (
-            db.query(models.Submission)
-            .filter(
-                models.Submission.exam_id == e.id,
-                models.Submission.status == "GRADED",
-            )
-            .count()
-        )
-        has_solution = bool(
-            db.query(models.SolutionDoc)
-            .filter(models.SolutionDoc.exam_id == e.id)
-            .first()
+    ids = [e.id for e in exams]
+    # Per-exam counts in one grouped query each, not four queries per exam
+    sub_counts = {
+        exam_id: (total, graded or 0)
+        for exam_id, total, graded in db.query(
+            models.Submission.exam_id,
+            func.count(models.Submission.id),
+            func.sum(case((models.Submission.status == "GRADED", 1), else_=0)),
         )
-        flag_count = (
-            db.query(models.SimilarityFlag)
-            .filter(models.SimilarityFlag.exam_id == e.id)
-            .count()
-        )
-        result.append(
-            {
-                "id": e.id,
-                "title": e.title,
-                "due_at": e.due_at,
-                "enrollment_code": e.enrollment_code,
-                "submission_count": sub_count,
-                "graded_count": graded_count,
-                "has_solution": has_solution,
-                "flag_count": flag_count,
-            }
-        )
-    return result
+        .filter(models.Submission.exam_id.in_(ids))
+        .group_by(models.Submission.exam_id)
+    }
+    with_solution = {
+        exam_id for (exam_id,) in db.query(models.SolutionDoc.exam_id)
+        .filter(models.SolutionDoc.exam_id.in_(ids))
+    }
+    flag_counts = dict(
+        db.query(models.SimilarityFlag.exam_id, func.count(models.SimilarityFlag.id))
+        .filter(models.SimilarityFlag.exam_id.in_(ids))
+        .group_by(models.SimilarityFlag.exam_id)
+        .all()
+    )
+    return [
+        {
+            "id": e.id,
+            "title": e.title,
+            "due_at": e.due_at,
+            "enrollment_code": e.enrollment_code,
+            "submission_count": sub_counts.get(e.id, (0, 0))[0],
+            "graded_count": sub_counts.get(e.id, (0, 0))[1],
+            "has_solution": e.id in with_solution,
+            "flag_count": flag_counts.get(e.id, 0),
+        }
+        for e in exams
+    ]
 
 
 # ── Upload solution PDF ───────────────────────────────────────────────────────
@@ -142,21 +139,24 @@ def upload_solution_pdf(
     if exam.created_by != prof.id:
         raise HTTPException(status_code=403, detail="Not your exam")
 
-    # Save PDF
-    dest = UPLOAD_DIR / f"exam_{exam_id}_solution.pdf"
-    with dest.open("wb") as f:
-        f.write(file.file.read())
-
-    # Convert → PNGs
-    img_dir = UPLOAD_DIR / f"exam_{exam_id}_solution_imgs"
-    solution_imgs = pdf_to_pngs(str(dest), str(img_dir))
-
-    # Detect question spans
-    spans = detect_question_spans(solution_imgs)
+    # Save PDF (content-addressed) → PNGs, reusing pages already rendered for this hash
+    try:
+        blob = storage.save_upload(file, db)
+    except storage.UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    solution_keys = storage.render_pages(blob.sha256)
+
+    # Detect question spans (headers from the text layer / OCR, else the vision model)
+    with scheduler.work_class(scheduler.INTERACTIVE, exam_id):
+        spans = detect_spans(solution_keys, storage.fetch(solution_keys), blob.sha256)
+    texts = pipeline.text_layer(blob.sha256)
+    # Crop + encode each question's solution images once, not per student
+    assets_version = solution_assets.build_bundle(blob.sha256, solution_keys, spans)
     qnums = sorted({item["q_idx"] for item in spans}) or [1]
     per = round(100.0 / max(1, len(qnums)), 2)
 
-    # Upsert questions
+    # Upsert questions (nothing above writes to the database, so no lock is
+    # held across rendering or model calls)
     existing = (
         db.query(models.Question).filter(models.Question.exam_id == exam_id).all()
     )
@@ -177,24 +177,30 @@ def upload_solution_pdf(
             q.max_points = per
     db.commit()
 
-    # Save solution metadata
-    payload = {"images": solution_imgs, "spans": spans}
+    # Save solution metadata (pages + spans go to doc_pages / page_spans)
     doc = (
         db.query(models.SolutionDoc)
         .filter(models.SolutionDoc.exam_id == exam_id)
         .first()
     )
     if not doc:
-        db.add(
-            models.SolutionDoc(
-                exam_id=exam_id,
-                file_path=str(dest),
-                extracted_text=json.dumps(payload),
-            )
+        doc = models.SolutionDoc(
+            exam_id=exam_id,
+            file_path=blob.path,
+            blob_sha256=blob.sha256,
+            extracted_text="",
         )
-    else:
-        doc.file_path = str(dest)
-        doc.extracted_text = json.dumps(payload)
+        db.add(doc)
+        storage.retain(db, blob.sha256)
+    elif doc.blob_sha256 != blob.sha256:
+        storage.release(db, doc.blob_sha256)
+        storage.retain(db, blob.sha256)
+        doc.file_path = blob.path
+        doc.blob_sha256 = blob.sha256
+        doc.extracted_text = ""
+    db.flush()
+    documents.replace_solution_pages(db, doc, solution_keys, spans, texts)
+    doc.assets_version = assets_version
     db.commit()
 
     return {
@@ -202,10 +208,218 @@ def upload_solution_pdf(
         "questions_detected": len(qnums),
         "points_per_question": per,
         "total_points": round(per * len(qnums), 2),
-        "images_saved": len(solution_imgs),
+        "images_saved": len(solution_keys),
     }
 
 
+# ── Solution pages ────────────────────────────────────────────────────────────
+
+@router.get("/exams/{exam_id}/solution_pages")
+def list_solution_pages(
+    exam_id: int, prof=Depends(get_prof), db: Session = Depends(get_db)
+):
+    exam = db.get(models.Exam, exam_id)
+    if not exam or exam.created_by != prof.id:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    return [
+        {**p, **page_urls(p["page_id"], p["image_sha256"])}
+        for p in documents.solution_pages(db, exam_id)
+    ]
+
+
+# ── Bulk import of scanned exams ───────────────────────────────────────────────
+
+@router.post("/exams/{exam_id}/import", status_code=202)
+def import_scans(
+    exam_id: int,
+    background: BackgroundTasks,
+    file: UploadFile = File(...),
+    split: Optional[str] = Form(None),
+    pages_per_student: Optional[int] = Form(None),
+    prof=Depends(get_prof),
+    db: Session = Depends(get_db),
+):
+    """
+    Grade a whole class of paper exams: a ZIP of per-student PDFs (matched by
+    email or name in the file name), or one scan split by ``split=pages``
+    (with ``pages_per_student``) or ``split=cover``. Runs in the background;
+    poll GET /prof/jobs/{job_id}.
+    """
+    exam = db.get(models.Exam, exam_id)
+    if not exam or exam.created_by != prof.id:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    if not pipeline.has_solution(db, exam_id):
+        raise HTTPException(status_code=400, detail="Upload a solution PDF first")
+
+    head = file.file.read(4)
+    file.file.seek(0)
+    fmt = "zip" if head.startswith(b"PK") else "pdf"
+    if fmt == "pdf":
+        if split not in imports.SPLIT_MODES:
+            raise HTTPException(
+                status_code=400, detail="A single scan needs split=pages or split=cover"
+            )
+        if split == "pages" and not (pages_per_student or 0) >= 1:
+            raise HTTPException(status_code=400, detail="split=pages needs pages_per_student >= 1")
+
+    try:
+        blob = storage.save_upload(file, db, limit_mb=settings.IMPORT_MAX_UPLOAD_MB)
+    except storage.UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    job = models.Job(
+        kind="import",
+        exam_id=exam_id,
+        created_by=prof.id,
+        blob_sha256=blob.sha256,
+        params={
+            "filename": file.filename,
+            "format": fmt,
+            "split": split,
+            "pages_per_student": pages_per_student,
+        },
+    )
+    db.add(job)
+    storage.retain(db, blob.sha256)  # released when the job finishes
+    db.commit()
+    queue.start_job(db, job, background)
+    return {"job_id": job.id, "status": job.status}
+
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: int, prof=Depends(get_prof), db: Session = Depends(get_db)):
+    job = (
+        db.query(models.Job)
+        .options(undefer(models.Job.results))
+        .filter(models.Job.id == job_id, models.Job.created_by == prof.id)
+        .first()
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "exam_id": job.exam_id,
+        "status": job.status,
+        "total": job.total,
+        "done": job.done,
+        "failed": job.failed,
+        **jobs.progress(db, job),
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "error": job.error,
+        "results": job.results or [],
+    }
+
+
+# ── Grading load ──────────────────────────────────────────────────────────────
+
+@router.get("/queue")
+def grading_load(prof=Depends(get_prof), db: Session = Depends(get_db)):
+    """Queue depth plus this process's in-flight gradings and admission counters."""
+    return admission.stats(db)
+
+
+@router.get("/exams/{exam_id}/queue")
+def exam_grading_load(exam_id: int, prof=Depends(get_prof), db: Session = Depends(get_db)):
+    exam = db.get(models.Exam, exam_id)
+    if not exam or exam.created_by != prof.id:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    return admission.stats(db, exam_id)
+
+
+# ── Regrade after a solution change ───────────────────────────────────────────
+
+@router.post("/exams/{exam_id}/regrade", status_code=202)
+def regrade_exam(
+    exam_id: int,
+    background: BackgroundTasks,
+    prof=Depends(get_prof),
+    db: Session = Depends(get_db),
+):
+    """Re-run grading for every graded submission from its stored page images."""
+    exam = db.get(models.Exam, exam_id)
+    if not exam or exam.created_by != prof.id:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    if not pipeline.has_solution(db, exam_id):
+        raise HTTPException(status_code=400, detail="Upload a solution PDF first")
+    running = jobs.active_job(db, exam_id, "regrade")
+    if running:
+        raise HTTPException(status_code=409, detail=f"Regrade job {running.id} is already running")
+    job = regrade.start_regrade(db, exam_id, prof.id)
+    queue.start_job(db, job, background)
+    return {"job_id": job.id, "status": job.status, "total": job.total}
+
+
+@router.post("/jobs/{job_id}/resume", status_code=202)
+def resume_job(
+    job_id: int,
+    background: BackgroundTasks,
+    force: bool = Query(False, description="Resume a job left RUNNING by a crashed server"),
+    prof=Depends(get_prof),
+    db: Session = Depends(get_db),
+):
+    job = db.get(models.Job, job_id)
+    if not job or job.created_by != prof.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.kind not in jobs.ITEM_KINDS:
+        raise HTTPException(status_code=400, detail=f"{job.kind} jobs cannot be resumed")
+    if job.status in jobs.ACTIVE and not force:
+        raise HTTPException(status_code=409, detail="Job is still running (use force=true after a crash)")
+    if job.status == "DONE" and job.failed == 0:
+        raise HTTPException(status_code=400, detail="Nothing left to resume")
+    job.status = "QUEUED"
+    db.commit()
+    queue.start_job(db, job, background)
+    return {"job_id": job.id, "status": job.status, "remaining": job.total - job.done}
+
+
+# ── Retry failed submissions ──────────────────────────────────────────────────
+
+@router.post("/exams/{exam_id}/retry_failed", status_code=202)
+def retry_failed_submissions(
+    exam_id: int,
+    background: BackgroundTasks,
+    prof=Depends(get_prof),
+    db: Session = Depends(get_db),
+):
+    """Resume every failed (or stuck PENDING) submission from its failed stage."""
+    exam = db.get(models.Exam, exam_id)
+    if not exam or exam.created_by != prof.id:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    running = jobs.active_job(db, exam_id, "retry")
+    if running:
+        raise HTTPException(status_code=409, detail=f"Retry job {running.id} is already running")
+    stale = datetime.utcnow() - timedelta(minutes=settings.RETRY_STALE_MINUTES)
+    sub_ids = pipeline.retry_candidates(db, exam_id, stale)
+    if not sub_ids:
+        return {"job_id": None, "status": "DONE", "total": 0}
+    job = jobs.create_item_job(db, "retry", exam_id, prof.id, sub_ids)
+    queue.start_job(db, job, background)
+    return {"job_id": job.id, "status": job.status, "total": job.total}
+
+
+@router.post("/submissions/{submission_id}/retry")
+def retry_submission(
+    submission_id: int, prof=Depends(get_prof), db: Session = Depends(get_db)
+):
+    sub = db.get(models.Submission, submission_id)
+    exam = db.get(models.Exam, sub.exam_id) if sub else None
+    if not exam or exam.created_by != prof.id:
+        raise HTTPException(status_code=404, detail="Submission not found")
+    stale = datetime.utcnow() - timedelta(minutes=settings.RETRY_STALE_MINUTES)
+    if not (sub.failed_stage or (sub.status == "PENDING" and sub.submitted_at < stale)):
+        raise HTTPException(status_code=409, detail="Only failed or stuck submissions can be retried")
+    if db.query(queue.has_open_task(sub.id)).scalar() or jobs.in_active_job(db, sub.id):
+        raise HTTPException(status_code=409, detail="Submission is already queued or being graded")
+    try:
+        out = pipeline.run_stages(db, submission_id)
+    except pipeline.StageFailed as exc:
+        raise HTTPException(status_code=502, detail=str(exc))
+    db.refresh(sub)
+    return {**out, "failed_stage": sub.failed_stage}
+
+
 # ── Exam statistics ───────────────────────────────────────────────────────────
 
 @router.get("/exams/{exam_id}/stats")
@@ -216,22 +430,14 @@ def exam_stats(
     if not exam or exam.created_by != prof.id:
         raise HTTPException(status_code=404, detail="Exam not found")
 
-    subs = (
-        db.query(models.Submission)
+    rows = (
+        db.query(models.Submission.status, models.Grade.total)
+        .outerjoin(models.Grade, models.Grade.submission_id == models.Submission.id)
         .filter(models.Submission.exam_id == exam_id)
         .all()
     )
-    graded = [s for s in subs if s.status == "GRADED"]
-
-    grade_totals: list[float] = []
-    for s in graded:
-        g = (
-            db.query(models.Grade)
-            .filter(models.Grade.submission_id == s.id)
-            .first()
-        )
-        if g:
-            grade_totals.append(g.total)
+    graded = [total for status, total in rows if status == "GRADED"]
+    grade_totals: list[float] = [total for total in graded if total is not None]
 
     # 10-point buckets for distribution histogram
     distribution = {f"{i*10}-{(i+1)*10}": 0 for i in range(10)}
@@ -252,7 +458,7 @@ def exam_stats(
 
     return {
         "exam_id": exam_id,
-        "total_submissions": len(subs),
+        "total_submissions": len(rows),
         "graded_count": len(graded),
         "average": round(sum(grade_totals) / len(grade_totals), 2) if grade_totals else None,
         "min": round(min(grade_totals), 2) if grade_totals else None,
@@ -273,8 +479,16 @@ def export_grades_csv(
     if not exam or exam.created_by != prof.id:
         raise HTTPException(status_code=404, detail="Exam not found")
 
-    subs = (
-        db.query(models.Submission)
+    rows = (
+        db.query(
+            models.Submission.id,
+            models.User.email,
+            models.Submission.submitted_at,
+            models.Submission.status,
+            models.Grade.total,
+        )
+        .outerjoin(models.User, models.User.id == models.Submission.student_id)
+        .outerjoin(models.Grade, models.Grade.submission_id == models.Submission.id)
         .filter(models.Submission.exam_id == exam_id)
         .order_by(models.Submission.submitted_at.asc())
         .all()
@@ -285,20 +499,14 @@ def export_grades_csv(
     writer.writerow(
         ["submission_id", "student_email", "submitted_at", "status", "grade_total"]
     )
-    for s in subs:
-        student = db.get(models.User, s.student_id)
-        grade = (
-            db.query(models.Grade)
-            .filter(models.Grade.submission_id == s.id)
-            .first()
-        )
+    for sub_id, email, submitted_at, status, total in rows:
         writer.writerow(
             [
-                s.id,
-                student.email if student else "unknown",
-                s.submitted_at.isoformat(),
-                s.status,
-                grade.total if grade else "",
+                sub_id,
+                email or "unknown",
+                submitted_at.isoformat(),
+                status,
+                total if total is not None else "",
             ]
         )
 
@@ -353,41 +561,41 @@ def list_submissions_for_exam(
     if exam.created_by != prof.id:
         raise HTTPException(status_code=403, detail="Not your exam")
 
-    subs = (
-        db.query(models.Submission)
+    rows = (
+        db.query(
+            models.Submission.id,
+            models.Submission.student_id,
+            models.User.email,
+            models.Submission.submitted_at,
+            models.Submission.status,
+            models.Submission.failed_stage,
+            models.Grade.total,
+        )
+        .outerjoin(models.User, models.User.id == models.Submission.student_id)
+        .outerjoin(models.Grade, models.Grade.submission_id == models.Submission.id)
         .filter(models.Submission.exam_id == exam_id)
         .order_by(models.Submission.submitted_at.asc())
         .all()
     )
-    result = []
-    for s in subs:
-        student = db.get(models.User, s.student_id)
-        grade = (
-            db.query(models.Grade)
-            .filter(models.Grade.submission_id == s.id)
-            .first()
-        )
-        # Any flags involving this submission?
-        flagged = bool(
-            db.query(models.SimilarityFlag)
-            .filter(
-                (models.SimilarityFlag.submission_a == s.id)
-                | (models.SimilarityFlag.submission_b == s.id)
-            )
-            .first()
-        )
-        result.append(
-            {
-                "submission_id": s.id,
-                "student_id": s.student_id,
-                "student_email": student.email if student else "unknown",
-                "submitted_at": s.submitted_at,
-                "status": s.status,
-                "grade_total": grade.total if grade else None,
-                "flagged": flagged,
-            }
-        )
-    return result
+    # Submissions involved in any flag, in one pass over the exam's flags
+    flagged = set()
+    for a, b in db.query(models.SimilarityFlag.submission_a, models.SimilarityFlag.submission_b).filter(
+        models.SimilarityFlag.exam_id == exam_id
+    ):
+        flagged.update((a, b))
+    return [
+        {
+            "submission_id": sub_id,
+            "student_id": student_id,
+            "student_email": email or "unknown",
+            "submitted_at": submitted_at,
+            "status": status,
+            "failed_stage": failed_stage,
+            "grade_total": total,
+            "flagged": sub_id in flagged,
+        }
+        for sub_id, student_id, email, submitted_at, status, failed_stage, total in rows
+    ]
 
 
 # ── View single submission detail ─────────────────────────────────────────────
@@ -405,25 +613,20 @@ def view_submission(
         raise HTTPException(status_code=403, detail="Not your exam")
 
     grade = (
-        db.query(models.Grade).filter(models.Grade.submission_id == sub.id).first()
+        db.query(models.Grade)
+        .options(undefer(models.Grade.breakdown))
+        .filter(models.Grade.submission_id == sub.id)
+        .first()
     )
     answers = (
         db.query(models.Answer).filter(models.Answer.submission_id == sub.id).all()
     )
-    doc = (
-        db.query(models.SubmissionDoc)
-        .filter(models.SubmissionDoc.submission_id == sub.id)
-        .first()
-    )
     student = db.get(models.User, sub.student_id)
 
-    student_images: list = []
-    if doc:
-        try:
-            data = json.loads(doc.extracted_text or "{}")
-            student_images = data.get("images", [])
-        except Exception:
-            pass
+    pages = [
+        {**p, **page_urls(p["page_id"], p["image_sha256"])}
+        for p in documents.submission_pages(db, sub.id)
+    ]
 
     return {
         "submission_id": sub.id,
@@ -434,7 +637,7 @@ def view_submission(
         "grade_total": grade.total if grade else None,
         "breakdown": grade.breakdown if grade else {},
         "answers": [{"question_id": a.question_id, "text": a.text} for a in answers],
-        "student_images": student_images,
+        "pages": pages,
     }
 
 
@@ -442,37 +645,52 @@ def view_submission(
 
 @router.get("/exams/{exam_id}/flags")
 def get_flags(
-    exam_id: int, prof=Depends(get_prof), db: Session = Depends(get_db)
+    exam_id: int,
+    severity: Optional[str] = Query(None, pattern="^(HIGH|MEDIUM)$"),
+    min_score: Optional[float] = Query(None, ge=0.0, le=1.0),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size; all flags if omitted"),
+    offset: int = Query(0, ge=0),
+    prof=Depends(get_prof),
+    db: Session = Depends(get_db),
 ):
     exam = db.get(models.Exam, exam_id)
     if not exam or exam.created_by != prof.id:
         raise HTTPException(status_code=404, detail="Exam not found")
 
-    flags = (
-        db.query(models.SimilarityFlag)
-        .filter(models.SimilarityFlag.exam_id == exam_id)
-        .order_by(models.SimilarityFlag.sem.desc())
-        .all()
+    # One round trip: both submissions and both students are joined in SQL.
+    SubA = aliased(models.Submission)
+    SubB = aliased(models.Submission)
+    UserA = aliased(models.User)
+    UserB = aliased(models.User)
+    Flag = models.SimilarityFlag
+
+    q = (
+        db.query(Flag, UserA.email, UserB.email)
+        .outerjoin(SubA, SubA.id == Flag.submission_a)
+        .outerjoin(SubB, SubB.id == Flag.submission_b)
+        .outerjoin(UserA, UserA.id == SubA.student_id)
+        .outerjoin(UserB, UserB.id == SubB.student_id)
+        .filter(Flag.exam_id == exam_id)
     )
-    result = []
-    for f in flags:
-        sub_a = db.get(models.Submission, f.submission_a)
-        sub_b = db.get(models.Submission, f.submission_b)
-        student_a = db.get(models.User, sub_a.student_id) if sub_a else None
-        student_b = db.get(models.User, sub_b.student_id) if sub_b else None
-        severity = "HIGH" if (f.sem >= 0.95 or f.jacc >= 0.92) else "MEDIUM"
-        result.append(
-            {
-                "id": f.id,
-                "submission_a": f.submission_a,
-                "submission_b": f.submission_b,
-                "student_a_email": student_a.email if student_a else "unknown",
-                "student_b_email": student_b.email if student_b else "unknown",
-                "question_id": f.question_id,
-                "sem": round(f.sem, 3),
-                "jacc": round(f.jacc, 3),
-                "reason": f.reason,
-                "severity": severity,
-            }
-        )
-    return result
+    if severity:
+        q = q.filter(Flag.severity == severity)
+    if min_score is not None:
+        q = q.filter(or_(Flag.sem >= min_score, Flag.jacc >= min_score))
+    q = q.order_by(Flag.sem.desc(), Flag.id.asc()).offset(offset)
+    rows = (q.limit(limit) if limit else q).all()
+
+    return [
+        {
+            "id": f.id,
+            "submission_a": f.submission_a,
+            "submission_b": f.submission_b,
+            "student_a_email": email_a or "unknown",
+            "student_b_email": email_b or "unknown",
+            "question_id": f.question_id,
+            "sem": round(f.sem, 3),
+            "jacc": round(f.jacc, 3),
+            "reason": f.reason,
+            "severity": f.severity,
+        }
+        for f, email_a, email_b in rows
+    ]
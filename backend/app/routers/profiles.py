@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import FileResponse
+from typing import Optional
+
+from .. import profiling
+
+router = APIRouter()
+
+
+def _require_token(token: Optional[str]) -> None:
+    # Same secret as the X-Profile request header; hidden entirely when unset
+    if not profiling.authorized(token):
+        raise HTTPException(status_code=404, detail="Not found")
+
+
+@router.get("")
+def list_profiles(x_profile: Optional[str] = Header(None)):
+    _require_token(x_profile)
+    return profiling.listing()
+
+
+@router.get("/{profile_id}")
+def download_profile(profile_id: str, x_profile: Optional[str] = Header(None)):
+    """Folded stacks: `flamegraph.pl file > out.svg`, or open in speedscope."""
+    _require_token(x_profile)
+    path = profiling.path_for(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=path.name)
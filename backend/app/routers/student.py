@@ -1,18 +1,17 @@
 # AUTOGRADEAI/backend/app/routers/student.py
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, undefer
 from datetime import datetime
-from pathlib import Path
-import json
+import asyncio, json, logging
 
 from .. import schemas, models
 from ..deps import get_db, get_current_user
 from ..config import settings
-from ..utils.images import pdf_to_pngs
-from ..services.grading_vision import grade_question_images, detect_question_spans
-from ..services.similarity import ocr_images, run_similarity_check
+from ..services import admission, executors, pipeline, queue, scheduler, storage
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 # ── Role guard ────────────────────────────────────────────────────────────────
@@ -68,43 +67,64 @@ def list_open_exams(user=Depends(require_student), db: Session = Depends(get_db)
 
 @router.get("/submissions")
 def my_submissions(user=Depends(require_student), db: Session = Depends(get_db)):
-    """Return all submissions (with grades) for the current student."""
-    subs = (
-        db.query(models.Submission)
+    """Compact history for the current student — one query, no breakdown JSON."""
+    rows = (
+        db.query(
+            models.Submission.id,
+            models.Submission.exam_id,
+            models.Exam.title,
+            models.Submission.submitted_at,
+            models.Submission.status,
+            models.Grade.total,
+        )
+        .outerjoin(models.Exam, models.Exam.id == models.Submission.exam_id)
+        .outerjoin(models.Grade, models.Grade.submission_id == models.Submission.id)
         .filter(models.Submission.student_id == user.id)
         .order_by(models.Submission.submitted_at.desc())
         .all()
     )
-    result = []
-    for s in subs:
-        exam = db.get(models.Exam, s.exam_id)
-        grade = (
-            db.query(models.Grade)
-            .filter(models.Grade.submission_id == s.id)
-            .first()
-        )
-        result.append(
-            {
-                "submission_id": s.id,
-                "exam_id": s.exam_id,
-                "exam_title": exam.title if exam else "Unknown",
-                "submitted_at": s.submitted_at,
-                "status": s.status,
-                "grade_total": grade.total if grade else None,
-                "breakdown": grade.breakdown if grade else {},
-            }
-        )
-    return result
+    return [
+        {
+            "submission_id": sub_id,
+            "exam_id": exam_id,
+            "exam_title": title or "Unknown",
+            "submitted_at": submitted_at,
+            "status": status,
+            "grade_total": total,
+        }
+        for sub_id, exam_id, title, submitted_at, status, total in rows
+    ]
+
+
+@router.get("/submissions/{submission_id}")
+def my_submission_detail(
+    submission_id: int, user=Depends(require_student), db: Session = Depends(get_db)
+):
+    """Full per-question breakdown for one of the student's own submissions."""
+    sub = db.get(models.Submission, submission_id)
+    if not sub or sub.student_id != user.id:
+        raise HTTPException(status_code=404, detail="Submission not found")
+    grade = (
+        db.query(models.Grade)
+        .options(undefer(models.Grade.breakdown))
+        .filter(models.Grade.submission_id == sub.id)
+        .first()
+    )
+    return {
+        "submission_id": sub.id,
+        "exam_id": sub.exam_id,
+        "submitted_at": sub.submitted_at,
+        "status": sub.status,
+        "grade_total": grade.total if grade else None,
+        "breakdown": grade.breakdown if grade else {},
+    }
 
 
 # ── Submit exam PDF ───────────────────────────────────────────────────────────
 
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-
 
 @router.post("/exams/{exam_id}/submit_pdf")
-def submit_pdf(
+async def submit_pdf(
     exam_id: int,
     file: UploadFile = File(...),
     user=Depends(require_student),
@@ -113,130 +133,137 @@ def submit_pdf(
     """
     Student uploads their solved exam PDF.
     Converts to images, grades with GPT-4o Vision, then runs similarity check.
+    Async: waiting on the model holds no thread (see pipeline.run_stages_async).
+    """
+    accepted = await executors.run_blocking(_accept_submission, db, exam_id, file, user)
+    if accepted.get("queued"):
+        return accepted
+    try:
+        with scheduler.work_class(scheduler.INTERACTIVE, exam_id):
+            return await pipeline.run_stages_async(accepted["submission_id"], exam_id)
+    except pipeline.StageFailed as exc:
+        # Completed stages are kept; a retry picks up from the failed one.
+        raise HTTPException(status_code=502, detail=str(exc))
+    finally:
+        admission.release(exam_id)
+
+
+def _accept_submission(db: Session, exam_id: int, file: UploadFile, user) -> dict:
+    """
+    Admission, storage and the Submission row. Returns the queued response, or
+    {"submission_id"} for inline grading — still holding the admission slot,
+    which the caller releases.
     """
     exam = db.get(models.Exam, exam_id)
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
     if datetime.utcnow() > exam.due_at:
         raise HTTPException(status_code=403, detail="Deadline has passed")
+    # Before storing anything: an upload nothing references would never be swept
+    if not pipeline.has_solution(db, exam_id):
+        raise HTTPException(status_code=400, detail=str(pipeline.NoSolution()))
 
-    # ── Save PDF ──────────────────────────────────────────────────────────────
-    dest = UPLOAD_DIR / f"exam_{exam_id}_student_{user.id}.pdf"
-    with dest.open("wb") as f:
-        f.write(file.file.read())
-
-    # ── PDF → PNGs ────────────────────────────────────────────────────────────
-    img_dir = UPLOAD_DIR / f"exam_{exam_id}_student_{user.id}_imgs"
-    student_imgs = pdf_to_pngs(str(dest), str(img_dir))
-
-    # ── Auto-enroll if not already ────────────────────────────────────────────
-    if not db.query(models.ExamEnrollment).filter(
-        models.ExamEnrollment.exam_id == exam_id,
-        models.ExamEnrollment.student_id == user.id,
-    ).first():
-        db.add(models.ExamEnrollment(exam_id=exam_id, student_id=user.id))
-        db.commit()
-
-    # ── Create Submission record ──────────────────────────────────────────────
-    sub = models.Submission(exam_id=exam_id, student_id=user.id, status="PENDING")
-    db.add(sub)
-    db.commit()
-    db.refresh(sub)
-
-    # ── Load professor solution ───────────────────────────────────────────────
-    sdoc = (
-        db.query(models.SolutionDoc)
-        .filter(models.SolutionDoc.exam_id == exam_id)
-        .first()
+    # ── Admission: grade now, defer past the deadline, or 429 ─────────────────
+    deferred_to = None
+    acquired = False
+    try:
+        if queue.queue_mode():
+            admission.check_queue(db, exam_id)
+        else:
+            admission.try_acquire(exam_id)
+            acquired = True
+    except admission.Saturated as exc:
+        deferred_to = admission.defer_until(exam)
+        if deferred_to is None:
+            admission.count("rejected")
+            raise HTTPException(status_code=429, detail=str(exc),
+                                headers={"Retry-After": str(exc.retry_after)})
+
+    handed_over = False
+    try:
+        # ── Save PDF (content-addressed); pages are rendered by the pipeline ──
+        try:
+            blob = storage.save_upload(file, db)
+        except storage.UploadTooLarge as exc:
+            raise HTTPException(status_code=413, detail=str(exc))
+
+        # ── Auto-enroll if not already, then record the submission ───────────
+        pipeline.ensure_enrolled(db, exam_id, user.id)
+        admission.count("deferred" if deferred_to else "admitted")
+        sub = pipeline.create_submission(db, exam_id, user.id, blob)
+        if deferred_to or queue.queue_mode():
+            # Stored now; a worker runs the stages (poll /student/submissions/{id})
+            queue.enqueue(db, "stages", {"submission_id": sub.id, "exam_id": exam_id},
+                          submission_id=sub.id, exam_id=exam_id, available_at=deferred_to)
+            db.commit()
+            return {"submission_id": sub.id, "status": sub.status, "queued": True,
+                    "deferred_until": deferred_to}
+        handed_over = acquired
+        return {"submission_id": sub.id}
+    except pipeline.NoSolution as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    finally:
+        if acquired and not handed_over:
+            admission.release(exam_id)
+
+
+# ── Submit, streamed ──────────────────────────────────────────────────────────
+
+_streams: set = set()  # grading tasks behind open (or abandoned) streams
+
+
+@router.post("/exams/{exam_id}/submit_pdf/stream")
+async def submit_pdf_stream(
+    exam_id: int,
+    request: Request,
+    file: UploadFile = File(...),
+    user=Depends(require_student),
+    db: Session = Depends(get_db),
+):
+    """
+    submit_pdf with progress: "accepted", then a "stage" event per finished
+    stage and a "question" event per graded question (with the running total),
+    and the final "grade" last ("error" instead if grading fails). NDJSON by
+    default, Server-Sent Events with Accept: text/event-stream. Grading carries
+    on if the client goes away.
+    """
+    accepted = await executors.run_blocking(_accept_submission, db, exam_id, file, user)
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    return StreamingResponse(
+        _grade_events(exam_id, accepted, sse),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    if not sdoc:
-        raise HTTPException(
-            status_code=400, detail="Teacher has not uploaded a solution PDF yet"
-        )
 
-    try:
-        sol_meta = json.loads(sdoc.extracted_text or "{}")
-    except Exception:
-        sol_meta = {}
 
-    solution_imgs = sol_meta.get("images", [])
-    spans = sol_meta.get("spans", [])
+def _frame(event: dict, sse: bool) -> str:
+    data = json.dumps(event, default=str)
+    return f"event: {event['event']}\ndata: {data}\n\n" if sse else data + "\n"
 
-    # ── Load questions ────────────────────────────────────────────────────────
-    questions = (
-        db.query(models.Question)
-        .filter(models.Question.exam_id == exam_id)
-        .all()
-    )
-    by_idx = {q.idx: q for q in questions}
-
-    if not spans:
-        spans = detect_question_spans(student_imgs)
-
-    # Naive: all pages for every question (vision model is given the full doc)
-    per_question_imgs = {qidx: student_imgs for qidx in by_idx}
-
-    # ── Grade each question ───────────────────────────────────────────────────
-    total = 0.0
-    breakdown = {}
-
-    for qidx, q in sorted(by_idx.items()):
-        stu_imgs = per_question_imgs.get(qidx, [])
-        if not stu_imgs:
-            breakdown[str(q.id)] = {
-                "points": 0.0,
-                "feedback": {
-                    "rationale": "No images found for this question",
-                    "strengths": [],
-                    "missing": ["Provide answer"],
-                },
-            }
-            continue
-
-        result = grade_question_images(qidx, stu_imgs, solution_imgs, q.max_points)
-        total += result["points"]
-        breakdown[str(q.id)] = result
-
-        db.add(
-            models.Answer(
-                submission_id=sub.id,
-                question_id=q.id,
-                text=f"[Q{qidx}: image-based answer]",
-            )
-        )
 
-    db.commit()
+async def _grade_events(exam_id: int, accepted: dict, sse: bool):
+    if accepted.get("queued"):
+        yield _frame({"event": "queued", **accepted}, sse)
+        return
+    events: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(_grade_streamed(exam_id, accepted["submission_id"], events.put_nowait))
+    _streams.add(task)
+    task.add_done_callback(_streams.discard)
+    yield _frame({"event": "accepted", **accepted}, sse)
+    while (event := await events.get()) is not None:
+        yield _frame(event, sse)
 
-    # ── Save grade ────────────────────────────────────────────────────────────
-    grade = models.Grade(
-        submission_id=sub.id, total=round(total, 2), breakdown=breakdown
-    )
-    sub.status = "GRADED"
-    db.add(grade)
-    db.commit()
-    db.refresh(grade)
-
-    # ── Save submission doc (images + OCR) ────────────────────────────────────
-    ocr_text = ocr_images(student_imgs)  # empty string if pytesseract unavailable
-    payload = {"images": student_imgs, "ocr": ocr_text}
-    doc = models.SubmissionDoc(
-        submission_id=sub.id,
-        file_path=str(dest),
-        extracted_text=json.dumps(payload),
-    )
-    db.add(doc)
-    db.commit()
 
-    # ── Academic integrity check ──────────────────────────────────────────────
+async def _grade_streamed(exam_id: int, submission_id: int, emit) -> None:
     try:
-        run_similarity_check(exam_id, sub.id, db)
-    except Exception as exc:
-        # Non-fatal — don't block the student's submission
-        print(f"[similarity] check failed for submission {sub.id}: {exc}")
-
-    return {
-        "submission_id": sub.id,
-        "grade_total": grade.total,
-        "breakdown": breakdown,
-        "answers_saved": len(questions),
-    }
+        with scheduler.work_class(scheduler.INTERACTIVE, exam_id):
+            result = await pipeline.run_stages_async(submission_id, exam_id, emit)
+        emit({"event": "grade", **result})
+    except pipeline.StageFailed as exc:
+        emit({"event": "error", "status_code": 502, "detail": str(exc)})
+    except Exception:
+        logger.exception(f"[submit] streamed grading of submission {submission_id} crashed")
+        emit({"event": "error", "status_code": 500, "detail": "Internal error"})
+    finally:
+        admission.release(exam_id)
+        emit(None)
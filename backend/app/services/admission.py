@@ -0,0 +1,164 @@
+"""
+Admission control for student submissions.
+
+Grading is the expensive part of an upload and submissions pile up in the
+last minutes before ``Exam.due_at``. Work is admitted against two limits, a
+global one and one per exam:
+
+  * inline mode: gradings running in this API process
+    (``ADMISSION_MAX_INFLIGHT`` / ``ADMISSION_MAX_INFLIGHT_PER_EXAM``);
+  * queue mode:  "stages" tasks waiting for or held by a worker
+    (``ADMISSION_MAX_QUEUED`` / ``ADMISSION_MAX_QUEUED_PER_EXAM``).
+
+When saturated the API answers 429 with ``Retry-After`` — except within
+``ADMISSION_DEFER_MINUTES`` of the deadline, where the upload is stored right
+away and its grading is queued to run once the deadline has passed. Deferral
+needs something to run that queue: a worker in queue mode, or the API's own
+drainer (``DEFER_DRAINER=1``) in inline mode.
+"""
+from __future__ import annotations
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import metrics, models
+from ..config import settings
+from . import queue, scheduler
+
+_lock = threading.Lock()
+_inflight: Counter = Counter()  # exam_id → gradings running in this process
+_totals: Counter = Counter()    # admitted / rejected / deferred since start
+
+
+class Saturated(Exception):
+    def __init__(self, scope: str, retry_after: int):
+        super().__init__(f"Grading is at capacity ({scope}); retry in {retry_after} s")
+        self.retry_after = retry_after
+
+
+def can_defer() -> bool:
+    """Deferred uploads are "stages" tasks; only defer when something runs them."""
+    return queue.queue_mode() or settings.DEFER_DRAINER
+
+
+def defer_until(exam: models.Exam, now: Optional[datetime] = None) -> Optional[datetime]:
+    """The deadline, if *exam* is inside the defer window and deferral is possible; else None."""
+    if not can_defer():
+        return None
+    window = timedelta(minutes=settings.ADMISSION_DEFER_MINUTES)
+    now = now or datetime.utcnow()
+    if window and exam.due_at - window <= now <= exam.due_at:
+        return exam.due_at
+    return None
+
+
+def _queued(db: Session, exam_id: Optional[int] = None) -> int:
+    q = db.query(func.count(models.QueueTask.id)).filter(
+        models.QueueTask.kind == "stages",
+        models.QueueTask.status.in_(("QUEUED", "CLAIMED")),
+        models.QueueTask.available_at <= datetime.utcnow(),  # deferred work doesn't count
+    )
+    if exam_id is not None:
+        q = q.filter(models.QueueTask.exam_id == exam_id)
+    return q.scalar() or 0
+
+
+def check_queue(db: Session, exam_id: int) -> None:
+    """Queue mode: raise Saturated if the worker backlog is over a limit."""
+    if _queued(db) >= settings.ADMISSION_MAX_QUEUED:
+        raise Saturated("global", settings.ADMISSION_RETRY_AFTER)
+    if _queued(db, exam_id) >= settings.ADMISSION_MAX_QUEUED_PER_EXAM:
+        raise Saturated("exam", settings.ADMISSION_RETRY_AFTER)
+
+
+def try_acquire(exam_id: int) -> None:
+    """Inline mode: take a grading slot or raise Saturated. Pair with release()."""
+    with _lock:
+        if sum(_inflight.values()) >= settings.ADMISSION_MAX_INFLIGHT:
+            scope = "global"
+        elif _inflight[exam_id] >= settings.ADMISSION_MAX_INFLIGHT_PER_EXAM:
+            scope = "exam"
+        else:
+            _inflight[exam_id] += 1
+            return
+    raise Saturated(scope, settings.ADMISSION_RETRY_AFTER)
+
+
+def release(exam_id: int) -> None:
+    with _lock:
+        _inflight[exam_id] -= 1
+        if _inflight[exam_id] <= 0:
+            del _inflight[exam_id]
+
+
+def count(event: str) -> None:
+    """Record an admission outcome: "admitted", "rejected" or "deferred"."""
+    with _lock:
+        _totals[event] += 1
+
+
+def stats(db: Session, exam_id: Optional[int] = None) -> Dict[str, Any]:
+    """Admission counters for this process plus queue depth (optionally per exam)."""
+    with _lock:
+        inflight = dict(_inflight)
+        totals = dict(_totals)
+    out: Dict[str, Any] = {
+        "mode": settings.GRADING_MODE,
+        "inflight": inflight.get(exam_id, 0) if exam_id is not None else sum(inflight.values()),
+        "queue": queue.stats(db, exam_id),
+    }
+    if exam_id is None:
+        out["inflight_by_exam"] = inflight
+        out["admission"] = {k: totals.get(k, 0) for k in ("admitted", "rejected", "deferred")}
+        out["scheduler"] = scheduler.stats()
+        out["limits"] = {
+            "max_inflight": settings.ADMISSION_MAX_INFLIGHT,
+            "max_inflight_per_exam": settings.ADMISSION_MAX_INFLIGHT_PER_EXAM,
+            "max_queued": settings.ADMISSION_MAX_QUEUED,
+            "max_queued_per_exam": settings.ADMISSION_MAX_QUEUED_PER_EXAM,
+        }
+    return out
+
+
+@metrics.collector
+def _load_gauges():
+    """Queue depth, in-flight gradings and scheduler state at scrape time."""
+    from ..database import SessionLocal
+
+    with SessionLocal() as db:
+        q = queue.stats(db)
+    depth = metrics.Gauge("autograde_queue_tasks", "Unfinished queue tasks",
+                          ["kind", "state"], register=False)
+    for kind, buckets in q["by_kind"].items():
+        for state, n in buckets.items():
+            depth.set(n, kind=kind, state=state)
+    dead = metrics.Gauge("autograde_queue_dead_tasks", "Dead-lettered queue tasks", register=False)
+    dead.set(q["dead"])
+    oldest = metrics.Gauge("autograde_queue_oldest_ready_seconds",
+                           "Age of the oldest runnable task", register=False)
+    oldest.set(q["oldest_ready_seconds"] or 0)
+
+    with _lock:
+        inflight, totals = dict(_inflight), dict(_totals)
+    running = metrics.Gauge("autograde_inflight_gradings", "Gradings running in this process",
+                            ["exam"], register=False)
+    for exam_id, n in inflight.items():
+        running.set(n, exam=exam_id)
+    admitted = metrics.Counter("autograde_admission_total", "Submission admission outcomes",
+                               ["outcome"], register=False)
+    for outcome in ("admitted", "rejected", "deferred"):
+        admitted.inc(totals.get(outcome, 0), outcome=outcome)
+
+    busy = metrics.Gauge("autograde_scheduler_slots_busy", "Scheduler slots in use",
+                         ["resource", "work_class"], register=False)
+    waiting = metrics.Gauge("autograde_scheduler_waiting", "Calls waiting for a slot",
+                            ["resource", "work_class"], register=False)
+    for name, res in scheduler.stats().items():
+        for cls in scheduler.CLASSES:
+            busy.set(res["busy"][cls], resource=name, work_class=cls)
+            waiting.set(res["waiting"][cls], resource=name, work_class=cls)
+    return [depth, dead, oldest, running, admitted, busy, waiting]
@@ -0,0 +1,259 @@
+"""
+Blob storage backends.
+
+Everything the API and grading workers persist as files (uploaded PDFs,
+rendered pages, derivatives) is addressed by a relative *key* such as
+``blobs/ab/<sha>.pdf`` and lives in one of:
+
+  * ``LocalBlobStore``  — a directory (``UPLOAD_DIR``); keys map to paths.
+  * ``S3BlobStore``     — any S3-compatible bucket (AWS, MinIO, R2...).
+    Large files use parallel multipart transfers; reads go through a local
+    on-disk cache so repeated grading of the same pages costs no network.
+    The cache is read-through only: ``exists`` always asks the bucket.
+
+The DB stores keys only, so any replica can serve or grade any submission.
+Select the backend with ``STORAGE_BACKEND=local|s3``.
+"""
+from __future__ import annotations
+import os
+import shutil
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from ..config import settings
+
+
+class BlobStore(ABC):
+    """Interface shared by the backends."""
+
+    @abstractmethod
+    def put_file(self, key: str, src: str, move: bool = False) -> None: ...
+
+    @abstractmethod
+    def put_bytes(self, key: str, data: bytes) -> None: ...
+
+    @abstractmethod
+    def get_bytes(self, key: str) -> Optional[bytes]: ...
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether the store itself holds *key* (never answered from a local cache)."""
+
+    @abstractmethod
+    def local_path(self, key: str) -> str:
+        """A readable local file for *key* (downloaded into the cache if needed)."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str) -> None: ...
+
+    # ── Parallel helpers ──────────────────────────────────────────────────────
+
+    def put_many(self, items: List[tuple[str, str]], move: bool = False) -> None:
+        """Upload [(key, local file)] concurrently."""
+        with ThreadPoolExecutor(max_workers=settings.STORAGE_CONCURRENCY) as pool:
+            list(pool.map(lambda kv: self.put_file(kv[0], kv[1], move=move), items))
+
+    def local_paths(self, keys: List[str]) -> List[str]:
+        """Resolve many keys to local files concurrently, preserving order."""
+        if len(keys) <= 1:
+            return [self.local_path(k) for k in keys]
+        with ThreadPoolExecutor(max_workers=settings.STORAGE_CONCURRENCY) as pool:
+            return list(pool.map(self.local_path, keys))
+
+
+# ── Local filesystem ──────────────────────────────────────────────────────────
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def put_file(self, key: str, src: str, move: bool = False) -> None:
+        dest = self._path(key)
+        if Path(src).resolve() == dest.resolve():
+            return
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if move:
+            shutil.move(src, dest)
+        else:
+            shutil.copyfile(src, dest)
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        dest = self._path(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f"{dest.name}.{threading.get_ident()}.part")
+        tmp.write_bytes(data)
+        os.replace(tmp, dest)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def local_path(self, key: str) -> str:
+        return str(self._path(key))
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def delete_prefix(self, prefix: str) -> None:
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+
+
+# ── S3-compatible ─────────────────────────────────────────────────────────────
+
+class S3BlobStore(BlobStore):
+    def __init__(self, bucket: str, prefix: str = "", cache_dir: str = ""):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("S3_BUCKET missing in .env")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=settings.S3_ENDPOINT_URL or None,
+            region_name=settings.S3_REGION or None,
+            aws_access_key_id=settings.S3_ACCESS_KEY_ID or None,
+            aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY or None,
+            config=Config(max_pool_connections=max(10, settings.STORAGE_CONCURRENCY * 2)),
+        )
+        part = int(settings.S3_MULTIPART_MB * 1024 * 1024)
+        self.transfer = TransferConfig(
+            multipart_threshold=part,
+            multipart_chunksize=part,
+            max_concurrency=settings.STORAGE_CONCURRENCY,
+            use_threads=True,
+        )
+        self.cache = Path(cache_dir or settings.BLOB_CACHE_DIR)
+        self.cache.mkdir(parents=True, exist_ok=True)
+        self._trim_lock = threading.Lock()
+        self._last_trim = 0.0
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _cached(self, key: str) -> Path:
+        return self.cache / key
+
+    def _seed_cache(self, key: str, src: str, move: bool) -> None:
+        dest = self._cached(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if move:
+            shutil.move(src, dest)
+        else:
+            shutil.copyfile(src, dest)
+
+    def put_file(self, key: str, src: str, move: bool = False) -> None:
+        self.client.upload_file(src, self.bucket, self._key(key), Config=self.transfer)
+        # Keep the bytes we just wrote: the uploading node reads them next.
+        self._seed_cache(key, src, move)
+        self._trim_cache()
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        cached = self._cached(key)
+        if cached.exists():
+            return cached.read_bytes()
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return obj["Body"].read()
+
+    def exists(self, key: str) -> bool:
+        # Ask the bucket: another replica may have deleted the object while
+        # this node still has it cached, and callers skip uploads on True.
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in {"404", "NoSuchKey", "NotFound"}:
+                return False
+            raise
+
+    def local_path(self, key: str) -> str:
+        dest = self._cached(key)
+        if dest.exists():
+            os.utime(dest)  # LRU touch
+            return str(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f"{dest.name}.{threading.get_ident()}.part")
+        self.client.download_file(self.bucket, self._key(key), str(tmp), Config=self.transfer)
+        os.replace(tmp, dest)
+        self._trim_cache()
+        return str(dest)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        self._cached(key).unlink(missing_ok=True)
+
+    def delete_prefix(self, prefix: str) -> None:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix.rstrip("/") + "/")):
+            objs = [{"Key": o["Key"]} for o in page.get("Contents", [])]
+            if objs:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objs})
+        shutil.rmtree(self._cached(prefix), ignore_errors=True)
+
+    def _trim_cache(self) -> None:
+        """Evict least-recently-used cache files above BLOB_CACHE_MB (at most every 30 s)."""
+        limit = int(settings.BLOB_CACHE_MB * 1024 * 1024)
+        if time.monotonic() - self._last_trim < 30 or not self._trim_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_trim = time.monotonic()
+            files = [(p.stat().st_mtime, p.stat().st_size, p)
+                     for p in self.cache.rglob("*") if p.is_file() and not p.name.endswith(".part")]
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= limit:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+        finally:
+            self._trim_lock.release()
+
+
+# ── Factory ───────────────────────────────────────────────────────────────────
+
+_store: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> BlobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            if settings.STORAGE_BACKEND == "s3":
+                _store = S3BlobStore(settings.S3_BUCKET, settings.S3_PREFIX)
+            else:
+                _store = LocalBlobStore(settings.UPLOAD_DIR)
+    return _store
+
+
+def set_store(store: Optional[BlobStore]) -> None:
+    """Swap the process-wide store (tests, tooling). None resets to settings."""
+    global _store
+    with _store_lock:
+        _store = store
@@ -0,0 +1,181 @@
+"""
+Page-level storage for solution and submission documents.
+
+Each rendered page is a ``DocPage`` row (image blob-store key/hash,
+dimensions, OCR text — taken from the PDF itself for typed pages, flagged
+``text_layer``) and question spans are ``PageSpan`` bands on those
+pages. Readers select only the columns they need instead of decoding one
+JSON blob per doc.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..utils.images import page_info
+from .storage import fetch, page_number
+
+
+# ── Write ─────────────────────────────────────────────────────────────────────
+
+def _page_text(key: str, texts: Optional[List[Optional[str]]]) -> Dict[str, Any]:
+    """ocr_text/text_layer for a page whose source PDF page is typed (see storage.text_layer)."""
+    n = page_number(key)
+    text = texts[n - 1] if texts and n and n <= len(texts) else None
+    return {"ocr_text": text, "text_layer": True} if text else {}
+
+
+def _page_rows(
+    img_keys: List[str], texts: Optional[List[Optional[str]]] = None, **doc_fk
+) -> List[models.DocPage]:
+    rows = []
+    for page_no, (key, local) in enumerate(zip(img_keys, fetch(img_keys)), start=1):
+        try:
+            info = page_info(local)
+        except Exception:
+            info = {}
+        rows.append(models.DocPage(page_no=page_no, image_path=key, **info,
+                                   **_page_text(key, texts), **doc_fk))
+    return rows
+
+
+def replace_solution_pages(
+    db: Session,
+    doc: models.SolutionDoc,
+    img_keys: List[str],
+    spans: List[Dict[str, Any]],
+    texts: Optional[List[Optional[str]]] = None,
+) -> List[models.DocPage]:
+    """Swap in the pages and question spans for a (re-)uploaded solution."""
+    old_ids = select(models.DocPage.id).where(models.DocPage.solution_doc_id == doc.id)
+    db.execute(delete(models.PageSpan).where(models.PageSpan.page_id.in_(old_ids)))
+    db.execute(delete(models.DocPage).where(models.DocPage.solution_doc_id == doc.id))
+
+    pages = _page_rows(img_keys, texts, solution_doc_id=doc.id)
+    db.add_all(pages)
+    db.flush()
+    by_no = {p.page_no: p for p in pages}
+    for item in spans:
+        q_idx = int(item.get("q_idx", 0))
+        for seg in item.get("segments", []):
+            page = by_no.get(int(seg.get("page", 0) or 0))
+            if q_idx <= 0 or page is None:
+                continue
+            db.add(models.PageSpan(
+                page_id=page.id,
+                q_idx=q_idx,
+                y_top=float(seg.get("y_top", 0.0)),
+                y_bottom=float(seg.get("y_bottom", 1.0)),
+            ))
+    return pages
+
+
+def add_submission_pages(
+    db: Session,
+    doc: models.SubmissionDoc,
+    img_keys: List[str],
+    texts: Optional[List[Optional[str]]] = None,
+) -> List[models.DocPage]:
+    pages = _page_rows(img_keys, texts, submission_doc_id=doc.id)
+    db.add_all(pages)
+    return pages
+
+
+def set_page_ocr(db: Session, page_id: int, text: str) -> None:
+    db.execute(update(models.DocPage).where(models.DocPage.id == page_id).values(ocr_text=text))
+
+
+# ── Read ──────────────────────────────────────────────────────────────────────
+
+def solution_images(db: Session, exam_id: int) -> List[str]:
+    return list(db.execute(
+        select(models.DocPage.image_path)
+        .join(models.SolutionDoc, models.SolutionDoc.id == models.DocPage.solution_doc_id)
+        .where(models.SolutionDoc.exam_id == exam_id)
+        .order_by(models.DocPage.page_no)
+    ).scalars())
+
+
+def solution_spans(db: Session, exam_id: int) -> List[Dict[str, Any]]:
+    """Spans in the detect_question_spans schema: [{q_idx, segments:[{page,y_top,y_bottom}]}]."""
+    rows = db.execute(
+        select(models.PageSpan.q_idx, models.DocPage.page_no,
+               models.PageSpan.y_top, models.PageSpan.y_bottom)
+        .join(models.DocPage, models.DocPage.id == models.PageSpan.page_id)
+        .join(models.SolutionDoc, models.SolutionDoc.id == models.DocPage.solution_doc_id)
+        .where(models.SolutionDoc.exam_id == exam_id)
+        .order_by(models.PageSpan.q_idx, models.DocPage.page_no, models.PageSpan.y_top)
+    ).all()
+    by_q: Dict[int, List[Dict[str, Any]]] = {}
+    for q_idx, page_no, y_top, y_bottom in rows:
+        by_q.setdefault(q_idx, []).append({"page": page_no, "y_top": y_top, "y_bottom": y_bottom})
+    return [{"q_idx": q, "segments": segs} for q, segs in by_q.items()]
+
+
+def submission_images(db: Session, submission_id: int) -> List[str]:
+    return list(db.execute(
+        select(models.DocPage.image_path)
+        .join(models.SubmissionDoc, models.SubmissionDoc.id == models.DocPage.submission_doc_id)
+        .where(models.SubmissionDoc.submission_id == submission_id)
+        .order_by(models.DocPage.page_no)
+    ).scalars())
+
+
+def submission_text_layer(db: Session, submission_id: int) -> List[Optional[str]]:
+    """Per page (in submission_images order): the typed text, or None for scanned pages."""
+    rows = db.execute(
+        select(models.DocPage.text_layer, models.DocPage.ocr_text)
+        .join(models.SubmissionDoc, models.SubmissionDoc.id == models.DocPage.submission_doc_id)
+        .where(models.SubmissionDoc.submission_id == submission_id)
+        .order_by(models.DocPage.page_no)
+    ).all()
+    return [text if typed else None for typed, text in rows]
+
+
+def solution_text_layer(db: Session, exam_id: int) -> Optional[str]:
+    """The solution as text if every page of it is typed, else None (send images)."""
+    rows = db.execute(
+        select(models.DocPage.page_no, models.DocPage.text_layer, models.DocPage.ocr_text)
+        .join(models.SolutionDoc, models.SolutionDoc.id == models.DocPage.solution_doc_id)
+        .where(models.SolutionDoc.exam_id == exam_id)
+        .order_by(models.DocPage.page_no)
+    ).all()
+    if not rows or not all(typed for _, typed, _ in rows):
+        return None
+    return "\n\n".join(f"[Page {n}]\n{text}" for n, _, text in rows)
+
+
+def _page_listing(db: Session, where) -> List[Dict[str, Any]]:
+    rows = db.execute(
+        select(models.DocPage.id, models.DocPage.page_no, models.DocPage.width,
+               models.DocPage.height, models.DocPage.image_sha256)
+        .where(where)
+        .order_by(models.DocPage.page_no)
+    ).all()
+    return [{"page_id": i, "page_no": n, "width": w, "height": h, "image_sha256": sha}
+            for i, n, w, h, sha in rows]
+
+
+def submission_pages(db: Session, submission_id: int) -> List[Dict[str, Any]]:
+    doc_ids = select(models.SubmissionDoc.id).where(models.SubmissionDoc.submission_id == submission_id)
+    return _page_listing(db, models.DocPage.submission_doc_id.in_(doc_ids))
+
+
+def solution_pages(db: Session, exam_id: int) -> List[Dict[str, Any]]:
+    doc_ids = select(models.SolutionDoc.id).where(models.SolutionDoc.exam_id == exam_id)
+    return _page_listing(db, models.DocPage.solution_doc_id.in_(doc_ids))
+
+
+def submission_ocr(db: Session, submission_id: int) -> Optional[str]:
+    """Concatenated page OCR, or None if the submission has no pages."""
+    texts = db.execute(
+        select(models.DocPage.ocr_text)
+        .join(models.SubmissionDoc, models.SubmissionDoc.id == models.DocPage.submission_doc_id)
+        .where(models.SubmissionDoc.submission_id == submission_id)
+        .order_by(models.DocPage.page_no)
+    ).scalars().all()
+    if not texts:
+        return None
+    return "\n\n".join(t for t in texts if t)
@@ -0,0 +1,73 @@
+"""
+Executors behind the async submit path.
+
+Coroutines must not block the event loop, so the async routes push work
+out to one of two bounded pools:
+
+  run_blocking  SQLAlchemy sessions, storage reads/writes, base64 encoding —
+                a thread pool of ``ASYNC_DB_THREADS``, separate from
+                Starlette's, so a burst of uploads can't take every thread
+                the sync routes need
+  run_cpu       PDF rendering — a process pool of ``ASYNC_CPU_PROCESSES``
+                ("spawn", so children don't inherit the parent's threads);
+                0 runs it on the blocking pool instead
+
+The caller's context (scheduler work class, per-request query stats) is
+carried into the blocking pool; the process pool gets plain arguments only.
+"""
+from __future__ import annotations
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from ..config import settings
+
+_lock = threading.Lock()
+_blocking: Optional[ThreadPoolExecutor] = None
+_cpu: Optional[ProcessPoolExecutor] = None
+
+
+def blocking_executor() -> ThreadPoolExecutor:
+    global _blocking
+    with _lock:
+        if _blocking is None:
+            _blocking = ThreadPoolExecutor(max(1, settings.ASYNC_DB_THREADS),
+                                           thread_name_prefix="blocking")
+        return _blocking
+
+
+def cpu_executor() -> Executor:
+    global _cpu
+    if settings.ASYNC_CPU_PROCESSES <= 0:
+        return blocking_executor()
+    with _lock:
+        if _cpu is None:
+            _cpu = ProcessPoolExecutor(settings.ASYNC_CPU_PROCESSES,
+                                       mp_context=multiprocessing.get_context("spawn"))
+        return _cpu
+
+
+async def run_blocking(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run *fn* on the blocking pool with the caller's context variables."""
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        blocking_executor(), functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+async def run_cpu(fn: Callable[..., Any], *args) -> Any:
+    """Run module-level *fn* (picklable arguments) in the process pool."""
+    return await asyncio.get_running_loop().run_in_executor(
+        cpu_executor(), functools.partial(fn, *args))
+
+
+def shutdown() -> None:
+    global _blocking, _cpu
+    with _lock:
+        for pool in (_blocking, _cpu):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        _blocking = _cpu = None
@@ -1,71 +1,127 @@
 # backend/app/services/grading_vision.py
 from __future__ import annotations
-import base64, json
-from typing import Dict, List, Any, Tuple
-from openai import OpenAI
+import asyncio, base64, json
+from typing import Dict, List, Any, Optional, Tuple, TYPE_CHECKING
 from pathlib import Path
+from .. import metrics
 from ..config import settings
+from .executors import run_blocking
+from .scheduler import async_slot, current, gated
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+    from PIL import Image
 
 _client = None
-def client() -> OpenAI:
+def client() -> "OpenAI":
     global _client
     if _client is None:
         if not settings.OPENAI_API_KEY:
             raise RuntimeError("OPENAI_API_KEY missing in .env")
+        from openai import OpenAI  # heavy import — deferred until the first model call
         _client = OpenAI(api_key=settings.OPENAI_API_KEY)
     return _client
 
+_async_client = None
+def async_client() -> "AsyncOpenAI":
+    global _async_client
+    if _async_client is None:
+        if not settings.OPENAI_API_KEY:
+            raise RuntimeError("OPENAI_API_KEY missing in .env")
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+    return _async_client
+
 def _img_to_data_url(path: str) -> str:
+    if path.startswith("data:"):  # already encoded (solution asset bundles)
+        return path
     with open(path, "rb") as f:
         b64 = base64.b64encode(f.read()).decode("utf-8")
     return f"data:image/png;base64,{b64}"
 
-def _vision_call_json(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
-    # Use JSON "forced" style — for GPT-4o you can ask for JSON in the instruction
-    resp = client().chat.completions.create(
-        model=settings.OPENAI_MODEL,
-        temperature=0.1,
-        messages=messages,
-        response_format={"type": "json_object"},
-    )
+def _images(paths: List[str]) -> List[Dict[str, Any]]:
+    return [{"type":"image_url", "image_url":{"url": _img_to_data_url(p)}} for p in paths]
+
+def _request_bytes(messages: List[Dict[str, Any]], stage: str) -> None:
+    metrics.VISION_REQUEST_BYTES.observe(sum(
+        len(part["image_url"]["url"])
+        for m in messages if isinstance(m["content"], list)
+        for part in m["content"] if part.get("type") == "image_url"
+    ), stage=stage)
+
+def _parse(raw, stage: str, exam) -> Dict[str, Any]:
+    if getattr(raw, "retries_taken", 0):
+        metrics.VISION_RETRIES.inc(raw.retries_taken, stage=stage)
+    resp = raw.parse()
+    if resp.usage:
+        metrics.VISION_TOKENS.inc(resp.usage.prompt_tokens, stage=stage, exam=exam, type="prompt")
+        metrics.VISION_TOKENS.inc(resp.usage.completion_tokens, stage=stage, exam=exam, type="completion")
     content = resp.choices[0].message.content or "{}"
     try:
         return json.loads(content)
     except Exception:
         return {}
 
+@gated("model")  # priority + fair share across exams, see scheduler.py
+def _vision_call_json(
+    messages: List[Dict[str, Any]], stage: str = "grade", model: Optional[str] = None
+) -> Dict[str, Any]:
+    exam = current()[1]
+    _request_bytes(messages, stage)
+    # Use JSON "forced" style — for GPT-4o you can ask for JSON in the instruction
+    try:
+        with metrics.VISION_SECONDS.time(stage=stage, exam=exam):
+            raw = client().chat.completions.with_raw_response.create(
+                model=model or settings.OPENAI_MODEL,
+                temperature=0.1,
+                messages=messages,
+                response_format={"type": "json_object"},
+            )
+    except Exception as exc:
+        metrics.VISION_ERRORS.inc(stage=stage, error=exc.__class__.__name__)
+        raise
+    return _parse(raw, stage, exam)
+
+async def _vision_call_json_async(
+    messages: List[Dict[str, Any]], stage: str = "grade", model: Optional[str] = None
+) -> Dict[str, Any]:
+    """_vision_call_json on AsyncOpenAI: waiting for the model holds no thread."""
+    exam = current()[1]
+    _request_bytes(messages, stage)
+    async with async_slot("model"):
+        try:
+            with metrics.VISION_SECONDS.time(stage=stage, exam=exam):
+                raw = await async_client().chat.completions.with_raw_response.create(
+                    model=model or settings.OPENAI_MODEL,
+                    temperature=0.1,
+                    messages=messages,
+                    response_format={"type": "json_object"},
+                )
+        except Exception as exc:
+            metrics.VISION_ERRORS.inc(stage=stage, error=exc.__class__.__name__)
+            raise
+    return _parse(raw, stage, exam)
+
 # ---------- 1) Detect question spans on SOLUTION images ----------
-def detect_question_spans(solution_imgs: List[str]) -> List[Dict[str, Any]]:
-    """
-    Ask the vision model to find question headers (Q1/Q2/Question 1/2...) across images
-    and return spans as a list of:
-      [{ "q_idx": 1, "segments": [{"page":1,"y_top":0.12,"y_bottom":0.35}, ...] }, ...]
-    y_top/y_bottom are relative (0..1). Page is 1-based index.
-    """
-    # Provide up to 10 images per request; if more pages, run multiple passes and merge.
-    chunks = [solution_imgs[i:i+settings.MAX_IMAGES_PER_CALL]
-              for i in range(0, len(solution_imgs), settings.MAX_IMAGES_PER_CALL)]
-    all_spans: Dict[int, List[Dict[str, Any]]] = {}
+def _span_messages(chunk: List[str]) -> List[Dict[str, Any]]:
+    return [
+        {"role": "system", "content": "You are a document analyst. Return STRICT JSON only."},
+        {"role": "user", "content": [
+            {"type":"text","text":(
+                "Find question boundaries labeled like 'Q1', 'Q2', 'Question 1', etc. "
+                "For each question number q, return a list of vertical bands (per page) "
+                "covering that question's content. Use relative y positions in [0,1]. "
+                "Schema:\n{\n  \"items\": [\n    {\"q_idx\": number, \"segments\": ["
+                "{\"page\": number, \"y_top\": number, \"y_bottom\": number}]}\n  ]\n}\n"
+                "Be conservative and include all relevant content blocks."
+            )},
+            *_images(chunk),
+        ]}
+    ]
 
-    for cidx, chunk in enumerate(chunks):
-        msgs = [
-            {"role": "system", "content": "You are a document analyst. Return STRICT JSON only."},
-            {"role": "user", "content": [
-                {"type":"text","text":(
-                    "Find question boundaries labeled like 'Q1', 'Q2', 'Question 1', etc. "
-                    "For each question number q, return a list of vertical bands (per page) "
-                    "covering that question's content. Use relative y positions in [0,1]. "
-                    "Schema:\n{\n  \"items\": [\n    {\"q_idx\": number, \"segments\": ["
-                    "{\"page\": number, \"y_top\": number, \"y_bottom\": number}]}\n  ]\n}\n"
-                    "Be conservative and include all relevant content blocks."
-                )},
-                *[
-                    {"type":"image_url", "image_url":{"url": _img_to_data_url(p)}}
-                    for p in chunk
-                ],
-            ]}
-        ]
-        out = _vision_call_json(msgs)
+def _merge_spans(outs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    all_spans: Dict[int, List[Dict[str, Any]]] = {}
+    for out in outs:
         for item in out.get("items", []):
             q = int(item.get("q_idx", 0))
             segs = item.get("segments", [])
@@ -77,10 +133,30 @@ def detect_question_spans(solution_imgs: List[str]) -> List[Dict[str, Any]]:
     merged = [{"q_idx": q, "segments": segs} for q, segs in sorted(all_spans.items())]
     return merged
 
-# ---------- 2) Crop helper (optional) ----------
-from PIL import Image
+def _chunks(imgs: List[str]) -> List[List[str]]:
+    return [imgs[i:i+settings.MAX_IMAGES_PER_CALL]
+            for i in range(0, len(imgs), settings.MAX_IMAGES_PER_CALL)]
 
-def crop_segments(img_path: str, y_top: float, y_bottom: float) -> Image.Image:
+def detect_question_spans(solution_imgs: List[str]) -> List[Dict[str, Any]]:
+    """
+    Ask the vision model to find question headers (Q1/Q2/Question 1/2...) across images
+    and return spans as a list of:
+      [{ "q_idx": 1, "segments": [{"page":1,"y_top":0.12,"y_bottom":0.35}, ...] }, ...]
+    y_top/y_bottom are relative (0..1). Page is 1-based index.
+    """
+    # Provide up to 10 images per request; if more pages, run multiple passes and merge.
+    return _merge_spans([_vision_call_json(_span_messages(chunk), stage="spans")
+                         for chunk in _chunks(solution_imgs)])
+
+async def detect_question_spans_async(solution_imgs: List[str]) -> List[Dict[str, Any]]:
+    """detect_question_spans with the passes in flight together."""
+    messages = await run_blocking(lambda: [_span_messages(c) for c in _chunks(solution_imgs)])
+    return _merge_spans(await asyncio.gather(
+        *(_vision_call_json_async(m, stage="spans") for m in messages)))
+
+# ---------- 2) Crop helper (optional) ----------
+def crop_segments(img_path: str, y_top: float, y_bottom: float) -> "Image.Image":
+    from PIL import Image
     im = Image.open(img_path)
     w, h = im.size
     y1 = max(0, int(y_top * h))
@@ -88,49 +164,47 @@ def crop_segments(img_path: str, y_top: float, y_bottom: float) -> Image.Image:
     return im.crop((0, y1, w, y2))
 
 # ---------- 3) Grade a question (student imgs + solution imgs) ----------
-def grade_question_images(
-    q_idx: int,
-    student_imgs: List[str],
-    solution_imgs: List[str],
-    max_points: float
-) -> Dict[str, Any]:
-    """
-    Send ≤10 images for the student's Q{q_idx} and the solution reference images.
-    Returns {points, feedback:{rationale,strengths,missing}}
-    """
-    # Respect cap
-    s_chunks = [student_imgs[i:i+settings.MAX_IMAGES_PER_CALL]
-                for i in range(0, len(student_imgs), settings.MAX_IMAGES_PER_CALL)]
-    sol_payload = [{"type":"image_url","image_url":{"url":_img_to_data_url(p)}} for p in solution_imgs]
+def _grade_messages(
+    q_idx: int, chunk: List[Dict[str, Any]], sol_payload: List[Dict[str, Any]], max_points: float
+) -> List[Dict[str, Any]]:
+    return [
+        {"role":"system","content":(
+            "You are an auto-grader for STEM exams. "
+            "Compare the student's images to the official solution images. "
+            "Award partial credit for correct steps even if final value differs. Return STRICT JSON."
+        )},
+        {"role":"user","content":[
+            {"type":"text","text":(
+                f"Grade *Question {q_idx}* only. Max points: {max_points}.\n"
+                "Return JSON with:\n{\n  \"points\": number 0..Max,\n"
+                "  \"rationale\": \"short\",\n"
+                "  \"strengths\": [\"kw\",...],\n"
+                "  \"missing\": [\"kw\",...]\n}\n"
+                "Only evaluate relevant steps; ignore other pages/questions."
+            )},
+            {"type":"text","text":"Official solution images:"},
+            *sol_payload,
+            {"type":"text","text":"Student images for this question:"},
+            *chunk
+        ]}
+    ]
+
+def _grade_requests(
+    q_idx: int, student_imgs: List[str], solution_imgs: List[str], max_points: float
+) -> List[List[Dict[str, Any]]]:
+    # Respect cap: one request per ≤10 student images, each with the full solution
+    sol_payload = _images(solution_imgs)
+    return [_grade_messages(q_idx, _images(chunk), sol_payload, max_points)
+            for chunk in _chunks(student_imgs)]
 
+def _merge_grades(outs: List[Dict[str, Any]], max_points: float) -> Dict[str, Any]:
     points_acc = 0.0
     rationale_parts: List[str] = []
     strengths: List[str] = []
     missing: List[str] = []
 
-    for chunk in s_chunks:
-        msgs = [
-            {"role":"system","content":(
-                "You are an auto-grader for STEM exams. "
-                "Compare the student's images to the official solution images. "
-                "Award partial credit for correct steps even if final value differs. Return STRICT JSON."
-            )},
-            {"role":"user","content":[
-                {"type":"text","text":(
-                    f"Grade *Question {q_idx}* only. Max points: {max_points}.\n"
-                    "Return JSON with:\n{\n  \"points\": number 0..Max,\n"
-                    "  \"rationale\": \"short\",\n"
-                    "  \"strengths\": [\"kw\",...],\n"
-                    "  \"missing\": [\"kw\",...]\n}\n"
-                    "Only evaluate relevant steps; ignore other pages/questions."
-                )},
-                {"type":"text","text":"Official solution images:"},
-                *sol_payload,
-                {"type":"text","text":"Student images for this question:"},
-                *[{"type":"image_url","image_url":{"url":_img_to_data_url(p)}} for p in chunk]
-            ]}
-        ]
-        out = _vision_call_json(msgs) or {}
+    for out in outs:
+        out = out or {}
         # Accumulate — average rationales; points: take max over chunks or sum capped at max_points.
         pts = float(out.get("points", 0) or 0)
         points_acc = max(points_acc, pts)  # safer than sum if chunks are split views
@@ -148,3 +222,111 @@ def grade_question_images(
             "missing": missing[:10],
         }
     }
+
+def grade_question_images(
+    q_idx: int,
+    student_imgs: List[str],
+    solution_imgs: List[str],
+    max_points: float
+) -> Dict[str, Any]:
+    """
+    Send ≤10 images for the student's Q{q_idx} and the solution reference images
+    (file paths, or data URLs from a precomputed solution asset bundle).
+    Returns {points, feedback:{rationale,strengths,missing}}
+    """
+    requests = _grade_requests(q_idx, student_imgs, solution_imgs, max_points)
+    return _merge_grades([_vision_call_json(msgs) for msgs in requests], max_points)
+
+async def grade_question_images_async(
+    q_idx: int,
+    student_imgs: List[str],
+    solution_imgs: List[str],
+    max_points: float
+) -> Dict[str, Any]:
+    """grade_question_images on AsyncOpenAI; images are read and encoded off the event loop."""
+    requests = await run_blocking(_grade_requests, q_idx, student_imgs, solution_imgs, max_points)
+    outs = await asyncio.gather(*(_vision_call_json_async(msgs) for msgs in requests))
+    return _merge_grades(list(outs), max_points)
+
+# ---------- 4) Grade a question from typed text (PDF text layer) ----------
+def _text_grade_messages(
+    q_idx: int,
+    student_text: str,
+    chunk: List[Dict[str, Any]],
+    solution_text: Optional[str],
+    sol_payload: List[Dict[str, Any]],
+    max_points: float,
+) -> List[Dict[str, Any]]:
+    solution = ([{"type":"text","text":f"Official solution (text):\n{solution_text}"}] if solution_text
+                else [{"type":"text","text":"Official solution images:"}, *sol_payload])
+    scanned = [{"type":"text","text":"Student images (scanned or handwritten pages):"}, *chunk] if chunk else []
+    return [
+        {"role":"system","content":(
+            "You are an auto-grader for STEM exams. "
+            "Compare the student's answer to the official solution. "
+            "Award partial credit for correct steps even if final value differs. Return STRICT JSON."
+        )},
+        {"role":"user","content":[
+            {"type":"text","text":(
+                f"Grade *Question {q_idx}* only. Max points: {max_points}.\n"
+                "Return JSON with:\n{\n  \"points\": number 0..Max,\n"
+                "  \"rationale\": \"short\",\n"
+                "  \"strengths\": [\"kw\",...],\n"
+                "  \"missing\": [\"kw\",...]\n}\n"
+                "Only evaluate relevant steps; ignore other pages/questions."
+            )},
+            *solution,
+            {"type":"text","text":f"Student answer (typed pages, extracted text):\n{student_text}"},
+            *scanned,
+        ]}
+    ]
+
+def _text_grade_requests(
+    q_idx: int,
+    student_text: str,
+    scanned_imgs: List[str],
+    solution_text: Optional[str],
+    solution_imgs: List[str],
+    max_points: float,
+) -> Tuple[List[List[Dict[str, Any]]], str, Optional[str]]:
+    """Requests plus the stage/model to use: text-only calls go to TEXT_GRADING_MODEL."""
+    sol_payload = [] if solution_text else _images(solution_imgs)
+    chunks = _chunks(scanned_imgs) or [[]]
+    requests = [_text_grade_messages(q_idx, student_text, _images(chunk), solution_text,
+                                     sol_payload, max_points) for chunk in chunks]
+    if scanned_imgs or sol_payload:
+        return requests, "grade", None
+    return requests, "grade_text", settings.TEXT_GRADING_MODEL or None
+
+def grade_question_text(
+    q_idx: int,
+    student_text: str,
+    scanned_imgs: List[str],
+    solution_text: Optional[str],
+    solution_imgs: List[str],
+    max_points: float
+) -> Dict[str, Any]:
+    """
+    Grade Q{q_idx} from the student's typed pages as text; images are sent only
+    for the scanned pages (and for the solution when it has no text layer).
+    Returns {points, feedback:{rationale,strengths,missing}}
+    """
+    requests, stage, model = _text_grade_requests(
+        q_idx, student_text, scanned_imgs, solution_text, solution_imgs, max_points)
+    return _merge_grades([_vision_call_json(msgs, stage=stage, model=model) for msgs in requests],
+                         max_points)
+
+async def grade_question_text_async(
+    q_idx: int,
+    student_text: str,
+    scanned_imgs: List[str],
+    solution_text: Optional[str],
+    solution_imgs: List[str],
+    max_points: float
+) -> Dict[str, Any]:
+    """grade_question_text on AsyncOpenAI."""
+    requests, stage, model = await run_blocking(
+        _text_grade_requests, q_idx, student_text, scanned_imgs, solution_text, solution_imgs, max_points)
+    outs = await asyncio.gather(*(_vision_call_json_async(msgs, stage=stage, model=model)
+                                  for msgs in requests))
+    return _merge_grades(list(outs), max_points)
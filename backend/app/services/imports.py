@@ -0,0 +1,260 @@
+"""
+Bulk import of scanned paper exams.
+
+A professor uploads either
+
+  * a ZIP of per-student PDFs — each file is matched to a student by the
+    email (or the email's local part) in its file name, or
+  * one multi-student scan — split every ``pages_per_student`` pages or at
+    each cover page (a page whose OCR text contains an email address); each
+    part is matched by the email found on its first page.
+
+Parts of a split scan share the scan's blob and rendered pages. Every matched
+file then goes through the normal grading pipeline on a bounded thread pool;
+progress and a per-file summary are written to the ``Job`` row as files finish.
+"""
+from __future__ import annotations
+import logging
+import re
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import PurePosixPath
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import settings
+from ..database import SessionLocal
+from . import pipeline, scheduler, storage
+from .blobstore import get_store
+from .similarity import ocr_image
+
+logger = logging.getLogger(__name__)
+
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+")
+SPLIT_MODES = {"pages", "cover"}
+
+
+@dataclass
+class ImportItem:
+    name: str                              # ZIP member or "pages 5-8"
+    hint: str                              # file name stem or first-page OCR text
+    blob_sha256: Optional[str] = None
+    page_keys: Optional[List[str]] = None  # None → the pipeline renders the blob
+    ocr_texts: Optional[List[str]] = None
+    student_id: Optional[str] = None
+    student_email: Optional[str] = None
+    error: Optional[str] = None
+    result: Dict = field(default_factory=dict)
+
+
+# ── Splitting ─────────────────────────────────────────────────────────────────
+
+def _zip_items(db: Session, zip_path: str) -> List[ImportItem]:
+    items: List[ImportItem] = []
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in zf.infolist():
+            path = PurePosixPath(info.filename)
+            if info.is_dir() or "__MACOSX" in path.parts or path.name.startswith("."):
+                continue
+            item = ImportItem(name=info.filename, hint=path.stem)
+            if path.suffix.lower() != ".pdf":
+                item.error = "Not a PDF"
+            else:
+                try:
+                    with zf.open(info) as src:
+                        item.blob_sha256 = storage.save_stream(src, db).sha256
+                    db.commit()
+                except storage.UploadTooLarge as exc:
+                    item.error = str(exc)
+            items.append(item)
+    return items
+
+
+def _ocr_pages(page_keys: List[str]) -> List[str]:
+    with ThreadPoolExecutor(max_workers=settings.IMPORT_CONCURRENCY) as pool:
+        return list(pool.map(ocr_image, storage.fetch(page_keys)))
+
+
+def _split_items(scan_sha: str, mode: str, per: int) -> List[ImportItem]:
+    keys = storage.render_pages(scan_sha)
+    texts = _ocr_pages(keys)
+    if mode == "pages":
+        starts = list(range(0, len(keys), per))
+    else:
+        if not any(texts):
+            raise ValueError("Cover-page detection needs OCR text (is tesseract installed?)")
+        starts = [i for i, t in enumerate(texts) if EMAIL_RE.search(t)]
+        if not starts:
+            raise ValueError("No cover pages found (no page contains an email address)")
+    items: List[ImportItem] = []
+    if starts and starts[0] > 0:
+        items.append(ImportItem(
+            name=f"pages 1-{starts[0]}", hint="", error="Pages before the first cover page",
+        ))
+    for start, end in zip(starts, starts[1:] + [len(keys)]):
+        items.append(ImportItem(
+            name=f"pages {start + 1}-{end}",
+            hint=texts[start],
+            blob_sha256=scan_sha,
+            page_keys=keys[start:end],
+            ocr_texts=texts[start:end],
+        ))
+    return items
+
+
+# ── Student matching ──────────────────────────────────────────────────────────
+
+def _match_students(db: Session, items: List[ImportItem]) -> None:
+    """Resolve each item's hint to a student (batched lookups; no per-file query)."""
+    pending = [i for i in items if not i.error]
+    emails = {e.lower() for i in pending for e in EMAIL_RE.findall(i.hint)}
+    stems = {i.hint.strip().lower() for i in pending if i.hint and not EMAIL_RE.search(i.hint)}
+
+    by_email: Dict[str, models.User] = {}
+    by_local: Dict[str, List[models.User]] = {}
+    if emails:
+        for u in db.query(models.User).filter(
+            models.User.role == "STUDENT", func.lower(models.User.email).in_(emails)
+        ):
+            by_email[u.email.lower()] = u
+    stem_list = sorted(stems)
+    for i in range(0, len(stem_list), 200):
+        patterns = [func.lower(models.User.email).like(f"{s}@%") for s in stem_list[i:i + 200]]
+        for u in db.query(models.User).filter(models.User.role == "STUDENT", or_(*patterns)):
+            by_local.setdefault(u.email.split("@", 1)[0].lower(), []).append(u)
+
+    claimed: Dict[str, str] = {}
+    for item in pending:
+        found = [by_email[e.lower()] for e in EMAIL_RE.findall(item.hint) if e.lower() in by_email]
+        if not found:
+            found = by_local.get(item.hint.strip().lower(), [])
+        if not found:
+            item.error = "No student matches this file"
+        elif len({u.id for u in found}) > 1:
+            item.error = "Matches several students: " + ", ".join(sorted({u.email for u in found}))
+        elif found[0].id in claimed:
+            item.error = f"Student {found[0].email} already matched by {claimed[found[0].id]}"
+        else:
+            item.student_id, item.student_email = found[0].id, found[0].email
+            claimed[found[0].id] = item.name
+
+
+# ── Runner ────────────────────────────────────────────────────────────────────
+
+class _Progress:
+    """Serializes per-file updates to the job row."""
+
+    def __init__(self, job_id: int, items: List[ImportItem]):
+        self.job_id = job_id
+        self.items = items
+        self.lock = threading.Lock()
+
+    def summary(self) -> List[Dict]:
+        return [
+            {"file": i.name, "student": i.student_email, "error": i.error, **i.result}
+            for i in self.items
+        ]
+
+    def record(self, item: ImportItem) -> None:
+        counter = models.Job.failed if item.error else models.Job.done
+        with self.lock, SessionLocal() as db:
+            db.execute(
+                update(models.Job)
+                .where(models.Job.id == self.job_id)
+                .values({counter: counter + 1, models.Job.results: self.summary()})
+            )
+            db.commit()
+
+
+def _existing_submission(db: Session, exam_id: int, student_id: str, sha256: str) -> Optional[int]:
+    """This student's submission of these bytes, e.g. from an earlier run of a reclaimed job."""
+    row = (
+        db.query(models.Submission.id)
+        .join(models.SubmissionDoc, models.SubmissionDoc.submission_id == models.Submission.id)
+        .filter(models.Submission.exam_id == exam_id,
+                models.Submission.student_id == student_id,
+                models.SubmissionDoc.blob_sha256 == sha256)
+        .order_by(models.Submission.id)
+        .first()
+    )
+    return row[0] if row else None
+
+
+def _process(exam_id: int, item: ImportItem) -> None:
+    with SessionLocal() as db, scheduler.work_class(scheduler.BULK, exam_id):
+        try:
+            # Re-running a job (lease expired, worker restarted) finishes what it started
+            sub_id = _existing_submission(db, exam_id, item.student_id, item.blob_sha256)
+            if sub_id:
+                out = pipeline.run_stages(db, sub_id, ocr_texts=item.ocr_texts)
+            else:
+                blob = db.get(models.Blob, item.blob_sha256)
+                pipeline.ensure_enrolled(db, exam_id, item.student_id)
+                out = pipeline.grade_submission(
+                    db, exam_id, item.student_id, blob, item.page_keys, ocr_texts=item.ocr_texts
+                )
+            item.result = {"submission_id": out["submission_id"], "grade_total": out["grade_total"]}
+        except Exception as exc:
+            db.rollback()
+            logger.exception(f"[import] {item.name} failed")
+            item.error = str(exc) or exc.__class__.__name__
+
+
+def run_import(job_id: int) -> None:
+    """Background entry point: split, match and grade everything in the job's upload."""
+    db = SessionLocal()
+    job = db.get(models.Job, job_id)
+    if job.finished_at is not None:
+        db.close()  # a reclaimed task for a run that already finished
+        return
+    try:
+        job.status, job.started_at = "RUNNING", datetime.utcnow()
+        job.done = job.failed = 0  # counted again below, item by item
+        db.commit()
+        params = job.params or {}
+        if params.get("format") == "zip":
+            items = _zip_items(db, get_store().local_path(storage.blob_key(job.blob_sha256)))
+        else:
+            items = _split_items(job.blob_sha256, params["split"], int(params.get("pages_per_student") or 1))
+        _match_students(db, items)
+
+        progress = _Progress(job_id, items)
+        job.total = len(items)
+        job.results = progress.summary()
+        db.commit()
+
+        for item in items:
+            if item.error:
+                progress.record(item)
+
+        exam_id = job.exam_id  # the session stays on this thread
+
+        def work(item: ImportItem) -> None:
+            _process(exam_id, item)
+            progress.record(item)
+
+        with ThreadPoolExecutor(max_workers=settings.IMPORT_CONCURRENCY) as pool:
+            list(pool.map(work, [i for i in items if not i.error]))
+        for item in items:
+            if item.error and item.blob_sha256 != job.blob_sha256:
+                storage.prune(db, item.blob_sha256)
+        db.refresh(job)
+        job.status = "DONE"
+    except Exception as exc:
+        db.rollback()
+        logger.exception(f"[import] job {job_id} failed")
+        job = db.get(models.Job, job_id)
+        job.status, job.error = "FAILED", str(exc) or exc.__class__.__name__
+    finally:
+        job.finished_at = datetime.utcnow()
+        sha, job.blob_sha256 = job.blob_sha256, None
+        db.flush()
+        storage.release(db, sha)  # split parts keep their own references
+        db.commit()
+        db.close()
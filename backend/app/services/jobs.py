@@ -0,0 +1,165 @@
+"""
+Background jobs (see models.Job): the per-submission item runner shared by
+regrade and retry jobs, plus progress, throughput and ETA reporting.
+"""
+from __future__ import annotations
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = ("QUEUED", "RUNNING")
+ITEM_KINDS = ("regrade", "retry")  # jobs tracked per submission in job_items
+
+
+def active_job(db: Session, exam_id: int, kind: str) -> Optional[models.Job]:
+    return (
+        db.query(models.Job)
+        .filter(models.Job.exam_id == exam_id, models.Job.kind == kind,
+                models.Job.status.in_(ACTIVE))
+        .first()
+    )
+
+
+def in_active_job(db: Session, submission_id: int) -> bool:
+    """True if a running regrade/retry job still has *submission_id* to do."""
+    return db.query(
+        db.query(models.JobItem.id)
+        .join(models.Job, models.Job.id == models.JobItem.job_id)
+        .filter(models.JobItem.submission_id == submission_id,
+                models.JobItem.status == "PENDING",
+                models.Job.status.in_(ACTIVE))
+        .exists()
+    ).scalar()
+
+
+# ── Item runner ───────────────────────────────────────────────────────────────
+
+def sync_counts(db: Session, job_id: int) -> None:
+    counts = dict(
+        db.query(models.JobItem.status, func.count(models.JobItem.id))
+        .filter(models.JobItem.job_id == job_id)
+        .group_by(models.JobItem.status)
+        .all()
+    )
+    db.query(models.Job).filter(models.Job.id == job_id).update(
+        {"done": counts.get("DONE", 0), "failed": counts.get("FAILED", 0)},
+        synchronize_session=False,
+    )
+
+
+def finish_item(db: Session, item: models.JobItem, error: Optional[str] = None) -> None:
+    """Mark *item* DONE (or FAILED with *error*) and refresh the job counters; caller commits."""
+    item.status = "FAILED" if error else "DONE"
+    item.error = error
+    item.updated_at = datetime.utcnow()
+    db.flush()
+    sync_counts(db, item.job_id)
+
+
+def fail_item(db: Session, job_id: int, submission_id: int, error: str) -> None:
+    item = (
+        db.query(models.JobItem)
+        .filter(models.JobItem.job_id == job_id, models.JobItem.submission_id == submission_id)
+        .first()
+    )
+    if item and item.status != "DONE":
+        finish_item(db, item, error)
+        db.commit()
+
+
+def finish_if_complete(db: Session, job_id: int) -> None:
+    """Queue mode: close the job once no item is PENDING."""
+    pending = (
+        db.query(models.JobItem.id)
+        .filter(models.JobItem.job_id == job_id, models.JobItem.status == "PENDING")
+        .first()
+    )
+    if pending:
+        return
+    sync_counts(db, job_id)
+    db.query(models.Job).filter(models.Job.id == job_id, models.Job.status == "RUNNING").update(
+        {"status": "DONE", "finished_at": datetime.utcnow()}, synchronize_session=False
+    )
+    db.commit()
+
+
+def create_item_job(db: Session, kind: str, exam_id: int, created_by: str, submission_ids) -> models.Job:
+    sub_ids = list(submission_ids)
+    job = models.Job(kind=kind, exam_id=exam_id, created_by=created_by,
+                     params={}, total=len(sub_ids))
+    db.add(job)
+    db.flush()
+    db.add_all(models.JobItem(job_id=job.id, submission_id=sid) for sid in sub_ids)
+    db.commit()
+    return job
+
+
+def run_items(job_id: int, work: Callable[[int, int, int], None], concurrency: int) -> None:
+    """
+    Run ``work(job_id, exam_id, submission_id)`` for every item not yet DONE on
+    a bounded pool. *work* marks its own item (finish_item) so the checkpoint
+    can share a transaction with its output. Safe to call again to resume.
+    """
+    db = SessionLocal()
+    job = db.get(models.Job, job_id)
+    try:
+        job.status, job.started_at, job.finished_at, job.error = (
+            "RUNNING", datetime.utcnow(), None, None
+        )
+        db.commit()
+        todo = [
+            sid for (sid,) in db.query(models.JobItem.submission_id)
+            .filter(models.JobItem.job_id == job_id, models.JobItem.status != "DONE")
+            .order_by(models.JobItem.submission_id)
+        ]
+        exam_id = job.exam_id
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda sid: work(job_id, exam_id, sid), todo))
+        job.status = "DONE"
+    except Exception as exc:
+        db.rollback()
+        logger.exception(f"[{job.kind}] job {job_id} failed")
+        job.status, job.error = "FAILED", str(exc) or exc.__class__.__name__
+    finally:
+        sync_counts(db, job_id)
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        db.close()
+
+
+# ── Reporting ─────────────────────────────────────────────────────────────────
+
+def progress(db: Session, job: models.Job) -> Dict[str, Any]:
+    """Completion ratio plus items/minute and ETA for the current run."""
+    finished = job.done + job.failed
+    out: Dict[str, Any] = {
+        "progress": round(finished / job.total, 3) if job.total else 0.0,
+        "throughput_per_min": None,
+        "eta_seconds": None,
+    }
+    if not job.started_at:
+        return out
+    end = job.finished_at or datetime.utcnow()
+    elapsed = max((end - job.started_at).total_seconds(), 1e-3)
+    # A resumed run only counts what it finished itself.
+    this_run = (
+        db.query(func.count(models.JobItem.id))
+        .filter(models.JobItem.job_id == job.id,
+                models.JobItem.status.in_(("DONE", "FAILED")),
+                models.JobItem.updated_at >= job.started_at)
+        .scalar()
+    ) if job.kind in ITEM_KINDS else finished
+    rate = this_run / elapsed
+    out["throughput_per_min"] = round(rate * 60, 2)
+    if job.status == "RUNNING" and rate > 0:
+        out["eta_seconds"] = round((job.total - finished) / rate, 1)
+    return out
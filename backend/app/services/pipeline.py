@@ -0,0 +1,614 @@
+"""
+Submission grading pipeline shared by the student upload, bulk import and
+retries.
+
+A submission is created together with its SubmissionDoc (the stored PDF is
+referenced from the start) and then moves through explicit stages, each of
+which persists its output and is skipped when that output already exists:
+
+  render      doc_pages rows for the submission (typed pages of digital PDFs
+              get their text from the PDF's text layer right away)
+  grade       one QuestionResult per question (run "submit"), then Answers +
+              Grade + status GRADED in one transaction
+  ocr         DocPage.ocr_text for every page that has none yet
+  similarity  run_similarity_check, recorded in Submission.similarity_at
+
+A failing stage records ``failed_stage``/``error`` on the Submission (status
+FAILED if grading never finished) and ``run_stages`` can simply be called
+again: finished stages and already-graded questions are not redone.
+``run_stages_async`` is the same pipeline for the async submit route.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import metrics, models
+from ..config import settings
+from ..database import SessionLocal
+from . import documents, executors, jobs, queue, scheduler, solution_assets, storage
+from .grading_vision import (
+    grade_question_images, grade_question_images_async,
+    grade_question_text, grade_question_text_async,
+)
+from .similarity import ocr_image, run_similarity_check
+from .spans import detect_spans, detect_spans_async
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("render", "grade", "ocr", "similarity")
+SUBMIT_RUN = "submit"
+
+Emit = Callable[[Dict[str, Any]], None]  # progress events of run_stages_async
+
+
+class NoSolution(Exception):
+    def __init__(self):
+        super().__init__("Teacher has not uploaded a solution PDF yet")
+
+
+class StageFailed(Exception):
+    def __init__(self, submission_id: int, stage: str, cause: Exception):
+        super().__init__(f"Submission {submission_id} failed at {stage}: {cause}")
+        self.submission_id = submission_id
+        self.stage = stage
+
+
+def has_solution(db: Session, exam_id: int) -> bool:
+    return (
+        db.query(models.SolutionDoc.id)
+        .filter(models.SolutionDoc.exam_id == exam_id)
+        .first()
+    ) is not None
+
+
+def ensure_enrolled(db: Session, exam_id: int, student_id: str) -> None:
+    if not db.query(models.ExamEnrollment).filter(
+        models.ExamEnrollment.exam_id == exam_id,
+        models.ExamEnrollment.student_id == student_id,
+    ).first():
+        db.add(models.ExamEnrollment(exam_id=exam_id, student_id=student_id))
+        db.commit()
+
+
+def solution_lookup(db: Session, exam_id: int) -> Callable[[int], List[str]]:
+    """q_idx → solution images to send (bundle data URLs, else full page files)."""
+    bundle = solution_assets.current_bundle(db, exam_id)
+    full: List[str] = []
+
+    def solution_for(qidx: int) -> List[str]:
+        # Pre-cropped, pre-encoded solution images for this question
+        entry = bundle and solution_assets.question_assets(*bundle, qidx)
+        if entry:
+            return entry["urls"]
+        if not full:
+            full.extend(storage.fetch(documents.solution_images(db, exam_id)))
+        return full
+
+    return solution_for
+
+
+def _no_answer() -> Dict[str, Any]:
+    return {
+        "points": 0.0,
+        "feedback": {
+            "rationale": "No images found for this question",
+            "strengths": [],
+            "missing": ["Provide answer"],
+        },
+    }
+
+
+def text_inputs(
+    db: Session, submission_id: int, exam_id: int
+) -> Tuple[List[Optional[str]], Optional[str]]:
+    """(per-page typed text, solution text) for TEXT_GRADING; nothing when it is off."""
+    if not settings.TEXT_GRADING:
+        return [], None
+    return (documents.submission_text_layer(db, submission_id),
+            documents.solution_text_layer(db, exam_id))
+
+
+def _split_typed(
+    student_imgs: List[str], page_texts: Optional[List[Optional[str]]]
+) -> Tuple[str, List[str]]:
+    """Typed pages joined as text, and the images of the pages that still need looking at."""
+    if not page_texts or len(page_texts) != len(student_imgs) or not any(page_texts):
+        return "", student_imgs
+    typed = "\n\n".join(f"[Page {n}]\n{t}" for n, t in enumerate(page_texts, start=1) if t)
+    return typed, [img for img, t in zip(student_imgs, page_texts) if not t]
+
+
+def grade_question(
+    q: models.Question,
+    student_imgs: List[str],
+    solution_for: Callable[[int], List[str]],
+    page_texts: Optional[List[Optional[str]]] = None,
+    solution_text: Optional[str] = None,
+) -> Dict[str, Any]:
+    if not student_imgs:
+        return _no_answer()
+    typed, scanned = _split_typed(student_imgs, page_texts)
+    if typed:
+        return grade_question_text(q.idx, typed, scanned, solution_text,
+                                   [] if solution_text else solution_for(q.idx), q.max_points)
+    return grade_question_images(q.idx, student_imgs, solution_for(q.idx), q.max_points)
+
+
+# ── Stages ────────────────────────────────────────────────────────────────────
+
+def _doc(db: Session, submission_id: int) -> models.SubmissionDoc:
+    return (
+        db.query(models.SubmissionDoc)
+        .filter(models.SubmissionDoc.submission_id == submission_id)
+        .one()
+    )
+
+
+def _render_target(db: Session, sub: models.Submission) -> Optional[models.SubmissionDoc]:
+    """The doc to render, or None if its pages are already recorded."""
+    if documents.submission_images(db, sub.id):
+        return None
+    return _doc(db, sub.id)
+
+
+def _save_pages(
+    db: Session,
+    sub: models.Submission,
+    doc: models.SubmissionDoc,
+    keys: List[str],
+    texts: Optional[List[Optional[str]]] = None,
+) -> None:
+    documents.add_submission_pages(db, doc, keys, texts)
+    db.commit()
+    metrics.PAGES.observe(len(keys), exam=sub.exam_id)
+    if texts:
+        metrics.TEXT_LAYER_PAGES.inc(sum(1 for t in texts if t), exam=sub.exam_id)
+
+
+def text_layer(sha256: str) -> Optional[List[Optional[str]]]:
+    """storage.text_layer when TEXT_LAYER is on (typed pages then skip OCR)."""
+    return storage.text_layer(sha256) if settings.TEXT_LAYER else None
+
+
+def _render(db: Session, sub: models.Submission) -> None:
+    doc = _render_target(db, sub)
+    if doc:
+        keys = storage.render_pages(doc.blob_sha256)
+        _save_pages(db, sub, doc, keys, text_layer(doc.blob_sha256))
+
+
+class _GradePlan:
+    """Everything the grade stage reads before calling the model."""
+
+    def __init__(self, db: Session, sub: models.Submission):
+        exam_id = sub.exam_id
+        self.student_keys = documents.submission_images(db, sub.id)
+        self.student_imgs = storage.fetch(self.student_keys)
+        self.blob_sha256 = _doc(db, sub.id).blob_sha256
+
+        # ── Load professor solution ───────────────────────────────────────────
+        self.solution_for = solution_lookup(db, exam_id)
+        self.spans = documents.solution_spans(db, exam_id)
+
+        # Typed pages go to the model as text (TEXT_GRADING)
+        self.page_texts, self.solution_text = text_inputs(db, sub.id, exam_id)
+
+        # ── Load questions ────────────────────────────────────────────────────
+        questions = (
+            db.query(models.Question)
+            .filter(models.Question.exam_id == exam_id)
+            .all()
+        )
+        self.by_idx = {q.idx: q for q in questions}
+
+        # Naive: all pages for every question (vision model is given the full doc)
+        # unless SPANS_NARROW_PAGES finds each question's own pages (narrow())
+        self.per_question_imgs = {qidx: self.student_imgs for qidx in self.by_idx}
+        self.per_question_texts = {qidx: self.page_texts for qidx in self.by_idx}
+
+        # Questions graded by an earlier attempt (checkpoints)
+        self.done: Dict[int, Dict[str, Any]] = {
+            qid: result for qid, result in db.query(
+                models.QuestionResult.question_id, models.QuestionResult.result
+            ).filter(
+                models.QuestionResult.submission_id == sub.id,
+                models.QuestionResult.run == SUBMIT_RUN,
+            )
+        }
+
+    def todo(self) -> List[models.Question]:
+        return [q for _, q in sorted(self.by_idx.items()) if q.id not in self.done]
+
+    def wants_student_spans(self) -> bool:
+        return not self.spans or settings.SPANS_NARROW_PAGES
+
+    def use_student_spans(self, student_spans: List[Dict[str, Any]]) -> None:
+        if not self.spans:
+            self.spans = student_spans
+        if settings.SPANS_NARROW_PAGES:
+            self.narrow(student_spans)
+
+    def narrow(self, student_spans: List[Dict[str, Any]]) -> None:
+        """Give each question only the student pages its span covers (all questions found)."""
+        pages = {
+            item["q_idx"]: sorted({seg["page"] for seg in item["segments"]
+                                   if 1 <= seg["page"] <= len(self.student_imgs)})
+            for item in student_spans
+        }
+        if set(pages) != set(self.by_idx) or not all(pages.values()):
+            return
+        self.per_question_imgs = {q: [self.student_imgs[p - 1] for p in ps] for q, ps in pages.items()}
+        if self.page_texts:
+            self.per_question_texts = {q: [self.page_texts[p - 1] for p in ps] for q, ps in pages.items()}
+
+
+def _grade_plan(db: Session, sub: models.Submission) -> Optional[_GradePlan]:
+    if db.query(models.Grade.id).filter(models.Grade.submission_id == sub.id).first():
+        return None
+    return _GradePlan(db, sub)
+
+
+def _checkpoint(db: Session, submission_id: int, question_id: int, result: Dict[str, Any]) -> None:
+    try:
+        db.add(models.QuestionResult(
+            submission_id=submission_id, question_id=question_id, run=SUBMIT_RUN, result=result,
+        ))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+
+
+def _save_grade(db: Session, sub: models.Submission, plan: _GradePlan) -> None:
+    """Answers + Grade + status GRADED in one transaction."""
+    total = 0.0
+    breakdown = {}
+    db.execute(delete(models.Answer).where(models.Answer.submission_id == sub.id))
+    for qidx, q in sorted(plan.by_idx.items()):
+        breakdown[str(q.id)] = plan.done[q.id]
+        if not plan.per_question_imgs.get(qidx):
+            continue
+        total += plan.done[q.id]["points"]
+        db.add(
+            models.Answer(
+                submission_id=sub.id,
+                question_id=q.id,
+                text=f"[Q{qidx}: image-based answer]",
+            )
+        )
+    db.add(models.Grade(submission_id=sub.id, total=round(total, 2), breakdown=breakdown))
+    sub.status = "GRADED"
+    db.commit()
+
+
+def _grade(db: Session, sub: models.Submission) -> None:
+    plan = _grade_plan(db, sub)
+    if plan is None:
+        return
+    if plan.wants_student_spans():
+        plan.use_student_spans(detect_spans(
+            plan.student_keys, plan.student_imgs, plan.blob_sha256,
+            expected=len(plan.by_idx), kind="submission", fallback=not plan.spans,
+        ))
+
+    # ── Grade each question (checkpointed) ────────────────────────────────────
+    for q in plan.todo():
+        plan.done[q.id] = grade_question(q, plan.per_question_imgs.get(q.idx, []), plan.solution_for,
+                                         plan.per_question_texts.get(q.idx), plan.solution_text)
+        _checkpoint(db, sub.id, q.id, plan.done[q.id])
+
+    _save_grade(db, sub, plan)
+
+
+def _ocr(db: Session, sub: models.Submission, ocr_texts: Optional[List[str]] = None) -> None:
+    pages = (
+        db.query(models.DocPage.id, models.DocPage.page_no, models.DocPage.image_path)
+        .join(models.SubmissionDoc, models.SubmissionDoc.id == models.DocPage.submission_doc_id)
+        .filter(models.SubmissionDoc.submission_id == sub.id, models.DocPage.ocr_text.is_(None))
+        .order_by(models.DocPage.page_no)
+        .all()
+    )
+    if not pages:
+        return
+    local = storage.fetch([key for _, _, key in pages])
+    texts = [
+        ocr_texts[page_no - 1] if ocr_texts is not None and page_no <= len(ocr_texts)
+        else ocr_image(path)  # empty string if pytesseract unavailable
+        for (_, page_no, _), path in zip(pages, local)
+    ]
+    # Write only after all pages are read: OCR waits for CPU slots, and an
+    # open write transaction must not wait on them (SQLite locks the file)
+    for (page_id, _, _), text in zip(pages, texts):
+        documents.set_page_ocr(db, page_id, text)
+    db.commit()
+
+
+def _similarity(db: Session, sub: models.Submission) -> None:
+    if sub.similarity_at:
+        return
+    run_similarity_check(sub.exam_id, sub.id, db)
+    sub.similarity_at = datetime.utcnow()
+    db.commit()
+
+
+# ── Entry points ──────────────────────────────────────────────────────────────
+
+def create_submission(
+    db: Session,
+    exam_id: int,
+    student_id: str,
+    blob: models.Blob,
+    page_keys: Optional[List[str]] = None,
+) -> models.Submission:
+    """
+    Record a submission of *blob*. *page_keys* pins already-rendered pages
+    (e.g. one student's part of a split scan); otherwise the render stage
+    renders the whole PDF.
+    """
+    if not has_solution(db, exam_id):
+        raise NoSolution()
+    sub = models.Submission(exam_id=exam_id, student_id=student_id, status="PENDING")
+    db.add(sub)
+    db.flush()
+    doc = models.SubmissionDoc(
+        submission_id=sub.id,
+        file_path=blob.path,
+        blob_sha256=blob.sha256,
+        extracted_text="",
+    )
+    db.add(doc)
+    storage.retain(db, blob.sha256)
+    db.flush()
+    if page_keys is not None:
+        documents.add_submission_pages(db, doc, page_keys)
+    db.commit()
+    db.refresh(sub)
+    return sub
+
+
+def _begin(db: Session, submission_id: int) -> models.Submission:
+    sub = db.get(models.Submission, submission_id)
+    sub.attempts = (sub.attempts or 0) + 1
+    sub.failed_stage, sub.error = None, None
+    db.commit()
+    return sub
+
+
+def _stage_failed(db: Session, sub: models.Submission, stage: str, exc: Exception) -> None:
+    db.rollback()
+    metrics.STAGE_FAILURES.inc(stage=stage, exam=sub.exam_id)
+    logger.error(f"[pipeline] submission {sub.id} failed at {stage}", exc_info=exc)
+    sub.failed_stage, sub.error = stage, str(exc)[:1000] or exc.__class__.__name__
+    if sub.status != "GRADED":
+        sub.status = "FAILED"
+    db.commit()
+
+
+def _result(db: Session, submission_id: int, exam_id: int) -> Dict[str, Any]:
+    grade = (
+        db.query(models.Grade.total, models.Grade.breakdown)
+        .filter(models.Grade.submission_id == submission_id)
+        .one()
+    )
+    return {
+        "submission_id": submission_id,
+        "grade_total": grade.total,
+        "breakdown": grade.breakdown,
+        "answers_saved": db.query(func.count(models.Question.id))
+        .filter(models.Question.exam_id == exam_id)
+        .scalar(),
+    }
+
+
+def run_stages(
+    db: Session, submission_id: int, ocr_texts: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Run every unfinished stage of a submission. Raises StageFailed if render or
+    grading fails; OCR and similarity failures are recorded but non-fatal.
+    """
+    sub = _begin(db, submission_id)
+
+    for stage in STAGES:
+        started = time.perf_counter()
+        try:
+            if stage == "render":
+                _render(db, sub)
+            elif stage == "grade":
+                _grade(db, sub)
+            elif stage == "ocr":
+                with scheduler.work_class(scheduler.BACKGROUND, sub.exam_id):
+                    _ocr(db, sub, ocr_texts)
+            else:
+                with scheduler.work_class(scheduler.BACKGROUND, sub.exam_id):
+                    _similarity(db, sub)
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started,
+                                          stage=stage, exam=sub.exam_id)
+        except Exception as exc:
+            _stage_failed(db, sub, stage, exc)
+            if stage in ("render", "grade"):
+                raise StageFailed(submission_id, stage, exc) from exc
+            if stage == "ocr":
+                break  # similarity needs the OCR text
+
+    return _result(db, submission_id, sub.exam_id)
+
+
+def grade_submission(
+    db: Session,
+    exam_id: int,
+    student_id: str,
+    blob: models.Blob,
+    page_keys: Optional[List[str]] = None,
+    ocr_texts: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Create a submission and run all stages; *ocr_texts* skips OCR the caller already ran."""
+    sub = create_submission(db, exam_id, student_id, blob, page_keys)
+    return run_stages(db, sub.id, ocr_texts)
+
+
+# ── Async path (student submit) ───────────────────────────────────────────────
+# Same stages and bookkeeping as run_stages, for the async submit route: the
+# PDF renders in the CPU process pool, all questions are graded concurrently
+# on AsyncOpenAI, and session work runs on the bounded blocking pool. The one
+# Session is only ever used by one blocking call at a time; checkpoints from
+# the concurrent questions use their own sessions.
+
+def _checkpoint_own_session(submission_id: int, question_id: int, result: Dict[str, Any]) -> None:
+    with SessionLocal() as db:
+        _checkpoint(db, submission_id, question_id, result)
+
+
+async def _render_async(db: Session, sub: models.Submission) -> None:
+    doc = await executors.run_blocking(_render_target, db, sub)
+    if doc:
+        render = executors.run_cpu(storage.render_pages_timed, doc.blob_sha256)
+        if settings.TEXT_LAYER:
+            (keys, seconds), texts = await asyncio.gather(
+                render, executors.run_cpu(storage.text_layer, doc.blob_sha256))
+        else:
+            (keys, seconds), texts = await render, None
+        if seconds is not None:  # timed in the pool process; record it here
+            metrics.RENDER_SECONDS.observe(seconds)
+        await executors.run_blocking(_save_pages, db, sub, doc, keys, texts)
+
+
+async def _grade_async(
+    db: Session, sub: models.Submission, submission_id: int, emit: Optional[Emit] = None
+) -> None:
+    plan = await executors.run_blocking(_grade_plan, db, sub)
+    if plan is None:
+        return
+    if plan.wants_student_spans():
+        plan.use_student_spans(await detect_spans_async(
+            plan.student_keys, plan.student_imgs, plan.blob_sha256,
+            expected=len(plan.by_idx), kind="submission", fallback=not plan.spans,
+        ))
+    todo = plan.todo()
+    solutions = await executors.run_blocking(lambda: {q.idx: plan.solution_for(q.idx) for q in todo})
+
+    async def one(q: models.Question) -> None:
+        imgs = plan.per_question_imgs.get(q.idx, [])
+        typed, scanned = _split_typed(imgs, plan.per_question_texts.get(q.idx))
+        if not imgs:
+            result = _no_answer()
+        elif typed:
+            result = await grade_question_text_async(q.idx, typed, scanned, plan.solution_text,
+                                                     solutions[q.idx], q.max_points)
+        else:
+            result = await grade_question_images_async(q.idx, imgs, solutions[q.idx], q.max_points)
+        await executors.run_blocking(_checkpoint_own_session, submission_id, q.id, result)
+        plan.done[q.id] = result
+        if emit:
+            emit({
+                "event": "question",
+                "question_id": q.id,
+                "q_idx": q.idx,
+                "max_points": q.max_points,
+                **result,
+                "graded": len(plan.done),
+                "questions": len(plan.by_idx),
+                "running_total": round(sum(r["points"] for r in plan.done.values()), 2),
+            })
+
+    # Finished questions stay checkpointed even if a sibling fails
+    outcomes = await asyncio.gather(*(one(q) for q in todo), return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+    await executors.run_blocking(_save_grade, db, sub, plan)
+
+
+async def run_stages_async(
+    submission_id: int, exam_id: int, emit: Optional[Emit] = None
+) -> Dict[str, Any]:
+    """
+    run_stages without holding a thread while the model works. *emit* gets a
+    "stage" event as each stage ends and a "question" event (with the running
+    total) as each question is graded.
+    """
+    db = await executors.run_blocking(SessionLocal)
+    try:
+        sub = await executors.run_blocking(_begin, db, submission_id)
+        for stage in STAGES:
+            started = time.perf_counter()
+            try:
+                if stage == "render":
+                    await _render_async(db, sub)
+                elif stage == "grade":
+                    await _grade_async(db, sub, submission_id, emit)
+                else:
+                    with scheduler.work_class(scheduler.BACKGROUND, exam_id):
+                        await executors.run_blocking(_ocr if stage == "ocr" else _similarity, db, sub)
+                elapsed = time.perf_counter() - started
+                metrics.STAGE_SECONDS.observe(elapsed, stage=stage, exam=exam_id)
+                if emit:
+                    emit({"event": "stage", "stage": stage, "status": "done",
+                          "seconds": round(elapsed, 2)})
+            except Exception as exc:
+                await executors.run_blocking(_stage_failed, db, sub, stage, exc)
+                if emit:
+                    emit({"event": "stage", "stage": stage, "status": "failed"})
+                if stage in ("render", "grade"):
+                    raise StageFailed(submission_id, stage, exc) from exc
+                if stage == "ocr":
+                    break  # similarity needs the OCR text
+        return await executors.run_blocking(_result, db, submission_id, exam_id)
+    finally:
+        await executors.run_blocking(db.close)
+
+
+# ── Retry ─────────────────────────────────────────────────────────────────────
+
+def retry_candidates(db: Session, exam_id: int, stale_before: datetime) -> List[int]:
+    """
+    Submissions with a failed stage, or left PENDING by a crashed request.
+    Those with a queued (or deferred) or running task are left to the worker.
+    """
+    return [
+        sid for (sid,) in db.query(models.Submission.id)
+        .join(models.SubmissionDoc, models.SubmissionDoc.submission_id == models.Submission.id)
+        .filter(
+            models.Submission.exam_id == exam_id,
+            (models.Submission.failed_stage.isnot(None))
+            | ((models.Submission.status == "PENDING")
+               & (models.Submission.submitted_at < stale_before)),
+            ~queue.has_open_task(models.Submission.id),
+        )
+        .order_by(models.Submission.id)
+    ]
+
+
+def retry_item(job_id: int, exam_id: int, submission_id: int) -> None:
+    """jobs.run_items worker for kind "retry"."""
+    with SessionLocal() as db, scheduler.work_class(scheduler.BULK, exam_id):
+        item = (
+            db.query(models.JobItem)
+            .filter(models.JobItem.job_id == job_id, models.JobItem.submission_id == submission_id)
+            .one()
+        )
+        item.attempts += 1
+        db.commit()
+        error = None
+        try:
+            run_stages(db, submission_id)
+            failed = db.query(models.Submission.failed_stage).filter(
+                models.Submission.id == submission_id
+            ).scalar()
+            if failed:
+                error = f"failed at {failed}"
+        except StageFailed as exc:
+            error = str(exc)
+        jobs.finish_item(db, item, error)
+        db.commit()
+
+
+def run_retry(job_id: int) -> None:
+    """Background entry point for retry jobs; safe to call again to resume."""
+    jobs.run_items(job_id, retry_item, settings.REGRADE_CONCURRENCY)
@@ -0,0 +1,122 @@
+"""
+Exam-wide regrade after the solution changed.
+
+Only the grading stage is re-run, from the page images already stored for
+each submission — nothing is re-rendered, re-OCR'd or re-checked for
+similarity. Work is checkpointed at two levels:
+
+  * every graded question is saved as a ``QuestionResult`` (run
+    ``"regrade:<job id>"``) as soon as the model answers, and
+  * a submission's ``JobItem`` turns DONE in the same transaction that
+    replaces its ``Grade``, so nobody ever sees a half-regraded total.
+
+Resuming a crashed or failed job skips finished submissions and never sends
+an already-graded question to the model again.
+"""
+from __future__ import annotations
+import logging
+from typing import Any, Dict
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import settings
+from ..database import SessionLocal
+from . import documents, jobs, pipeline, scheduler, storage
+
+logger = logging.getLogger(__name__)
+
+
+def run_name(job_id: int) -> str:
+    return f"regrade:{job_id}"
+
+
+def start_regrade(db: Session, exam_id: int, prof_id: str) -> models.Job:
+    """Create the job and one PENDING item per graded submission of the exam."""
+    sub_ids = [
+        sid for (sid,) in db.query(models.Submission.id)
+        .join(models.SubmissionDoc, models.SubmissionDoc.submission_id == models.Submission.id)
+        .filter(models.Submission.exam_id == exam_id, models.Submission.status == "GRADED")
+        .order_by(models.Submission.id)
+    ]
+    return jobs.create_item_job(db, "regrade", exam_id, prof_id, sub_ids)
+
+
+def _regrade_one(job_id: int, exam_id: int, submission_id: int) -> None:
+    run = run_name(job_id)
+    with SessionLocal() as db, scheduler.work_class(scheduler.BULK, exam_id):
+        item = (
+            db.query(models.JobItem)
+            .filter(models.JobItem.job_id == job_id, models.JobItem.submission_id == submission_id)
+            .one()
+        )
+        item.attempts += 1
+        db.commit()
+        try:
+            keys = documents.submission_images(db, submission_id)
+            if not keys:
+                raise ValueError("No stored page images for this submission")
+            student_imgs = storage.fetch(keys)
+            questions = (
+                db.query(models.Question)
+                .filter(models.Question.exam_id == exam_id)
+                .order_by(models.Question.idx)
+                .all()
+            )
+            done: Dict[int, Dict[str, Any]] = {
+                qid: result for qid, result in db.query(
+                    models.QuestionResult.question_id, models.QuestionResult.result
+                ).filter(
+                    models.QuestionResult.submission_id == submission_id,
+                    models.QuestionResult.run == run,
+                )
+            }
+            solution_for = pipeline.solution_lookup(db, exam_id)
+            page_texts, solution_text = pipeline.text_inputs(db, submission_id, exam_id)
+
+            # ── Per-question checkpoints ──────────────────────────────────────
+            for q in questions:
+                if q.id in done:
+                    continue
+                result = pipeline.grade_question(q, student_imgs, solution_for, page_texts, solution_text)
+                try:
+                    db.add(models.QuestionResult(
+                        submission_id=submission_id, question_id=q.id, run=run, result=result,
+                    ))
+                    db.commit()
+                except IntegrityError:
+                    # Another runner checkpointed it first — keep theirs.
+                    db.rollback()
+                    result = db.query(models.QuestionResult.result).filter(
+                        models.QuestionResult.submission_id == submission_id,
+                        models.QuestionResult.run == run,
+                        models.QuestionResult.question_id == q.id,
+                    ).scalar()
+                done[q.id] = result
+
+            # ── Swap in the new grade (one transaction) ───────────────────────
+            breakdown = {str(q.id): done[q.id] for q in questions}
+            total = round(sum(float(r.get("points", 0) or 0) for r in breakdown.values()), 2)
+            grade = (
+                db.query(models.Grade)
+                .filter(models.Grade.submission_id == submission_id)
+                .first()
+            )
+            if grade is None:
+                grade = models.Grade(submission_id=submission_id, total=total, breakdown=breakdown)
+                db.add(grade)
+            else:
+                grade.total, grade.breakdown = total, breakdown
+            jobs.finish_item(db, item)
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            logger.exception(f"[regrade] job {job_id} submission {submission_id} failed")
+            jobs.finish_item(db, item, str(exc) or exc.__class__.__name__)
+            db.commit()
+
+
+def run_regrade(job_id: int) -> None:
+    """Background entry point; safe to call again to resume."""
+    jobs.run_items(job_id, _regrade_one, settings.REGRADE_CONCURRENCY)
@@ -0,0 +1,264 @@
+"""
+Shared scheduler for the expensive calls: vision-model requests ("model")
+and OCR / similarity work ("cpu").
+
+Every call takes a slot of its resource. The caller's priority class and
+exam come from ``work_class(...)`` (a context variable, so set it on the
+thread that does the work):
+
+  interactive  a student waiting on their upload, a professor on a solution
+  bulk         regrades, imports, retries (the default)
+  background   OCR and similarity checks
+
+When a slot frees up the waiter with the lowest virtual start time goes next
+(weighted fair queuing). Each (class, exam) pair is its own flow, weighted by
+class, so one 500-submission regrade only gets its fair share against other
+exams. Coroutines (the async submit path) wait in the same line through
+``async_slot``. Live students get two guarantees on top of that:
+
+  * ``SCHED_RESERVED_SLOTS`` of each resource are never given to bulk or
+    background work, so an interactive call rarely waits at all;
+  * an interactive waiter that has used half of ``SCHED_INTERACTIVE_SLO_SECONDS``
+    jumps the queue.
+"""
+from __future__ import annotations
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from .. import metrics
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BULK, BACKGROUND = "interactive", "bulk", "background"
+CLASSES = (INTERACTIVE, BULK, BACKGROUND)
+
+_current: ContextVar[Tuple[str, Optional[int]]] = ContextVar("work_class", default=(BULK, None))
+
+
+@contextmanager
+def work_class(cls: str, exam_id: Optional[int] = None) -> Iterator[None]:
+    """Run the block as *cls* work for *exam_id* (keeps the current exam if None)."""
+    if cls not in CLASSES:
+        raise ValueError(f"unknown work class {cls!r}")
+    token = _current.set((cls, exam_id if exam_id is not None else _current.get()[1]))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def current() -> Tuple[str, Optional[int]]:
+    """(work class, exam id) of the calling context."""
+    return _current.get()
+
+
+def _weights() -> Dict[str, float]:
+    return {
+        INTERACTIVE: settings.SCHED_WEIGHT_INTERACTIVE,
+        BULK: settings.SCHED_WEIGHT_BULK,
+        BACKGROUND: settings.SCHED_WEIGHT_BACKGROUND,
+    }
+
+
+class _Waiter:
+    __slots__ = ("cls", "exam_id", "tag", "since", "wake")
+
+    def __init__(self, cls: str, exam_id: Optional[int], tag: float, wake: Optional[Callable] = None):
+        self.cls, self.exam_id, self.tag = cls, exam_id, tag
+        self.since = time.monotonic()
+        self.wake = wake  # set for async waiters: called (under the lock) once granted
+
+
+class Resource:
+    def __init__(self, name: str, slots: int, reserved: int):
+        self.name = name
+        self.slots = max(1, slots)
+        self.reserved = max(0, min(reserved, self.slots - 1))
+        self._cond = threading.Condition()
+        self._busy: Counter = Counter()
+        self._waiting: List[_Waiter] = []
+        self._vclock = 0.0
+        self._finish: Dict[Tuple[str, Optional[int]], float] = {}
+        self._waits: Dict[str, Deque[float]] = {c: deque(maxlen=500) for c in CLASSES}
+        self._slo_misses = 0
+
+    # ── Selection ─────────────────────────────────────────────────────────────
+
+    def _next(self) -> Optional[_Waiter]:
+        if sum(self._busy.values()) >= self.slots or not self._waiting:
+            return None
+        others_busy = self._busy[BULK] + self._busy[BACKGROUND]
+        eligible = [
+            w for w in self._waiting
+            if w.cls == INTERACTIVE or others_busy < self.slots - self.reserved
+        ]
+        if not eligible:
+            return None
+        urgent_after = settings.SCHED_INTERACTIVE_SLO_SECONDS / 2
+        now = time.monotonic()
+        urgent = [w for w in eligible if w.cls == INTERACTIVE and now - w.since >= urgent_after]
+        if urgent:
+            return min(urgent, key=lambda w: w.since)
+        return min(eligible, key=lambda w: (w.tag, w.since))
+
+    # ── Acquire / release ─────────────────────────────────────────────────────
+
+    def _enqueue(self, cls: str, exam_id: Optional[int], wake: Optional[Callable] = None) -> _Waiter:
+        flow = (cls, exam_id)
+        start = max(self._vclock, self._finish.get(flow, 0.0))
+        self._finish[flow] = start + 1.0 / max(_weights()[cls], 1e-6)
+        me = _Waiter(cls, exam_id, start, wake)
+        self._waiting.append(me)
+        return me
+
+    def _grant(self, w: _Waiter) -> None:
+        self._waiting.remove(w)
+        self._busy[w.cls] += 1
+        self._vclock = max(self._vclock, w.tag)
+        if len(self._finish) > 1000:
+            self._finish = {f: t for f, t in self._finish.items() if t > self._vclock}
+
+    def _dispatch_async(self) -> None:
+        """Hand free slots to async waiters at the head of the line (they can't poll)."""
+        while True:
+            w = self._next()
+            if w is None or w.wake is None:
+                return
+            self._grant(w)
+            w.wake()
+
+    def acquire(self, cls: str, exam_id: Optional[int]) -> None:
+        with self._cond:
+            me = self._enqueue(cls, exam_id)
+            while True:
+                self._dispatch_async()
+                if self._next() is me:
+                    break
+                self._cond.wait(timeout=1.0)  # re-check so waiters age into "urgent"
+            self._grant(me)
+            self._cond.notify_all()
+        self._record_wait(me)
+
+    async def acquire_async(self, cls: str, exam_id: Optional[int]) -> None:
+        """acquire() for coroutines: waits on a future instead of holding a thread."""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def resolve() -> None:
+            if not granted.done():
+                granted.set_result(None)
+
+        with self._cond:
+            me = self._enqueue(cls, exam_id, lambda: loop.call_soon_threadsafe(resolve))
+            self._dispatch_async()
+        try:
+            await granted
+        except asyncio.CancelledError:
+            with self._cond:
+                if me in self._waiting:
+                    self._waiting.remove(me)
+                else:  # granted while being cancelled
+                    self._busy[cls] -= 1
+                self._dispatch_async()
+                self._cond.notify_all()
+            raise
+        self._record_wait(me)
+
+    def _record_wait(self, me: _Waiter) -> None:
+        waited = time.monotonic() - me.since
+        self._waits[me.cls].append(waited)
+        metrics.SCHED_WAIT_SECONDS.observe(waited, resource=self.name, work_class=me.cls)
+        if me.cls == INTERACTIVE and waited > settings.SCHED_INTERACTIVE_SLO_SECONDS:
+            self._slo_misses += 1
+            logger.warning(f"[scheduler] {self.name}: interactive call for exam {me.exam_id} "
+                           f"waited {waited:.1f}s (SLO {settings.SCHED_INTERACTIVE_SLO_SECONDS}s)")
+
+    def release(self, cls: str) -> None:
+        with self._cond:
+            self._busy[cls] -= 1
+            self._dispatch_async()
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            busy = {c: self._busy[c] for c in CLASSES}
+            waiting = Counter(w.cls for w in self._waiting)
+        out: Dict[str, Any] = {
+            "slots": self.slots,
+            "reserved_interactive": self.reserved,
+            "busy": busy,
+            "waiting": {c: waiting[c] for c in CLASSES},
+            "slo_misses": self._slo_misses,
+            "wait_seconds": {},
+        }
+        for c in CLASSES:
+            waits = sorted(self._waits[c])
+            if waits:
+                out["wait_seconds"][c] = {
+                    "p50": round(waits[len(waits) // 2], 3),
+                    "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3),
+                }
+        return out
+
+
+_resources: Dict[str, Resource] = {}
+_resources_lock = threading.Lock()
+
+
+def resource(name: str) -> Resource:
+    with _resources_lock:
+        if name not in _resources:
+            slots = (settings.SCHED_MODEL_SLOTS if name == "model"
+                     else settings.SCHED_CPU_SLOTS or (os.cpu_count() or 2))
+            _resources[name] = Resource(name, slots, settings.SCHED_RESERVED_SLOTS)
+        return _resources[name]
+
+
+@contextmanager
+def slot(name: str) -> Iterator[None]:
+    """Hold one slot of resource *name* as the current work class."""
+    cls, exam_id = _current.get()
+    res = resource(name)
+    res.acquire(cls, exam_id)
+    try:
+        yield
+    finally:
+        res.release(cls)
+
+
+@asynccontextmanager
+async def async_slot(name: str) -> AsyncIterator[None]:
+    """slot() for coroutines; shares the same slots and queue as the threaded callers."""
+    cls, exam_id = _current.get()
+    res = resource(name)
+    await res.acquire_async(cls, exam_id)
+    try:
+        yield
+    finally:
+        res.release(cls)
+
+
+def gated(name: str) -> Callable:
+    """Decorator: every call of the function holds a slot of resource *name*."""
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with slot(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def stats() -> Dict[str, Any]:
+    with _resources_lock:
+        resources = dict(_resources)
+    return {name: res.stats() for name, res in resources.items()}
@@ -9,9 +9,14 @@ Flags suspicious pairs with HIGH or MEDIUM severity.
 """
 from __future__ import annotations
 import re
-import json
+import time
 from typing import List
 
+from sqlalchemy.orm import undefer
+
+from .. import metrics
+from .scheduler import gated
+
 # ── Text similarity helpers ────────────────────────────────────────────────────
 
 def jaccard_similarity(text_a: str, text_b: str) -> float:
@@ -22,6 +27,11 @@ def jaccard_similarity(text_a: str, text_b: str) -> float:
     return len(words_a & words_b) / len(words_a | words_b)
 
 
+def flag_severity(sem: float, jacc: float) -> str:
+    """HIGH for near-verbatim matches, MEDIUM for anything else above threshold."""
+    return "HIGH" if (sem >= 0.95 or jacc >= 0.92) else "MEDIUM"
+
+
 _sem_model = None
 
 
@@ -56,22 +66,26 @@ def semantic_similarity(text_a: str, text_b: str) -> float:
 
 # ── OCR helper ────────────────────────────────────────────────────────────────
 
-def ocr_images(img_paths: List[str]) -> str:
-    """OCR a list of images → combined text. Empty string if unavailable."""
+@gated("cpu")
+def ocr_image(img_path: str) -> str:
+    """OCR one page image → stripped text. Empty string if unavailable."""
     try:
         import pytesseract
         from PIL import Image
-        parts = []
-        for p in img_paths:
-            try:
-                text = pytesseract.image_to_string(Image.open(p), config="--psm 3")
-                if text.strip():
-                    parts.append(text.strip())
-            except Exception:
-                pass
-        return "\n\n".join(parts)
     except ImportError:
         return ""
+    started = time.perf_counter()
+    try:
+        return pytesseract.image_to_string(Image.open(img_path), config="--psm 3").strip()
+    except Exception:
+        return ""
+    finally:
+        metrics.OCR_SECONDS.observe(time.perf_counter() - started)
+
+
+def ocr_images(img_paths: List[str]) -> str:
+    """OCR a list of images → combined text. Empty string if unavailable."""
+    return "\n\n".join(t for t in (ocr_image(p) for p in img_paths) if t)
 
 
 # ── Internal: resolve text for a submission ───────────────────────────────────
@@ -79,28 +93,20 @@ def ocr_images(img_paths: List[str]) -> str:
 def _submission_text(submission_id: int, db) -> str:
     """
     Return the best available text for a submission:
-    1. OCR stored in SubmissionDoc.extracted_text["ocr"]
+    1. Page OCR stored in doc_pages.ocr_text
     2. Concatenated grade feedback (rationale + strengths + missing)
     """
     from .. import models
+    from . import documents
 
-    doc = (
-        db.query(models.SubmissionDoc)
-        .filter(models.SubmissionDoc.submission_id == submission_id)
-        .first()
-    )
-    if doc:
-        try:
-            data = json.loads(doc.extracted_text or "{}")
-            ocr = data.get("ocr", "")
-            if ocr and len(ocr.strip()) > 50:
-                return ocr
-        except Exception:
-            pass
+    ocr = documents.submission_ocr(db, submission_id)
+    if ocr and len(ocr.strip()) > 50:
+        return ocr
 
     # Fallback: grade feedback text
     grade = (
         db.query(models.Grade)
+        .options(undefer(models.Grade.breakdown))
         .filter(models.Grade.submission_id == submission_id)
         .first()
     )
@@ -118,12 +124,18 @@ def _submission_text(submission_id: int, db) -> str:
 
 # ── Main entry point ──────────────────────────────────────────────────────────
 
+@gated("cpu")
 def run_similarity_check(exam_id: int, new_submission_id: int, db) -> int:
     """
     Compare *new_submission_id* against every other graded submission for
     *exam_id*. Creates SimilarityFlag rows for suspicious pairs.
     Returns the number of new flags created.
     """
+    with metrics.SIMILARITY_SECONDS.time(exam=exam_id):
+        return _compare(exam_id, new_submission_id, db)
+
+
+def _compare(exam_id: int, new_submission_id: int, db) -> int:
     from .. import models
     from ..config import settings
 
@@ -158,6 +170,7 @@ def run_similarity_check(exam_id: int, new_submission_id: int, db) -> int:
         other_text = _submission_text(other_sub.id, db)
         if not other_text:
             continue
+        metrics.SIMILARITY_COMPARISONS.inc(exam=exam_id)
 
         jacc = jaccard_similarity(new_text, other_text)
         sem = semantic_similarity(new_text, other_text)
@@ -165,7 +178,7 @@ def run_similarity_check(exam_id: int, new_submission_id: int, db) -> int:
         if sem < settings.SIM_THRESH_SEM and jacc < settings.SIM_THRESH_JACC:
             continue
 
-        severity = "HIGH" if (sem >= 0.95 or jacc >= 0.92) else "MEDIUM"
+        severity = flag_severity(sem, jacc)
         sub_a = min(new_submission_id, other_sub.id)
         sub_b = max(new_submission_id, other_sub.id)
 
@@ -186,6 +199,7 @@ def run_similarity_check(exam_id: int, new_submission_id: int, db) -> int:
             if sem > existing.sem or jacc > existing.jacc:
                 existing.sem = round(sem, 4)
                 existing.jacc = round(jacc, 4)
+                existing.severity = severity
                 existing.reason = (
                     f"{severity}: sem={sem:.1%}, jacc={jacc:.1%} (document-level)"
                 )
@@ -199,6 +213,7 @@ def run_similarity_check(exam_id: int, new_submission_id: int, db) -> int:
                 question_id=q.id,
                 sem=round(sem, 4),
                 jacc=round(jacc, 4),
+                severity=severity,
                 reason=f"{severity}: sem={sem:.1%}, jacc={jacc:.1%} (document-level)",
             )
         )
@@ -0,0 +1,213 @@
+"""
+Per-question solution asset bundles.
+
+When a solution is uploaded, every question's spans are cropped out of the
+rendered pages once, resized to what the vision model actually looks at,
+and stored next to the pages together with their base64 data URLs and
+byte/token estimates:
+
+    pages/<sha[:2]>/<sha>/assets/<version>/manifest.json
+    pages/<sha[:2]>/<sha>/assets/<version>/q001.json     {urls, bytes, est_tokens, ...}
+    pages/<sha[:2]>/<sha>/assets/<version>/q001_01.png
+
+``version`` combines the asset format and a hash of the spans, so re-detected
+spans for the same PDF get a new bundle and an unchanged upload reuses the old
+one. ``SolutionDoc.assets_version`` points at the current bundle. Grading loads
+one small JSON per question (cached in-process) and never re-encodes a page.
+Questions without spans fall back to the ``full`` entry (every page).
+"""
+from __future__ import annotations
+import base64
+import hashlib
+import io
+import json
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from .blobstore import get_store
+from .storage import fetch, pages_prefix
+
+ASSET_FORMAT = 1
+FULL = "full"
+
+# The vision model fits images into 2048×2048, then scales the short side to 768,
+# and bills 85 tokens + 170 per 512px tile ("high" detail).
+_MAX_SIDE = 2048
+_SHORT_SIDE = 768
+_CROP_PAD = 0.01
+
+
+# ── Sizing ────────────────────────────────────────────────────────────────────
+
+def _vision_size(w: int, h: int) -> tuple[int, int]:
+    scale = min(1.0, _MAX_SIDE / max(w, h))
+    w, h = w * scale, h * scale
+    scale = min(1.0, _SHORT_SIDE / min(w, h))
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+
+def estimate_image_tokens(w: int, h: int) -> int:
+    w, h = _vision_size(w, h)
+    return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+
+
+# ── Build ─────────────────────────────────────────────────────────────────────
+
+def assets_version(spans: List[Dict[str, Any]]) -> str:
+    digest = hashlib.sha256(json.dumps(spans, sort_keys=True).encode()).hexdigest()
+    return f"v{ASSET_FORMAT}-{digest[:12]}"
+
+
+def assets_prefix(sha256: str, version: str) -> str:
+    return f"{pages_prefix(sha256)}/assets/{version}"
+
+
+def _entry_key(prefix: str, q: Any) -> str:
+    return f"{prefix}/{FULL}.json" if q == FULL else f"{prefix}/q{int(q):03d}.json"
+
+
+def _encode(im) -> bytes:
+    im = im.convert("RGB")
+    size = _vision_size(*im.size)
+    if size != im.size:
+        from PIL import Image
+        im = im.resize(size, Image.LANCZOS)
+    buf = io.BytesIO()
+    im.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def _crop(path: str, y_top: float, y_bottom: float):
+    from PIL import Image
+    im = Image.open(path)
+    w, h = im.size
+    y1 = max(0, int((min(y_top, y_bottom) - _CROP_PAD) * h))
+    y2 = min(h, int((max(y_top, y_bottom) + _CROP_PAD) * h))
+    if y2 - y1 < 2:
+        return im
+    return im.crop((0, y1, w, y2))
+
+
+def _entry(q_idx: Any, images: List, prefix: str, uploads: List[tuple[str, bytes]]) -> Dict[str, Any]:
+    urls, keys, sizes, total, tokens = [], [], [], 0, 0
+    for n, im in enumerate(images, start=1):
+        png = _encode(im)
+        name = f"{FULL}_{n:02d}" if q_idx == FULL else f"q{int(q_idx):03d}_{n:02d}"
+        key = f"{prefix}/{name}.png"
+        uploads.append((key, png))
+        w, h = _vision_size(*im.size)
+        keys.append(key)
+        sizes.append([w, h])
+        urls.append("data:image/png;base64," + base64.b64encode(png).decode("ascii"))
+        total += len(png)
+        tokens += estimate_image_tokens(w, h)
+    return {
+        "q_idx": q_idx,
+        "images": keys,
+        "sizes": sizes,
+        "urls": urls,
+        "bytes": total,
+        "est_tokens": tokens,
+    }
+
+
+def build_bundle(sha256: str, page_keys: List[str], spans: List[Dict[str, Any]]) -> str:
+    """Crop, encode and store the bundle for these spans; returns its version."""
+    from PIL import Image
+
+    version = assets_version(spans)
+    prefix = assets_prefix(sha256, version)
+    store = get_store()
+    manifest_key = f"{prefix}/manifest.json"
+    if store.exists(manifest_key):
+        return version
+
+    local = fetch(page_keys)
+    uploads: List[tuple[str, bytes]] = []
+    entries: Dict[str, Dict[str, Any]] = {}
+    entries[FULL] = _entry(FULL, [Image.open(p) for p in local], prefix, uploads)
+    for item in spans:
+        q_idx = int(item.get("q_idx", 0))
+        crops = []
+        for seg in item.get("segments", []):
+            page = int(seg.get("page", 0) or 0)
+            if 1 <= page <= len(local):
+                crops.append(_crop(local[page - 1],
+                                   float(seg.get("y_top", 0.0)),
+                                   float(seg.get("y_bottom", 1.0))))
+        if q_idx > 0 and crops:
+            entries[str(q_idx)] = _entry(q_idx, crops, prefix, uploads)
+
+    for key, data in uploads:
+        store.put_bytes(key, data)
+    for q, entry in entries.items():
+        store.put_bytes(_entry_key(prefix, q), json.dumps(entry).encode())
+    # Manifest last: its presence means the bundle is complete.
+    store.put_bytes(manifest_key, json.dumps({
+        "version": version,
+        "solution_sha256": sha256,
+        "questions": {
+            q: {k: e[k] for k in ("images", "bytes", "est_tokens")}
+            for q, e in entries.items()
+        },
+    }).encode())
+    return version
+
+
+# ── Load ──────────────────────────────────────────────────────────────────────
+
+_CACHE_SIZE = 64
+_cache: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _load_entry(key: str) -> Optional[Dict[str, Any]]:
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    raw = get_store().get_bytes(key)
+    entry = json.loads(raw) if raw else None
+    if entry is not None:
+        with _cache_lock:
+            _cache[key] = entry
+            while len(_cache) > _CACHE_SIZE:
+                _cache.popitem(last=False)
+    return entry
+
+
+def current_bundle(db: Session, exam_id: int) -> Optional[tuple[str, str]]:
+    """(solution sha256, assets version) for the exam, building a missing bundle once."""
+    from . import documents
+
+    row = (
+        db.query(models.SolutionDoc.id, models.SolutionDoc.blob_sha256, models.SolutionDoc.assets_version)
+        .filter(models.SolutionDoc.exam_id == exam_id)
+        .first()
+    )
+    if not row or not row.blob_sha256:
+        return None
+    if row.assets_version:
+        return row.blob_sha256, row.assets_version
+    # Solutions uploaded before bundles existed.
+    version = build_bundle(
+        row.blob_sha256,
+        documents.solution_images(db, exam_id),
+        documents.solution_spans(db, exam_id),
+    )
+    db.query(models.SolutionDoc).filter(models.SolutionDoc.id == row.id).update(
+        {"assets_version": version}, synchronize_session=False
+    )
+    db.commit()
+    return row.blob_sha256, version
+
+
+def question_assets(sha256: str, version: str, q_idx: int) -> Optional[Dict[str, Any]]:
+    """The bundle entry for *q_idx*, or the all-pages entry if it has no spans."""
+    prefix = assets_prefix(sha256, version)
+    return _load_entry(_entry_key(prefix, q_idx)) or _load_entry(_entry_key(prefix, FULL))
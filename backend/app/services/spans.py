@@ -0,0 +1,251 @@
+"""
+Local question span detection.
+
+Finds question headers ("Q1", "Question 2", "Problem 3)"...) at the start
+of a line and turns them into the detect_question_spans schema:
+
+    [{"q_idx": 1, "segments": [{"page": 1, "y_top": 0.12, "y_bottom": 0.35}, ...]}, ...]
+
+Header lines come from the PDF text layer (pypdf, with positions) on pages
+that have one, else from tesseract word boxes (``image_to_data``) on the
+page image. A question runs from its header to the next question's header.
+
+The local result is used only when it looks right: question numbers run
+1..N in document order, N matches the exam's question count when that is
+known, and OCR'd headers were read with at least ``SPANS_MIN_CONF``
+confidence. Otherwise the vision model is asked, as before.
+"""
+from __future__ import annotations
+import logging
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .. import metrics
+from ..config import settings
+from .blobstore import get_store
+from .executors import run_blocking
+from .grading_vision import detect_question_spans, detect_question_spans_async
+from .scheduler import gated
+from .storage import blob_key, page_number
+
+logger = logging.getLogger(__name__)
+
+HEADER = re.compile(r"^\s*(?:Q(?:uestion)?|Problem|Exercise)\s*\.?\s*#?\s*(\d{1,2})(?!\d)", re.IGNORECASE)
+PAD = 0.01             # bands start just above their header line
+OCR_MAX_WIDTH = 1000   # headers stay legible; tesseract is several times faster than at 200 dpi
+
+Line = Tuple[float, str, float]  # (relative y of the line top, text, confidence 0..100)
+
+
+# ── Line sources ──────────────────────────────────────────────────────────────
+
+def _join(runs: List[Tuple[float, float, str]], conf: float) -> List[Line]:
+    """Text runs (y, x, text) → lines, top to bottom."""
+    lines: List[Line] = []
+    current: List[Tuple[float, float, str]] = []
+    for run in sorted(runs) + [None]:
+        if current and (run is None or run[0] - current[0][0] > 0.005):
+            current.sort(key=lambda r: r[1])
+            lines.append((current[0][0], " ".join(r[2] for r in current), conf))
+            current = []
+        if run is not None:
+            current.append(run)
+    return lines
+
+
+def pdf_lines(pdf_path: str) -> List[List[Line]]:
+    """Text-layer lines of every PDF page (empty for pages without one)."""
+    from pypdf import PdfReader  # deferred: only needed for span detection
+    pages: List[List[Line]] = []
+    for page in PdfReader(pdf_path).pages:
+        top, height = float(page.mediabox.top), float(page.mediabox.height) or 1.0
+        runs: List[Tuple[float, float, str]] = []
+
+        def visit(text, cm, tm, font_dict, font_size):
+            if not text.strip():
+                return
+            x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+            y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]  # baseline, PDF units from the bottom
+            y_top = (top - y - (font_size or 0)) / height
+            runs.append((round(min(1.0, max(0.0, y_top)), 4), x, text.strip()))
+
+        try:
+            page.extract_text(visitor_text=visit)
+        except Exception:  # malformed content stream: OCR the image instead
+            runs = []
+        pages.append(_join(runs, 100.0))
+    return pages
+
+
+@gated("cpu")
+def ocr_lines(img_path: str) -> List[Line]:
+    """Tesseract lines of a page image. Empty if pytesseract is unavailable."""
+    try:
+        import pytesseract
+        from PIL import Image
+    except ImportError:
+        return []
+    started = time.perf_counter()
+    try:
+        with Image.open(img_path) as im:
+            if im.width > OCR_MAX_WIDTH:
+                im = im.resize((OCR_MAX_WIDTH, max(1, round(im.height * OCR_MAX_WIDTH / im.width))))
+            height = im.height or 1
+            data = pytesseract.image_to_data(im, config="--psm 3", output_type=pytesseract.Output.DICT)
+    except Exception:
+        return []
+    finally:
+        metrics.SPAN_OCR_SECONDS.observe(time.perf_counter() - started)
+
+    words: Dict[Tuple[int, int, int], List[Tuple[int, int, str, float]]] = {}
+    for i, word in enumerate(data["text"]):
+        conf = float(data["conf"][i])
+        if not word.strip() or conf < 0:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        words.setdefault(key, []).append((data["left"][i], data["top"][i], word.strip(), conf))
+    lines: List[Line] = []
+    for ws in words.values():
+        ws.sort()
+        # A header's confidence is that of its first words ("Question", "2")
+        lines.append((min(w[1] for w in ws) / height, " ".join(w[2] for w in ws),
+                      min(w[3] for w in ws[:2])))
+    return sorted(lines)
+
+
+def _layer(keys: List[str], sha256: Optional[str]) -> List[List[Line]]:
+    """Text-layer lines for each page key (pinned pages map back to their PDF page)."""
+    if not sha256:
+        return [[] for _ in keys]
+    try:
+        by_pdf_page = pdf_lines(get_store().local_path(blob_key(sha256)))
+    except Exception as exc:
+        logger.warning(f"[spans] could not read the text layer of {sha256[:12]}: {exc}")
+        by_pdf_page = []
+    out = []
+    for key in keys:
+        n = page_number(key)
+        out.append(by_pdf_page[n - 1] if n and n <= len(by_pdf_page) else [])
+    return out
+
+
+# ── Headers → spans ───────────────────────────────────────────────────────────
+
+def _headers(pages: List[List[Line]]) -> List[Tuple[int, int, float, float]]:
+    """(q_idx, page, y, confidence) of each header, in document order."""
+    found: List[Tuple[int, int, float, float]] = []
+    for page_no, lines in enumerate(pages, start=1):
+        for y, text, conf in lines:
+            match = HEADER.match(text)
+            if not match:
+                continue
+            q = int(match.group(1))
+            if found and q <= found[-1][0]:
+                continue  # "Q1 (continued)" and references back to earlier questions
+            found.append((q, page_no, y, conf))
+    return found
+
+
+def _bands(headers: List[Tuple[int, int, float, float]], pages: List[List[Line]]) -> List[Dict[str, Any]]:
+    n_pages = len(pages)
+    items = []
+    for i, (q, page, y, _) in enumerate(headers):
+        start = max(0.0, y - PAD)
+        if i + 1 < len(headers):
+            end_page, end_y = headers[i + 1][1], max(0.0, headers[i + 1][2] - PAD)
+        else:
+            end_page, end_y = n_pages, 1.0
+        segments = []
+        for p in range(page, end_page + 1):
+            y_top = start if p == page else 0.0
+            y_bottom = end_y if p == end_page else 1.0
+            # The next header's page counts only if something is written above that header
+            if p == page or p < end_page or any(line_y < y_bottom for line_y, _, _ in pages[p - 1]):
+                segments.append({"page": p, "y_top": round(y_top, 3),
+                                 "y_bottom": round(max(y_bottom, y_top), 3)})
+        items.append({"q_idx": q, "segments": segments})
+    return items
+
+
+def _unsure(headers: List[Tuple[int, int, float, float]], expected: Optional[int]) -> Optional[str]:
+    """Why the local result can't be trusted, or None if it can."""
+    qs = [h[0] for h in headers]
+    if not qs:
+        return "no headers found"
+    if qs != list(range(1, len(qs) + 1)):
+        return f"headers out of sequence {qs}"
+    if expected and len(qs) != expected:
+        return f"{len(qs)} headers, exam has {expected} questions"
+    low = [q for q, _, _, conf in headers if conf < settings.SPANS_MIN_CONF]
+    if low:
+        return "low OCR confidence on " + ", ".join(f"Q{q}" for q in low)
+    return None
+
+
+def local_spans(
+    keys: List[str], img_paths: List[str], sha256: Optional[str], expected: Optional[int] = None
+) -> Tuple[Optional[List[Dict[str, Any]]], str]:
+    """(spans, source) from the text layer / OCR, or (None, reason) when unsure."""
+    pages = _layer(keys, sha256)
+    ocr_pages = 0
+    for i, path in enumerate(img_paths):
+        if not pages[i]:
+            pages[i] = ocr_lines(path)
+            ocr_pages += 1
+    headers = _headers(pages)
+    reason = _unsure(headers, expected)
+    if reason:
+        return None, reason
+    return _bands(headers, pages), "ocr" if ocr_pages else "text_layer"
+
+
+# ── Entry points ──────────────────────────────────────────────────────────────
+
+def _local(
+    keys: List[str], img_paths: List[str], sha256: Optional[str], expected: Optional[int], kind: str
+) -> Optional[List[Dict[str, Any]]]:
+    if not settings.SPANS_LOCAL:
+        return None
+    spans, source = local_spans(keys, img_paths, sha256, expected)
+    if spans is None:
+        logger.info(f"[spans] {kind}: local detection unsure ({source})")
+        return None
+    metrics.SPAN_DETECTIONS.inc(kind=kind, source=source)
+    return spans
+
+
+def detect_spans(
+    keys: List[str],
+    img_paths: List[str],
+    sha256: Optional[str] = None,
+    expected: Optional[int] = None,
+    kind: str = "solution",
+    fallback: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Question spans of a rendered PDF (page *keys*, their local *img_paths*,
+    and the PDF's blob hash for its text layer). Found locally when possible;
+    otherwise from the vision model, or [] when *fallback* is off.
+    """
+    spans = _local(keys, img_paths, sha256, expected, kind)
+    if spans is not None or not fallback:
+        return spans or []
+    metrics.SPAN_DETECTIONS.inc(kind=kind, source="vision")
+    return detect_question_spans(img_paths)
+
+
+async def detect_spans_async(
+    keys: List[str],
+    img_paths: List[str],
+    sha256: Optional[str] = None,
+    expected: Optional[int] = None,
+    kind: str = "solution",
+    fallback: bool = True,
+) -> List[Dict[str, Any]]:
+    """detect_spans with local detection on the blocking pool and the fallback on AsyncOpenAI."""
+    spans = await run_blocking(_local, keys, img_paths, sha256, expected, kind)
+    if spans is not None or not fallback:
+        return spans or []
+    metrics.SPAN_DETECTIONS.inc(kind=kind, source="vision")
+    return await detect_question_spans_async(img_paths)
@@ -0,0 +1,315 @@
+"""
+Content-addressed upload storage.
+
+Uploads are streamed to local scratch space in fixed-size chunks while being
+hashed, and the size limit is enforced as bytes arrive. The finished file is
+stored under the key ``blobs/<sha[:2]>/<sha>.pdf`` in the configured blob
+store (see blobstore.py). A ``Blob`` row tracks how many documents reference
+it. Identical uploads share one object and one set of rendered pages, so
+re-uploading the same PDF does not store or render it again. Downstream
+caches can key on the hash.
+
+Unreferenced blobs are swept only after the transaction that released them
+commits: a rolled-back release keeps its bytes. Uploads claim the row in a
+short transaction of their own before touching the store, and the sweep
+re-checks the refcount and the claim time under the row lock.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import BinaryIO, List, Optional
+
+from sqlalchemy import delete, event, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import metrics, models
+from ..config import settings
+from ..database import SessionLocal
+from .blobstore import get_store
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit_bytes: int):
+        super().__init__(f"Upload exceeds {limit_bytes // (1024 * 1024)} MB limit")
+        self.limit_bytes = limit_bytes
+
+
+# ── Keys ──────────────────────────────────────────────────────────────────────
+
+def blob_key(sha256: str) -> str:
+    return f"blobs/{sha256[:2]}/{sha256}.pdf"
+
+
+def pages_prefix(sha256: str) -> str:
+    return f"pages/{sha256[:2]}/{sha256}"
+
+
+def derivative_key(page_key: str, variant: str) -> str:
+    """pages/…/page_001.png → pages/…/page_001.<variant>.webp"""
+    return str(Path(page_key).with_suffix(f".{variant}.webp"))
+
+
+def page_number(page_key: str) -> Optional[int]:
+    """pages/…/page_007.png → 7 (the page of the source PDF), None for other keys."""
+    match = re.search(r"page_(\d+)\.png$", page_key)
+    return int(match.group(1)) if match else None
+
+
+def scratch_dir() -> Path:
+    """Node-local temp space for uploads in flight and renders."""
+    path = Path(settings.UPLOAD_DIR) / "tmp"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def fetch(keys: List[str]) -> List[str]:
+    """Local file paths for stored keys (parallel, through the read cache)."""
+    return get_store().local_paths(keys)
+
+
+# ── Write ─────────────────────────────────────────────────────────────────────
+
+def _stream_to_disk(src: BinaryIO, limit: int) -> tuple[str, int, str]:
+    """Copy *src* to a temp file in chunks → (sha256, size, temp path)."""
+    fd, tmp = tempfile.mkstemp(dir=scratch_dir(), suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    raise UploadTooLarge(limit)
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return digest.hexdigest(), size, tmp
+
+
+def save_upload(upload, db: Session, limit_mb: Optional[float] = None) -> models.Blob:
+    """
+    Store an UploadFile (or anything with ``.file``) and return its Blob row.
+    The row starts unreferenced; call retain() when a document points at it.
+    """
+    limit = int((limit_mb or settings.MAX_UPLOAD_MB) * 1024 * 1024)
+    declared: Optional[int] = getattr(upload, "size", None)
+    if declared is not None and declared > limit:
+        raise UploadTooLarge(limit)
+    return save_stream(upload.file, db, limit_mb)
+
+
+def save_stream(src: BinaryIO, db: Session, limit_mb: Optional[float] = None) -> models.Blob:
+    """Like save_upload() for a plain binary stream (e.g. a ZIP member)."""
+    limit = int((limit_mb or settings.MAX_UPLOAD_MB) * 1024 * 1024)
+    sha, size, tmp = _stream_to_disk(src, limit)
+    key = blob_key(sha)
+    try:
+        _claim(sha, size, key)
+        store = get_store()
+        if not store.exists(key):  # dedupe: bytes already stored
+            store.put_file(key, tmp, move=True)
+    finally:
+        Path(tmp).unlink(missing_ok=True)
+    return db.get(models.Blob, sha, populate_existing=True)
+
+
+def _claim(sha: str, size: int, key: str) -> None:
+    """
+    Create or touch the Blob row for *sha* in a short transaction of its own,
+    before the store is checked, so no write lock is held across uploads or
+    whatever the caller does next. A sweep already holding the row finishes
+    first (the row is gone and the bytes are put again); one that starts later
+    skips the blob for ``BLOB_CLAIM_GRACE_MINUTES``, until the caller retains it.
+    """
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        claimed = db.execute(
+            update(models.Blob)
+            .where(models.Blob.sha256 == sha)
+            .values(claimed_at=now)
+        ).rowcount
+        if not claimed:
+            try:
+                with db.begin_nested():
+                    db.add(models.Blob(sha256=sha, size=size, path=key, refcount=0, claimed_at=now))
+            except IntegrityError:
+                # A concurrent request stored the same bytes first.
+                db.execute(update(models.Blob).where(models.Blob.sha256 == sha).values(claimed_at=now))
+        db.commit()
+
+
+# ── Reference counting ────────────────────────────────────────────────────────
+
+def retain(db: Session, sha256: str) -> None:
+    db.execute(
+        update(models.Blob)
+        .where(models.Blob.sha256 == sha256)
+        .values(refcount=models.Blob.refcount + 1)
+    )
+
+
+def release(db: Session, sha256: Optional[str]) -> None:
+    """Drop one reference; the object and its rendered pages go with the last one."""
+    if not sha256:
+        return
+    db.execute(
+        update(models.Blob)
+        .where(models.Blob.sha256 == sha256)
+        .values(refcount=models.Blob.refcount - 1)
+    )
+    db.get(models.Blob, sha256, populate_existing=True)
+    _queue_sweep(db, sha256, grace=True)
+
+
+def prune(db: Session, sha256: Optional[str]) -> None:
+    """Delete an upload this caller stored but nothing ended up referencing, once *db* commits."""
+    _queue_sweep(db, sha256, grace=False)
+
+
+def _queue_sweep(db: Session, sha256: Optional[str], grace: bool) -> None:
+    blob = db.get(models.Blob, sha256) if sha256 else None
+    if not blob or blob.refcount > 0:
+        return
+    if "blob_sweeps" not in db.info:
+        db.info["blob_sweeps"] = {}
+        event.listen(db, "after_commit", _after_commit)
+        event.listen(db, "after_rollback", _after_rollback)
+    sweeps = db.info["blob_sweeps"]
+    sweeps[sha256] = sweeps.get(sha256, True) and grace
+
+
+def _after_commit(db: Session) -> None:
+    if db.get_nested_transaction() is not None:
+        return  # a savepoint; wait for the outer commit
+    sweeps, db.info["blob_sweeps"] = db.info["blob_sweeps"], {}
+    for sha, grace in sweeps.items():
+        sweep(sha, grace)
+
+
+def _after_rollback(db: Session) -> None:
+    if db.get_nested_transaction() is None:
+        db.info["blob_sweeps"].clear()
+
+
+def sweep(sha256: str, grace: bool = True) -> bool:
+    """
+    Delete an unreferenced blob's row, object and rendered pages. The refcount
+    is re-checked under the row lock, and the store objects go before that
+    lock is released, so an upload of the same bytes waiting on the row
+    stores them again. With *grace*, a blob uploaded within
+    ``BLOB_CLAIM_GRACE_MINUTES`` is kept for the upload that is about to
+    reference it. Returns True if the blob was deleted.
+    """
+    with SessionLocal() as db:
+        try:
+            q = select(models.Blob.sha256).where(
+                models.Blob.sha256 == sha256, models.Blob.refcount <= 0
+            )
+            if grace:
+                cutoff = datetime.utcnow() - timedelta(minutes=settings.BLOB_CLAIM_GRACE_MINUTES)
+                q = q.where(or_(models.Blob.claimed_at.is_(None), models.Blob.claimed_at < cutoff))
+            locked = db.execute(q.with_for_update(skip_locked=True)).first()
+            if not locked:
+                return False  # referenced again, just uploaded, or an upload holds it
+            db.execute(delete(models.Blob).where(models.Blob.sha256 == sha256))
+            store = get_store()
+            store.delete(f"{pages_prefix(sha256)}/manifest.json")  # first: no reader trusts a partial set
+            store.delete(blob_key(sha256))
+            store.delete_prefix(pages_prefix(sha256))
+            db.commit()
+            return True
+        except Exception:
+            db.rollback()
+            logger.exception(f"[storage] sweep of blob {sha256[:12]} failed")
+            return False
+
+
+# ── Rendering cache ───────────────────────────────────────────────────────────
+
+def render_pages(sha256: str) -> List[str]:
+    """Page image keys for a stored PDF, rendered once per hash and reused after."""
+    keys, seconds = render_pages_timed(sha256)
+    if seconds is not None:
+        metrics.RENDER_SECONDS.observe(seconds)
+    return keys
+
+
+def render_pages_timed(sha256: str) -> tuple[List[str], Optional[float]]:
+    """
+    render_pages() → (keys, render seconds or None on a cache hit), without
+    recording the metric: in a worker process it would land in that
+    process's registry, so the caller observes it.
+    """
+    from ..utils.images import DERIVATIVES, make_derivative, pdf_to_pngs
+
+    store = get_store()
+    manifest = f"{pages_prefix(sha256)}/manifest.json"
+    raw = store.get_bytes(manifest)
+    if raw:
+        return json.loads(raw), None
+
+    # Concurrent renders of the same PDF write identical objects; the manifest
+    # goes last so readers never see a partial page set.
+    scratch = tempfile.mkdtemp(dir=scratch_dir(), prefix=f"{sha256[:12]}.")
+    started = time.perf_counter()
+    try:
+        pages = pdf_to_pngs(store.local_path(blob_key(sha256)), scratch)
+        keys = [f"{pages_prefix(sha256)}/{Path(p).name}" for p in pages]
+        uploads = list(zip(keys, pages))
+        for key, page in zip(keys, pages):
+            for variant in DERIVATIVES:
+                uploads.append((derivative_key(key, variant), make_derivative(page, variant)))
+        store.put_many(uploads, move=True)
+        store.put_bytes(manifest, json.dumps(keys).encode())
+        return keys, time.perf_counter() - started
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def text_layer(sha256: str) -> List[Optional[str]]:
+    """Per-page text of a stored PDF's typed pages (None = scanned), cached like renders."""
+    from ..utils.pdftext import page_texts
+
+    store = get_store()
+    key = f"{pages_prefix(sha256)}/text.json"
+    raw = store.get_bytes(key)
+    if raw:
+        return json.loads(raw)
+    texts = page_texts(store.local_path(blob_key(sha256)), settings.TEXT_LAYER_MIN_CHARS)
+    store.put_bytes(key, json.dumps(texts).encode())
+    return texts
+
+
+def derivative(page_key: str, variant: str) -> str:
+    """Local path of a page derivative, generating it once if an older render lacks it."""
+    from ..utils.images import make_derivative
+
+    store = get_store()
+    key = derivative_key(page_key, variant)
+    if not store.exists(key):
+        src = store.local_path(page_key)
+        scratch = tempfile.mkdtemp(dir=scratch_dir())
+        try:
+            tmp = shutil.copy(src, scratch)
+            store.put_file(key, make_derivative(tmp, variant), move=True)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return store.local_path(key)
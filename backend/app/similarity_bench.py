@@ -0,0 +1,310 @@
+"""
+Similarity-check benchmark across class sizes.
+
+    python -m app.similarity_bench                                # 50, 500, 2000 — Jaccard only
+    python -m app.similarity_bench --sizes 50,500,2000,10000 --modes jaccard,semantic --out sim.json
+    python -m app.similarity_bench --baseline sim.json            # exit 1 on regression
+
+Each size gets its own exam in a throwaway SQLite database, filled with
+synthetic page OCR: every answer shares ``--overlap`` of its words with the
+question's reference vocabulary, and ``--copy-rate`` of students hand in a
+lightly edited copy of someone else's text (the pairs a check should flag).
+``run_similarity_check`` is then timed for ``--checks`` submissions per size,
+counting SQL statements, encoder calls and peak Python memory.
+
+Modes:
+  jaccard   no sentence model (what runs when sentence-transformers is missing)
+  semantic  all-MiniLM-L6-v2 via sentence-transformers; skipped if not installed
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+MODES = ("jaccard", "semantic")
+
+# metric → compared against the baseline when --baseline is given
+TRACKED = ("seconds_p50", "queries_per_check", "encode_calls_per_check")
+
+
+# ── Synthetic texts ───────────────────────────────────────────────────────────
+
+def _vocabulary(rng: random.Random, size: int) -> List[str]:
+    syllables = ["ka", "lo", "mi", "ter", "san", "qu", "ex", "vo", "ri", "den", "ph", "al"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def synthetic_texts(n: int, questions: int, words: int, overlap: float, copy_rate: float,
+                    seed: int) -> Tuple[List[List[str]], List[Tuple[int, int]]]:
+    """
+    Per-student page texts (one page per question) and the planted (original,
+    copy) index pairs. Copies swap 5% of the original's words.
+    """
+    rng = random.Random(seed)
+    vocab = _vocabulary(rng, 5000)
+    reference = [rng.sample(vocab, words) for _ in range(questions)]
+    texts: List[List[str]] = []
+    for _ in range(n):
+        pages = []
+        for q in range(questions):
+            shared = int(words * overlap)
+            chosen = rng.sample(reference[q], shared) + rng.choices(vocab, k=words - shared)
+            rng.shuffle(chosen)
+            pages.append(f"Question {q + 1} " + " ".join(chosen))
+        texts.append(pages)
+
+    planted: List[Tuple[int, int]] = []
+    copies = rng.sample(range(1, n), min(n - 1, int(n * copy_rate))) if n > 1 else []
+    for copy in copies:
+        original = rng.randrange(0, copy)
+        pages = []
+        for page in texts[original]:
+            tokens = page.split()
+            for i in rng.sample(range(len(tokens)), len(tokens) // 20):
+                tokens[i] = rng.choice(vocab)
+            pages.append(" ".join(tokens))
+        texts[copy] = pages
+        planted.append((original, copy))
+    return texts, planted
+
+
+def seed_exam(db, texts: List[List[str]], size: int) -> Tuple[int, List[int]]:
+    """One exam with a GRADED submission (doc + OCR'd pages) per text; returns (exam, sub ids)."""
+    from sqlalchemy import insert, select
+
+    from . import models
+
+    prof_id = "bench-prof"
+    if not db.get(models.User, prof_id):
+        db.add(models.User(id=prof_id, email="prof@bench.test", role="PROF"))
+    exam = models.Exam(title=f"Similarity bench ({size})",
+                       due_at=datetime.utcnow() + timedelta(days=7), created_by=prof_id)
+    db.add(exam)
+    db.flush()
+    db.add_all(models.Question(exam_id=exam.id, idx=q, prompt=f"Q{q}", max_points=10.0,
+                               answer_key={}) for q in range(1, len(texts[0]) + 1))
+    students = [f"bench-{exam.id}-{n}" for n in range(len(texts))]
+    db.execute(insert(models.User), [
+        {"id": s, "email": f"{s}@bench.test", "role": "STUDENT"} for s in students
+    ])
+    db.execute(insert(models.Submission), [
+        {"exam_id": exam.id, "student_id": s, "status": "GRADED"} for s in students
+    ])
+    sub_ids = db.execute(
+        select(models.Submission.id).where(models.Submission.exam_id == exam.id)
+        .order_by(models.Submission.id)
+    ).scalars().all()
+    db.execute(insert(models.SubmissionDoc), [
+        {"submission_id": sid, "file_path": f"{sid}.pdf", "extracted_text": ""} for sid in sub_ids
+    ])
+    doc_ids = dict(db.execute(
+        select(models.SubmissionDoc.submission_id, models.SubmissionDoc.id)
+        .where(models.SubmissionDoc.submission_id.in_(sub_ids))
+    ).all())
+    db.execute(insert(models.DocPage), [
+        {"submission_doc_id": doc_ids[sid], "page_no": p, "image_path": f"{sid}/{p}.png",
+         "ocr_text": page}
+        for sid, pages in zip(sub_ids, texts) for p, page in enumerate(pages, start=1)
+    ])
+    db.commit()
+    return exam.id, list(sub_ids)
+
+
+# ── Modes ─────────────────────────────────────────────────────────────────────
+
+class _CountingModel:
+    """Wraps the sentence model to count encode() calls and encoded texts."""
+
+    def __init__(self, model):
+        self.model, self.calls, self.texts = model, 0, 0
+
+    def encode(self, texts, **kwargs):
+        self.calls += 1
+        self.texts += len(texts)
+        return self.model.encode(texts, **kwargs)
+
+
+def use_mode(mode: str) -> Optional[_CountingModel]:
+    """Point the similarity service at *mode*; returns the encode counter (None for jaccard)."""
+    from .services import similarity
+
+    if mode == "jaccard":
+        similarity._get_sem_model = lambda: None
+        return None
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        raise RuntimeError("sentence-transformers not installed")
+    counter = _CountingModel(SentenceTransformer("all-MiniLM-L6-v2"))
+    similarity._get_sem_model = lambda: counter
+    return counter
+
+
+# ── Measurement ───────────────────────────────────────────────────────────────
+
+def bench(mode: str, size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    from . import models, querystats
+    from .database import SessionLocal
+    from .services.similarity import run_similarity_check
+
+    counter = use_mode(mode)
+    texts, planted = synthetic_texts(size, args.questions, args.words, args.overlap,
+                                     args.copy_rate, seed=args.seed + size)
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        exam_id, sub_ids = seed_exam(db, texts, size)
+    seed_seconds = time.perf_counter() - started
+
+    rng = random.Random(args.seed)
+    copies = [c for _, c in planted]
+    chosen = rng.sample(copies, min(len(copies), (args.checks + 1) // 2))
+    others = [i for i in range(size) if i not in set(chosen)]
+    chosen += rng.sample(others, min(len(others), args.checks - len(chosen)))
+
+    seconds: List[float] = []
+    queries: List[int] = []
+    encodes: List[int] = []
+    flags = 0
+    for idx in chosen:
+        calls_before = counter.calls if counter else 0
+        with SessionLocal() as db, querystats.track() as stats:
+            t0 = time.perf_counter()
+            flags += run_similarity_check(exam_id, sub_ids[idx], db)
+            seconds.append(time.perf_counter() - t0)
+        queries.append(stats.count)
+        encodes.append((counter.calls if counter else 0) - calls_before)
+
+    tracemalloc.start()
+    with SessionLocal() as db:
+        run_similarity_check(exam_id, sub_ids[chosen[0]], db)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    with SessionLocal() as db:
+        flagged = set(db.query(models.SimilarityFlag.submission_a, models.SimilarityFlag.submission_b)
+                      .filter(models.SimilarityFlag.exam_id == exam_id).all())
+    checked = set(chosen)
+    planted_checked = [(a, b) for a, b in planted if a in checked or b in checked]
+    found = sum(1 for a, b in planted_checked
+                if (min(sub_ids[a], sub_ids[b]), max(sub_ids[a], sub_ids[b])) in flagged)
+
+    return {
+        "mode": mode,
+        "size": size,
+        "checks": len(seconds),
+        "seed_seconds": round(seed_seconds, 2),
+        "seconds_p50": round(statistics.median(seconds), 4),
+        "seconds_max": round(max(seconds), 4),
+        "us_per_comparison": round(statistics.median(seconds) / max(size - 1, 1) * 1e6, 1),
+        "queries_per_check": max(queries),
+        "encode_calls_per_check": max(encodes),
+        "peak_memory_mb": round(peak / 2**20, 2),
+        "flags_created": flags,
+        "planted_pairs_checked": len(planted_checked),
+        "planted_pairs_flagged": found,
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Metrics that grew more than *tolerance* (fraction) over the baseline run."""
+    before = {(r["mode"], r["size"]): r for r in baseline.get("results", []) if "skipped" not in r}
+    regressions = []
+    for r in results:
+        old = before.get((r["mode"], r["size"]))
+        if not old or "skipped" in r:
+            continue
+        for key in TRACKED:
+            if old.get(key) and r[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{r['mode']}/{r['size']}: {key} {old[key]} → {r[key]}")
+    return regressions
+
+
+def run(args: argparse.Namespace) -> int:
+    from . import migrations
+    from .database import engine
+
+    migrations.upgrade(engine)
+    results: List[Dict[str, Any]] = []
+    for mode in args.modes:
+        for size in args.sizes:
+            try:
+                r = bench(mode, size, args)
+            except RuntimeError as exc:
+                print(f"{mode:<9} {size:>6}  skipped: {exc}", file=sys.stderr)
+                results.append({"mode": mode, "size": size, "skipped": str(exc)})
+                break
+            print(f"{mode:<9} {size:>6}  p50 {r['seconds_p50'] * 1000:>9.1f} ms  "
+                  f"{r['us_per_comparison']:>7.1f} µs/pair  {r['queries_per_check']:>6} queries  "
+                  f"{r['encode_calls_per_check']:>6} encodes  {r['peak_memory_mb']:>7.1f} MB  "
+                  f"planted {r['planted_pairs_flagged']}/{r['planted_pairs_checked']}",
+                  file=sys.stderr)
+            results.append(r)
+
+    report = {
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "params": {k: getattr(args, k) for k in
+                   ("questions", "words", "overlap", "copy_rate", "checks", "seed")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.similarity_bench")
+    parser.add_argument("--sizes", type=lambda s: [int(n) for n in s.split(",")],
+                        default=[50, 500, 2000], help="submissions per exam, comma-separated")
+    parser.add_argument("--modes", type=lambda s: s.split(","), default=["jaccard"],
+                        help=f"comma-separated: {', '.join(MODES)}")
+    parser.add_argument("--checks", type=int, default=5, help="similarity checks timed per size")
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--words", type=int, default=120, help="words per answer")
+    parser.add_argument("--overlap", type=float, default=0.5,
+                        help="share of each answer drawn from the reference vocabulary")
+    parser.add_argument("--copy-rate", type=float, default=0.02, help="share of planted copies")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed growth over the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown mode(s): {', '.join(sorted(unknown))}")
+
+    if "app.database" in sys.modules:
+        raise SystemExit("run as `python -m app.similarity_bench` (needs its own database)")
+    scratch = tempfile.mkdtemp(prefix="similarity-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{scratch}/bench.db"
+    os.environ["UPLOAD_DIR"] = os.path.join(scratch, "uploads")
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
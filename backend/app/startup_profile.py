@@ -0,0 +1,97 @@
+"""
+Cold-start profile for the API process.
+
+    python -m app.startup_profile                 # import-time breakdown + wall time
+    python -m app.startup_profile --budget-ms 800 # exit 1 if cold start exceeds budget
+
+Each run spawns a fresh interpreter, so numbers include every import the
+web process pays for before it can serve its first request.
+"""
+from __future__ import annotations
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+_COLD_START_SNIPPET = """
+import asyncio, time
+t0 = time.perf_counter()
+from app.main import app
+t1 = time.perf_counter()
+async def boot():
+    async with app.router.lifespan_context(app):
+        pass
+asyncio.run(boot())
+t2 = time.perf_counter()
+print(f"{(t1 - t0) * 1000:.1f} {(t2 - t1) * 1000:.1f}")
+"""
+
+
+def _python(args: List[str]) -> subprocess.CompletedProcess:
+    proc = subprocess.run(
+        [sys.executable, *args], cwd=BACKEND_DIR, env=os.environ.copy(),
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"app failed to start:\n{proc.stderr[-2000:]}")
+    return proc
+
+
+def cold_start_ms() -> Tuple[float, float]:
+    """(import ms, lifespan ms) for one fresh interpreter."""
+    out = _python(["-c", _COLD_START_SNIPPET]).stdout.strip().splitlines()[-1]
+    imp, boot = out.split()
+    return float(imp), float(boot)
+
+
+def import_breakdown(top: int = 20) -> List[Tuple[int, int, str]]:
+    """Heaviest imports as (cumulative µs, self µs, module), from `-X importtime`."""
+    err = _python(["-X", "importtime", "-c", "import app.main"]).stderr
+    rows: List[Tuple[int, int, str]] = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        # Only direct children of the app (or the app modules themselves)
+        if depth <= 1 or name.strip().startswith("app."):
+            rows.append((int(cum_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main(argv: List[str] | None = None) -> int:
+    from .config import settings
+
+    parser = argparse.ArgumentParser(prog="python -m app.startup_profile")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help=f"fail above this (default COLD_START_BUDGET_MS={settings.COLD_START_BUDGET_MS:g})")
+    args = parser.parse_args(argv)
+
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cum_us, self_us, name in import_breakdown(args.top):
+        print(f"{cum_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+    samples = [cold_start_ms() for _ in range(max(1, args.runs))]
+    imp = statistics.median(s[0] for s in samples)
+    boot = statistics.median(s[1] for s in samples)
+    total = imp + boot
+    budget = args.budget_ms if args.budget_ms is not None else settings.COLD_START_BUDGET_MS
+    print(f"\ncold start (median of {len(samples)}): import {imp:.0f} ms + "
+          f"lifespan {boot:.0f} ms = {total:.0f} ms  (budget {budget:.0f} ms, "
+          f"FAST_START={'1' if settings.FAST_START else '0'})")
+    if total > budget:
+        print("over budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
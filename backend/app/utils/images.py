@@ -1,14 +1,14 @@
 # backend/app/utils/images.py
 from __future__ import annotations
-from pdf2image import convert_from_bytes
 from pathlib import Path
-from typing import List
-import io, os
+from typing import Any, Dict, List
+import hashlib, io, os
 
 def pdf_to_pngs(pdf_path: str, out_dir: str) -> List[str]:
     """
     Convert a PDF to per-page PNG images. Returns ordered list of image paths.
     """
+    from pdf2image import convert_from_bytes  # deferred: only needed when rendering
     out = Path(out_dir)
     out.mkdir(parents=True, exist_ok=True)
     with open(pdf_path, "rb") as f:
@@ -19,3 +19,27 @@ def pdf_to_pngs(pdf_path: str, out_dir: str) -> List[str]:
         img.save(p, format="PNG", optimize=True)
         paths.append(str(p))
     return paths
+
+def page_info(img_path: str) -> Dict[str, Any]:
+    """Width/height (header read only) and SHA-256 of a rendered page image."""
+    from PIL import Image
+    with open(img_path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    with Image.open(img_path) as im:
+        width, height = im.size
+    return {"image_sha256": digest, "width": width, "height": height}
+
+# Downscaled WebP derivatives generated once at render time (variant → max width)
+DERIVATIVES = {"thumb": 320, "preview": 1280}
+
+def make_derivative(png_path: str, variant: str) -> str:
+    """Write the WebP *variant* next to *png_path* and return its path."""
+    from PIL import Image
+    width = DERIVATIVES[variant]
+    out = str(Path(png_path).with_suffix(f".{variant}.webp"))
+    with Image.open(png_path) as im:
+        im = im.convert("RGB")
+        if im.width > width:
+            im = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+        im.save(out, format="WEBP", quality=80, method=4)
+    return out
@@ -0,0 +1,56 @@
+# backend/app/utils/pdftext.py
+from __future__ import annotations
+import re
+from typing import List, Optional
+
+_WORD = re.compile(r"[^\W\d_]{2,}")
+
+def _has_images(resources, depth: int = 0) -> bool:
+    """True if the page (or a form it draws) paints a raster image — a scan or photo."""
+    if resources is None or depth > 3:
+        return False
+    xobjects = resources.get_object().get("/XObject")
+    if xobjects is None:
+        return False
+    for ref in xobjects.get_object().values():
+        obj = ref.get_object()
+        subtype = obj.get("/Subtype")
+        if subtype == "/Image":
+            return True
+        if subtype == "/Form" and _has_images(obj.get("/Resources"), depth + 1):
+            return True
+    return False
+
+def _has_ink(page) -> bool:
+    """Pen annotations (tablet handwriting) are not part of the text layer."""
+    for ref in page.get("/Annots") or []:
+        if ref.get_object().get("/Subtype") in ("/Ink", "/Stamp"):
+            return True
+    return False
+
+def usable_text(text: str, min_chars: int) -> bool:
+    text = text.strip()
+    if len(text) < min_chars:
+        return False
+    printable = sum(ch.isprintable() or ch.isspace() for ch in text)
+    return printable / len(text) >= 0.95 and len(_WORD.findall(text)) >= 5
+
+def page_texts(pdf_path: str, min_chars: int = 50) -> List[Optional[str]]:
+    """
+    Text of every page that is fully typed (usable text layer, no raster images,
+    no ink annotations); None for scanned / handwritten pages, which still need
+    OCR and the page image.
+    """
+    from pypdf import PdfReader  # deferred: only needed for digital PDFs
+    out: List[Optional[str]] = []
+    for page in PdfReader(pdf_path).pages:
+        try:
+            if _has_images(page.get("/Resources")) or _has_ink(page):
+                out.append(None)
+                continue
+            text = page.extract_text() or ""
+        except Exception:  # malformed content streams: fall back to OCR
+            out.append(None)
+            continue
+        out.append(text.strip() if usable_text(text, min_chars) else None)
+    return out
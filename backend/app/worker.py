@@ -0,0 +1,232 @@
+"""
+Standalone grading worker.
+
+    python -m app.worker                      # run until SIGTERM/SIGINT
+    python -m app.worker --concurrency 8 --kinds stages,regrade
+    python -m app.worker --once               # drain the queue, then exit
+    python -m app.worker --dead               # list dead-lettered tasks
+    python -m app.worker --requeue-dead [ID ...]
+
+Workers claim tasks from the DB queue (services/queue.py), so any number of
+them can run on any host next to (or instead of) the API replicas. Run the
+API with GRADING_MODE=queue, and use a shared STORAGE_BACKEND (s3) when
+workers live on other machines.
+"""
+from __future__ import annotations
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from . import metrics
+from .config import settings
+from .database import SessionLocal, engine
+from .services import queue
+
+logger = logging.getLogger("app.worker")
+
+_HANDLERS: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+
+
+def handler(kind: str):
+    def register(fn):
+        _HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+# ── Task handlers ─────────────────────────────────────────────────────────────
+
+@handler("stages")
+def _stages(payload: Dict[str, Any]) -> None:
+    from .services import pipeline, scheduler
+    # Student uploads (queued or deferred past the deadline)
+    with SessionLocal() as db, scheduler.work_class(scheduler.INTERACTIVE, payload.get("exam_id")):
+        pipeline.run_stages(db, payload["submission_id"])  # StageFailed → retried
+
+
+@handler("regrade")
+def _regrade(payload: Dict[str, Any]) -> None:
+    from .services import jobs, regrade
+    regrade._regrade_one(payload["job_id"], payload["exam_id"], payload["submission_id"])
+    with SessionLocal() as db:
+        jobs.finish_if_complete(db, payload["job_id"])
+
+
+@handler("retry")
+def _retry(payload: Dict[str, Any]) -> None:
+    from .services import jobs, pipeline
+    pipeline.retry_item(payload["job_id"], payload["exam_id"], payload["submission_id"])
+    with SessionLocal() as db:
+        jobs.finish_if_complete(db, payload["job_id"])
+
+
+@handler("import")
+def _import(payload: Dict[str, Any]) -> None:
+    from .services import imports
+    imports.run_import(payload["job_id"])
+
+
+def _on_dead(task: Dict[str, Any], error: str) -> None:
+    """Dead-lettered job items count as failed so their job can finish."""
+    from .services import jobs
+    payload = task["payload"]
+    if task["kind"] in jobs.ITEM_KINDS and "job_id" in payload:
+        with SessionLocal() as db:
+            jobs.fail_item(db, payload["job_id"], payload["submission_id"], error)
+            jobs.finish_if_complete(db, payload["job_id"])
+
+
+# ── Worker loop ───────────────────────────────────────────────────────────────
+
+class Worker:
+    def __init__(self, concurrency: int, kinds: Optional[List[str]] = None,
+                 poll_seconds: float = 2.0):
+        self.concurrency = max(1, concurrency)
+        self.kinds = kinds or None
+        self.poll_seconds = poll_seconds
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = threading.Event()
+
+    def start(self, once: bool = False) -> List[threading.Thread]:
+        threads = [
+            threading.Thread(target=self._loop, args=(f"{self.name}:{n}", once),
+                             name=f"worker-{n}", daemon=True)
+            for n in range(self.concurrency)
+        ]
+        for t in threads:
+            t.start()
+        return threads
+
+    def run(self, once: bool = False) -> None:
+        for t in self.start(once):
+            while t.is_alive():
+                t.join(timeout=0.5)
+
+    def stop(self, *_: Any) -> None:
+        logger.info("Stopping after current tasks...")
+        self.stopping.set()
+
+    def _loop(self, worker_id: str, once: bool) -> None:
+        while not self.stopping.is_set():
+            try:
+                with SessionLocal() as db:
+                    task = queue.claim(db, worker_id, self.kinds)
+            except Exception:
+                logger.exception("[worker] claim failed")
+                task = None
+            if task is None:
+                if once:
+                    return
+                self.stopping.wait(self.poll_seconds)
+                continue
+            self._execute(task, worker_id)
+
+    def _heartbeat(self, task_id: int, worker_id: str, done: threading.Event) -> None:
+        interval = max(1.0, settings.QUEUE_LEASE_SECONDS / 3)
+        while not done.wait(interval):
+            try:
+                with SessionLocal() as db:
+                    if not queue.heartbeat(db, task_id, worker_id):
+                        logger.warning(f"[worker] lost lease on task {task_id}")
+                        return
+            except Exception:
+                logger.exception(f"[worker] heartbeat for task {task_id} failed")
+
+    def _execute(self, task: Dict[str, Any], worker_id: str) -> None:
+        done = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(task["id"], worker_id, done),
+                                daemon=True)
+        beat.start()
+        try:
+            fn = _HANDLERS.get(task["kind"])
+            if fn is None:
+                raise LookupError(f"no handler for task kind {task['kind']!r}")
+            fn(task["payload"])
+        except Exception as exc:
+            error = str(exc) or exc.__class__.__name__
+            logger.exception(f"[worker] task {task['id']} ({task['kind']}) failed")
+            self._settle(task, worker_id, error)
+        else:
+            self._settle(task, worker_id)
+        finally:
+            done.set()
+
+    def _settle(self, task: Dict[str, Any], worker_id: str, error: Optional[str] = None) -> None:
+        """Record the task's outcome. If that fails, its lease expires and it is claimed again."""
+        try:
+            with SessionLocal() as db:
+                if error is None:
+                    queue.complete(db, task["id"], worker_id)
+                    return
+                status = queue.fail(db, task["id"], worker_id, error)
+            if status == "DEAD":
+                _on_dead(task, error)
+        except Exception:
+            logger.exception(f"[worker] could not record the outcome of task {task['id']}")
+
+
+def _serve_metrics(port: int) -> None:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Metrics on :{port}/metrics")
+
+
+# ── CLI ───────────────────────────────────────────────────────────────────────
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.worker")
+    parser.add_argument("--concurrency", type=int, default=settings.WORKER_CONCURRENCY)
+    parser.add_argument("--kinds", default="", help="comma-separated task kinds (default: all)")
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    parser.add_argument("--dead", action="store_true", help="list dead-lettered tasks")
+    parser.add_argument("--requeue-dead", nargs="*", type=int, metavar="ID",
+                        help="requeue dead tasks (all if no IDs)")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="serve Prometheus metrics on this port")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.dead:
+        with SessionLocal() as db:
+            for t in queue.dead_tasks(db):
+                print(f"{t.id:>8}  {t.kind:<8} attempts={t.attempts}  "
+                      f"{t.finished_at:%Y-%m-%d %H:%M}  {t.last_error}")
+        return 0
+    if args.requeue_dead is not None:
+        with SessionLocal() as db:
+            print(f"Requeued {queue.requeue_dead(db, args.requeue_dead)} task(s)")
+        return 0
+
+    metrics.install_db_hooks(engine)
+    if args.metrics_port:
+        _serve_metrics(args.metrics_port)
+    worker = Worker(args.concurrency, [k for k in args.kinds.split(",") if k],
+                    settings.QUEUE_POLL_SECONDS)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    logger.info(f"Worker {worker.name} started ({worker.concurrency} slots)")
+    worker.run(once=args.once)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
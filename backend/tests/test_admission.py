@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_tmp = tempfile.mkdtemp(prefix="autograde-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("UPLOAD_DIR", f"{_tmp}/uploads")
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "test")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import migrations, models
+from app.auth.testing import sign_test_token, use_local_auth
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.main import app
+from app.services import admission
+
+
+@pytest.fixture(scope="module")
+def client():
+    migrations.upgrade(engine)
+    use_local_auth()
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def inline_mode(monkeypatch):
+    monkeypatch.setattr(settings, "GRADING_MODE", "inline")
+    monkeypatch.setattr(settings, "ADMISSION_DEFER_MINUTES", 15.0)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_INFLIGHT_PER_EXAM", 0)  # always saturated
+
+
+def _exam(due_in: timedelta) -> models.Exam:
+    with SessionLocal() as db:
+        prof = models.User(id="prof-1", email="prof@example.com", role="PROF")
+        db.add(prof)
+        db.flush()
+        exam = models.Exam(title="Midterm", created_by=prof.id, due_at=datetime.utcnow() + due_in)
+        db.add(exam)
+        db.flush()
+        db.add(models.SolutionDoc(exam_id=exam.id, file_path="solution.pdf", extracted_text=""))
+        db.commit()
+        db.refresh(exam)
+        db.expunge(exam)
+        return exam
+
+
+def test_inline_without_drainer_never_defers(inline_mode, monkeypatch):
+    monkeypatch.setattr(settings, "DEFER_DRAINER", False)
+    exam = models.Exam(due_at=datetime.utcnow() + timedelta(minutes=5))
+    assert admission.defer_until(exam) is None
+
+
+def test_inline_with_drainer_defers(inline_mode, monkeypatch):
+    monkeypatch.setattr(settings, "DEFER_DRAINER", True)
+    exam = models.Exam(due_at=datetime.utcnow() + timedelta(minutes=5))
+    assert admission.defer_until(exam) == exam.due_at
+
+
+def test_saturated_inline_without_drainer_rejects(client, inline_mode, monkeypatch):
+    monkeypatch.setattr(settings, "DEFER_DRAINER", False)
+    exam = _exam(timedelta(minutes=5))
+    token = sign_test_token("student-1", "student@example.com", "STUDENT")
+    r = client.post(
+        f"/student/exams/{exam.id}/submit_pdf",
+        files={"file": ("a.pdf", b"%PDF-1.4\n", "application/pdf")},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert r.status_code == 429
+    assert "Retry-After" in r.headers
+    with SessionLocal() as db:
+        assert db.query(models.QueueTask).filter(models.QueueTask.exam_id == exam.id).count() == 0
+        assert db.query(models.Submission).filter(models.Submission.exam_id == exam.id).count() == 0
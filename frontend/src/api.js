@@ -48,6 +48,41 @@ export async function uploadSolutionPdf(examId, file) {
   return data;
 }
 
+// Bulk import: a ZIP of per-student PDFs, or one scan with split "pages" | "cover"
+export async function importScans(examId, file, { split, pagesPerStudent } = {}) {
+  const fd = new FormData();
+  fd.append("file", file);
+  if (split) fd.append("split", split);
+  if (pagesPerStudent) fd.append("pages_per_student", pagesPerStudent);
+  const { data } = await http.post(`/prof/exams/${examId}/import`, fd);
+  return data;
+}
+
+export async function getJob(jobId) {
+  const { data } = await http.get(`/prof/jobs/${jobId}`);
+  return data;
+}
+
+export async function regradeExam(examId) {
+  const { data } = await http.post(`/prof/exams/${examId}/regrade`);
+  return data;
+}
+
+export async function retryFailedSubmissions(examId) {
+  const { data } = await http.post(`/prof/exams/${examId}/retry_failed`);
+  return data;
+}
+
+export async function retrySubmission(submissionId) {
+  const { data } = await http.post(`/prof/submissions/${submissionId}/retry`);
+  return data;
+}
+
+export async function resumeJob(jobId, force = false) {
+  const { data } = await http.post(`/prof/jobs/${jobId}/resume`, null, { params: { force } });
+  return data;
+}
+
 export async function getExamSubmissions(examId) {
   const { data } = await http.get(`/prof/exams/${examId}/submissions`);
   return data;
@@ -72,6 +107,18 @@ export function exportCsvUrl(examId) {
   return `${API_BASE}/prof/exams/${examId}/export_csv`;
 }
 
+export async function getSolutionPages(examId) {
+  const { data } = await http.get(`/prof/exams/${examId}/solution_pages`);
+  return data;
+}
+
+// Page images need the auth header, so fetch them as blobs for <img src>.
+// The browser revalidates with ETag and gets a 304 when nothing changed.
+export async function getPageImageUrl(pageUrl) {
+  const { data } = await http.get(pageUrl, { responseType: "blob" });
+  return URL.createObjectURL(data);
+}
+
 export async function getSubmissionDetail(submissionId) {
   const { data } = await http.get(`/prof/submissions/${submissionId}`);
   return data;
@@ -90,11 +137,50 @@ export async function submitPdf(examId, file) {
   return data;
 }
 
+// Same upload, graded with progress: onEvent gets each NDJSON event
+// (accepted / stage / question / grade / error / queued); resolves with the last one.
+export async function submitPdfStream(examId, file, onEvent) {
+  const fd = new FormData();
+  fd.append("file", file);
+  const { data: { session } } = await supabase.auth.getSession();
+  const res = await fetch(`${API_BASE}/student/exams/${examId}/submit_pdf/stream`, {
+    method: "POST",
+    body: fd,
+    headers: session?.access_token ? { Authorization: `Bearer ${session.access_token}` } : {},
+  });
+  if (!res.ok) {
+    const body = await res.json().catch(() => ({}));
+    throw { response: { status: res.status, data: body } };  // same shape as axios errors
+  }
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let last = null;
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    for (const line of lines) {
+      if (!line.trim()) continue;
+      last = JSON.parse(line);
+      onEvent?.(last);
+    }
+  }
+  return last;
+}
+
 export async function getMySubmissions() {
   const { data } = await http.get("/student/submissions");
   return data;
 }
 
+export async function getMySubmissionDetail(submissionId) {
+  const { data } = await http.get(`/student/submissions/${submissionId}`);
+  return data;
+}
+
 export async function joinExam(code) {
   const { data } = await http.post("/student/exams/join", { code });
   return data;
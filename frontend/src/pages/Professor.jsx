@@ -43,6 +43,235 @@ function Breakdown({ breakdown }) {
   );
 }
 
+// ── Page images ───────────────────────────────────────────────────────────────
+
+function PageImage({ url, alt, style }) {
+  const [src, setSrc] = useState(null);
+  const [failed, setFailed] = useState(false);
+
+  useEffect(() => {
+    let objectUrl = null;
+    let live = true;
+    setSrc(null); setFailed(false);
+    api.getPageImageUrl(url)
+      .then(u => { objectUrl = u; if (live) setSrc(u); else URL.revokeObjectURL(u); })
+      .catch(() => { if (live) setFailed(true); });
+    return () => { live = false; if (objectUrl) URL.revokeObjectURL(objectUrl); };
+  }, [url]);
+
+  if (failed) return <div className="text-danger text-sm">Image unavailable</div>;
+  if (!src) return <div className="text-muted text-sm">Loading…</div>;
+  return <img src={src} alt={alt} style={style} />;
+}
+
+function PageStrip({ pages }) {
+  const [open, setOpen] = useState(null);
+
+  return (
+    <div>
+      <div style={{ display: "flex", gap: 12, flexWrap: "wrap" }}>
+        {pages.map(p => (
+          <button
+            key={p.page_id}
+            className={`btn btn-ghost ${open?.page_id === p.page_id ? "active" : ""}`}
+            onClick={() => setOpen(open?.page_id === p.page_id ? null : p)}
+            style={{ flexDirection: "column", padding: 6 }}
+          >
+            <PageImage url={p.thumb_url} alt={`Page ${p.page_no}`} style={{ width: 120, display: "block" }} />
+            <span className="text-sm text-muted">Page {p.page_no}</span>
+          </button>
+        ))}
+      </div>
+      {open && (
+        <div style={{ marginTop: 16 }}>
+          <PageImage url={open.preview_url} alt={`Page ${open.page_no}`} style={{ maxWidth: "100%" }} />
+        </div>
+      )}
+    </div>
+  );
+}
+
+function SolutionPages({ examId, version }) {
+  const [pages, setPages] = useState(null);
+  const [err, setErr]     = useState("");
+
+  useEffect(() => {
+    setErr("");
+    api.getSolutionPages(examId)
+      .then(setPages)
+      .catch(e => { setPages([]); setErr(e?.response?.data?.detail || "Could not load solution pages"); });
+  }, [examId, version]);
+
+  if (err) return <div className="alert alert-error mb-16">{err}</div>;
+  if (pages === null) return <p className="text-muted text-sm">Loading…</p>;
+  if (!pages.length)
+    return (
+      <div className="empty">
+        <div className="empty-icon">📄</div>
+        <div className="empty-title">No solution pages</div>
+        <div className="empty-desc">Upload a solution PDF to see its pages here.</div>
+      </div>
+    );
+
+  return <PageStrip key={version} pages={pages} />;
+}
+
+// ── Background jobs ───────────────────────────────────────────────────────────
+
+const JOB_ACTIVE  = ["QUEUED", "RUNNING"];
+const JOB_POLL_MS = 2000;
+const JOB_LABELS  = { import: "Import", regrade: "Regrade", retry: "Retry" };
+const JOB_RESUMABLE = ["regrade", "retry"];  // jobs tracked per submission on the server
+
+function JobProgress({ jobId, onFinish, onDismiss }) {
+  const [job, setJob] = useState(null);
+  const [err, setErr] = useState("");
+  const [run, setRun] = useState(0);
+  const [resuming, setResuming] = useState(false);
+
+  useEffect(() => {
+    let live = true;
+    let timer = null;
+    const poll = async () => {
+      try {
+        const j = await api.getJob(jobId);
+        if (!live) return;
+        setJob(j); setErr("");
+        if (JOB_ACTIVE.includes(j.status)) timer = setTimeout(poll, JOB_POLL_MS);
+        else onFinish?.(j);
+      } catch (e) {
+        if (!live) return;
+        setErr(e?.response?.data?.detail || "Could not load job status");
+        timer = setTimeout(poll, JOB_POLL_MS * 5);
+      }
+    };
+    poll();
+    return () => { live = false; clearTimeout(timer); };
+  }, [jobId, run]);
+
+  const resume = async () => {
+    setErr(""); setResuming(true);
+    try {
+      await api.resumeJob(jobId);
+      setRun(n => n + 1);
+    } catch (e) {
+      setErr(e?.response?.data?.detail || "Could not resume job");
+    } finally { setResuming(false); }
+  };
+
+  if (!job) return err ? <div className="alert alert-error mb-16">{err}</div> : null;
+
+  const active = JOB_ACTIVE.includes(job.status);
+  const tone = job.status === "FAILED" ? "alert-error"
+    : active ? "alert-info"
+    : job.failed > 0 ? "alert-warn" : "alert-success";
+  const problems = (job.results || []).filter(r => r.error);
+  const canResume = !active && JOB_RESUMABLE.includes(job.kind)
+    && (job.status === "FAILED" || job.failed > 0);
+
+  return (
+    <div className={`alert ${tone} mb-16`}>
+      <div style={{ display: "flex", alignItems: "center", gap: 12, flexWrap: "wrap" }}>
+        <strong>{JOB_LABELS[job.kind] || job.kind} job #{job.id}</strong>
+        <span className="badge badge-muted">{job.status}</span>
+        <span className="text-sm">
+          {job.done} of {job.total} done{job.failed > 0 ? `, ${job.failed} failed` : ""}
+          {job.total > 0 && ` (${Math.round(job.progress * 100)}%)`}
+        </span>
+        {active && job.eta_seconds != null &&
+          <span className="text-sm">~{Math.max(1, Math.round(job.eta_seconds / 60))} min left</span>}
+        {canResume && (
+          <button className="btn btn-secondary text-sm" onClick={resume} disabled={resuming}
+            style={{ marginLeft: "auto" }}>
+            {resuming ? "Resuming…" : "Resume"}
+          </button>
+        )}
+        {!active && (
+          <button className="btn btn-ghost text-sm" onClick={onDismiss}
+            style={canResume ? {} : { marginLeft: "auto" }}>
+            Dismiss
+          </button>
+        )}
+      </div>
+      {err && <div className="text-sm">{err}</div>}
+      {job.error && <div className="text-sm">{job.error}</div>}
+      {problems.length > 0 && (
+        <ul className="text-sm" style={{ marginTop: 8 }}>
+          {problems.map((r, i) => <li key={i}>{r.file || `Item ${i + 1}`}: {r.error}</li>)}
+        </ul>
+      )}
+    </div>
+  );
+}
+
+// ── Scanned exam import ───────────────────────────────────────────────────────
+
+function ImportScans({ examId, hasSolution, onStarted }) {
+  const [file, setFile]             = useState(null);
+  const [split, setSplit]           = useState("pages");
+  const [perStudent, setPerStudent] = useState("");
+  const [err, setErr]               = useState("");
+  const [busy, setBusy]             = useState(false);
+
+  const isZip = !!file && file.name.toLowerCase().endsWith(".zip");
+
+  const start = async () => {
+    if (!file) return;
+    setErr(""); setBusy(true);
+    try {
+      const opts = isZip ? {} : { split, pagesPerStudent: split === "pages" ? perStudent : undefined };
+      const r = await api.importScans(examId, file, opts);
+      setFile(null); setPerStudent("");
+      onStarted(r.job_id);
+    } catch (e) {
+      setErr(e?.response?.data?.detail || "Import failed");
+    } finally { setBusy(false); }
+  };
+
+  if (!hasSolution)
+    return (
+      <div className="empty">
+        <div className="empty-icon">🗂</div>
+        <div className="empty-title">Upload a solution first</div>
+        <div className="empty-desc">Scanned exams are graded against the solution PDF.</div>
+      </div>
+    );
+
+  return (
+    <div className="card" style={{ maxWidth: 560 }}>
+      <p className="text-muted text-sm mb-16">
+        A ZIP of per-student PDFs named by email or name, or one scan of the whole class.
+      </p>
+      <div className="form-field">
+        <label className={`file-drop ${file ? "has-file" : ""}`} style={{ padding: "8px 16px" }}>
+          <input type="file" accept=".zip,application/zip,application/pdf"
+            onChange={e => { setFile(e.target.files?.[0] || null); setErr(""); }} />
+          {file ? `📄 ${file.name}` : "Choose ZIP or PDF"}
+        </label>
+      </div>
+      {file && !isZip && (
+        <div className="form-field">
+          <label className="form-label">Split the scan</label>
+          <select className="form-input" value={split} onChange={e => setSplit(e.target.value)}>
+            <option value="pages">Every N pages</option>
+            <option value="cover">At each cover page</option>
+          </select>
+          {split === "pages" && (
+            <input className="form-input" type="number" min={1} value={perStudent}
+              onChange={e => setPerStudent(e.target.value)} placeholder="Pages per student"
+              style={{ marginTop: 8 }} />
+          )}
+        </div>
+      )}
+      {err && <div className="alert alert-error mb-16">{err}</div>}
+      <button className="btn btn-primary" onClick={start}
+        disabled={!file || busy || (!isZip && split === "pages" && !(Number(perStudent) >= 1))}>
+        {busy ? "Uploading…" : "Import and grade"}
+      </button>
+    </div>
+  );
+}
+
 // ── Exam detail view ──────────────────────────────────────────────────────────
 
 function ExamDetail({ exam, onBack, onRefresh }) {
@@ -58,6 +287,12 @@ function ExamDetail({ exam, onBack, onRefresh }) {
   const [extendMsg, setExtendMsg]     = useState("");
   const [expandedSub, setExpandedSub] = useState(null);
   const [subDetail, setSubDetail]     = useState({});
+  const [solutionVersion, setSolutionVersion] = useState(0);
+  const [jobIds, setJobIds]           = useState([]);
+  const [regradeErr, setRegradeErr]   = useState("");
+  const [retryMsg, setRetryMsg]       = useState("");
+  const [retrying, setRetrying]       = useState(null);
+  const [rowErr, setRowErr]           = useState({});
 
   const load = useCallback(async () => {
     try {
@@ -81,6 +316,7 @@ function ExamDetail({ exam, onBack, onRefresh }) {
       const r = await api.uploadSolutionPdf(exam.id, pdf);
       setUploadMsg(`Done! ${r.questions_detected} question(s) detected, ${r.total_points} pts total.`);
       setPdf(null);
+      setSolutionVersion(v => v + 1);
       load(); onRefresh();
     } catch (e) {
       setUploadErr(e?.response?.data?.detail || "Upload failed");
@@ -107,6 +343,40 @@ function ExamDetail({ exam, onBack, onRefresh }) {
     }
   };
 
+  const trackJob = (jobId) => {
+    if (jobId) setJobIds(ids => ids.includes(jobId) ? ids : [...ids, jobId]);
+  };
+
+  const doRegrade = async () => {
+    if (!window.confirm("Regrade every graded submission against the current solution?")) return;
+    setRegradeErr("");
+    try {
+      const r = await api.regradeExam(exam.id);
+      trackJob(r.job_id);
+    } catch (e) { setRegradeErr(e?.response?.data?.detail || "Regrade failed"); }
+  };
+
+  const doRetryFailed = async () => {
+    setRetryMsg("");
+    try {
+      const r = await api.retryFailedSubmissions(exam.id);
+      if (r.job_id) trackJob(r.job_id);
+      else setRetryMsg("Nothing to retry");
+    } catch (e) { setRetryMsg(e?.response?.data?.detail || "Retry failed"); }
+  };
+
+  const doRetrySub = async (subId) => {
+    setRetrying(subId); setRowErr(prev => ({ ...prev, [subId]: "" }));
+    try {
+      await api.retrySubmission(subId);
+      setSubDetail(prev => ({ ...prev, [subId]: undefined }));
+      load(); onRefresh();
+    } catch (e) {
+      setRowErr(prev => ({ ...prev, [subId]: e?.response?.data?.detail || "Retry failed" }));
+    } finally { setRetrying(null); }
+  };
+
+  const hasUnfinished = submissions.some(s => s.failed_stage || s.status !== "GRADED");
   const isPast = new Date(exam.due_at) < new Date();
 
   return (
@@ -201,8 +471,38 @@ function ExamDetail({ exam, onBack, onRefresh }) {
         <a className="btn btn-secondary" href={api.exportCsvUrl(exam.id)} download>
           ⬇ Export CSV
         </a>
+
+        {exam.has_solution && (
+          <>
+            <div className="action-sep" />
+            <div style={{ display: "flex", alignItems: "center", gap: 8, flexWrap: "wrap" }}>
+              <button className="btn btn-secondary" onClick={doRegrade}>↻ Regrade all</button>
+              {regradeErr && <span className="text-danger text-sm">{regradeErr}</span>}
+            </div>
+          </>
+        )}
+
+        {hasUnfinished && (
+          <>
+            <div className="action-sep" />
+            <div style={{ display: "flex", alignItems: "center", gap: 8, flexWrap: "wrap" }}>
+              <button className="btn btn-secondary" onClick={doRetryFailed}>⟳ Retry failed</button>
+              {retryMsg && <span className="text-muted text-sm">{retryMsg}</span>}
+            </div>
+          </>
+        )}
       </div>
 
+      {/* Background jobs */}
+      {jobIds.map(id => (
+        <JobProgress
+          key={id}
+          jobId={id}
+          onFinish={() => { load(); onRefresh(); }}
+          onDismiss={() => setJobIds(ids => ids.filter(x => x !== id))}
+        />
+      ))}
+
       {/* Tabs */}
       <div className="tabs-bar">
         <button className={`tab-btn ${tab === "submissions" ? "active" : ""}`} onClick={() => setTab("submissions")}>
@@ -215,6 +515,12 @@ function ExamDetail({ exam, onBack, onRefresh }) {
             ? <span className="tab-badge warn">{flags.length}</span>
             : <span className="tab-badge">{flags.length}</span>}
         </button>
+        <button className={`tab-btn ${tab === "solution" ? "active" : ""}`} onClick={() => setTab("solution")}>
+          Solution
+        </button>
+        <button className={`tab-btn ${tab === "import" ? "active" : ""}`} onClick={() => setTab("import")}>
+          Import scans
+        </button>
       </div>
 
       {/* Submissions tab */}
@@ -249,6 +555,8 @@ function ExamDetail({ exam, onBack, onRefresh }) {
                           <span className={`badge ${s.status === "GRADED" ? "badge-success" : "badge-muted"}`}>
                             {s.status}
                           </span>
+                          {s.failed_stage &&
+                            <div className="text-danger text-sm">failed at {s.failed_stage}</div>}
                         </td>
                         <td>
                           {s.grade_total !== null
@@ -265,11 +573,27 @@ function ExamDetail({ exam, onBack, onRefresh }) {
                               {expandedSub === s.submission_id ? "▲ Hide" : "▼ Details"}
                             </button>
                           )}
+                          {s.failed_stage && (
+                            <button
+                              className="btn btn-ghost text-sm"
+                              onClick={() => doRetrySub(s.submission_id)}
+                              disabled={retrying === s.submission_id}
+                            >
+                              {retrying === s.submission_id ? "Retrying…" : "⟳ Retry"}
+                            </button>
+                          )}
+                          {rowErr[s.submission_id] &&
+                            <div className="text-danger text-sm">{rowErr[s.submission_id]}</div>}
                         </td>
                       </tr>
                       {expandedSub === s.submission_id && subDetail[s.submission_id] && (
                         <tr key={`${s.submission_id}-detail`}>
                           <td colSpan={7} style={{ padding: "16px 14px", background: "var(--surface2)" }}>
+                            {subDetail[s.submission_id].pages?.length > 0 && (
+                              <div style={{ marginBottom: 16 }}>
+                                <PageStrip pages={subDetail[s.submission_id].pages} />
+                              </div>
+                            )}
                             <Breakdown breakdown={subDetail[s.submission_id].breakdown} />
                           </td>
                         </tr>
@@ -281,6 +605,14 @@ function ExamDetail({ exam, onBack, onRefresh }) {
             </div>
       )}
 
+      {/* Solution tab */}
+      {tab === "solution" && <SolutionPages examId={exam.id} version={solutionVersion} />}
+
+      {/* Import tab */}
+      {tab === "import" && (
+        <ImportScans examId={exam.id} hasSolution={exam.has_solution} onStarted={trackJob} />
+      )}
+
       {/* Academic integrity tab */}
       {tab === "integrity" && (
         flags.length === 0
@@ -98,11 +98,29 @@ function GradeNum({ total }) {
 
 // ── History item ──────────────────────────────────────────────────────────────
 
+const FINAL_STATUSES = ["GRADED", "FAILED"];
+
 function HistoryItem({ sub }) {
-  const [open, setOpen] = useState(false);
+  const [open, setOpen]     = useState(false);
+  const [detail, setDetail] = useState(null);
+  const [err, setErr]       = useState("");
+
+  const load = async () => {
+    setErr("");
+    try { setDetail(await api.getMySubmissionDetail(sub.submission_id)); }
+    catch (e) { setErr(e?.response?.data?.detail || "Could not load the breakdown"); }
+  };
+
+  const toggle = () => {
+    if (open) { setOpen(false); return; }
+    setOpen(true);
+    // A submission still being graded may have finished since it was last opened
+    if (!detail || !FINAL_STATUSES.includes(detail.status)) { setDetail(null); load(); }
+  };
+
   return (
     <div className="history-item">
-      <div className="history-head" onClick={() => setOpen(v => !v)}>
+      <div className="history-head" onClick={toggle}>
         <div>
           <div className="history-exam">{sub.exam_title}</div>
           <div className="history-date">{new Date(sub.submitted_at).toLocaleString()}</div>
@@ -114,7 +132,16 @@ function HistoryItem({ sub }) {
       </div>
       {open && (
         <div className="history-body">
-          <Breakdown breakdown={sub.breakdown} />
+          {err
+            ? <div className="alert alert-error">
+                {err}{" "}
+                <button className="btn btn-ghost text-sm" onClick={load}>Retry</button>
+              </div>
+            : !detail
+              ? <p className="text-muted text-sm">Loading…</p>
+              : FINAL_STATUSES.includes(detail.status)
+                ? <Breakdown breakdown={detail.breakdown} />
+                : <p className="text-muted text-sm">⏳ Still grading — reopen to check again.</p>}
         </div>
       )}
     </div>
@@ -132,6 +159,7 @@ export default function Student() {
   const [result, setResult]         = useState(null);
   const [err, setErr]               = useState("");
   const [submitting, setSubmitting] = useState(false);
+  const [progress, setProgress]     = useState(null);
 
   const loadOpen = useCallback(async () => {
     try { setOpenExams(await api.listOpenExams()); } catch {}
@@ -144,16 +172,20 @@ export default function Student() {
   useEffect(() => { loadOpen(); loadHistory(); }, [loadOpen, loadHistory]);
 
   const submit = async () => {
-    setErr(""); setResult(null); setSubmitting(true);
+    setErr(""); setResult(null); setSubmitting(true); setProgress(null);
     try {
-      const r = await api.submitPdf(selected.id, pdf);
-      setResult(r);
+      const last = await api.submitPdfStream(selected.id, pdf, (ev) => {
+        if (ev.event === "question")
+          setProgress({ graded: ev.graded, questions: ev.questions, total: ev.running_total });
+      });
+      if (last?.event === "error") throw { response: { data: { detail: last.detail } } };
+      setResult(last);  // "grade", or "queued" (has queued: true)
       setPdf(null); setSelected(null);
       loadOpen(); loadHistory();
       setTab("submit"); // stay on submit tab to show result
     } catch (e) {
       setErr(e?.response?.data?.detail || "Submission failed");
-    } finally { setSubmitting(false); }
+    } finally { setSubmitting(false); setProgress(null); }
   };
 
   return (
@@ -173,7 +205,14 @@ export default function Student() {
       {tab === "submit" && (
         <div>
           {/* Grade result */}
-          {result && (
+          {result?.queued && (
+            <div className="alert alert-success mb-16" style={{ marginBottom: 24 }}>
+              {result.deferred_until
+                ? "Your exam was submitted before the deadline. Grading is busy, so it will be graded right after the deadline — check My Grades then."
+                : "Your exam was submitted and is queued for grading — check My Grades shortly."}
+            </div>
+          )}
+          {result && !result.queued && (
             <div className="card mb-16" style={{ marginBottom: 24 }}>
               <div className="alert alert-success mb-16">Your exam was submitted and graded.</div>
               <GradeNum total={result.grade_total} />
@@ -251,7 +290,9 @@ export default function Student() {
 
                   {submitting && (
                     <div className="alert alert-info mb-16">
-                      ⏳ Grading in progress — this takes 20–60 seconds. Please wait…
+                      {progress
+                        ? `⏳ Graded ${progress.graded} of ${progress.questions} questions — ${progress.total} pts so far…`
+                        : "⏳ Grading in progress — this takes 20–60 seconds. Please wait…"}
                     </div>
                   )}
 